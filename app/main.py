@@ -4,25 +4,53 @@ from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from loguru import logger
 
+from .server.admin import router as admin_router
+from .server.batch import BatchRunner
+from .server.batch import router as batch_router
 from .server.chat import router as chat_router
+from .server.handoff import close_handoff_client
 from .server.health import router as health_router
-from .server.middleware import add_cors_middleware, add_exception_handler
+from .server.middleware import (
+    add_access_log_middleware,
+    add_capture_middleware,
+    add_cors_middleware,
+    add_exception_handler,
+)
 from .services.pool import GeminiClientPool
+from .services.replication import ChangeFeedPuller
+from .utils import g_config
+from .utils.workers import worker_index
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
         pool = GeminiClientPool()
-        await pool.init()
+        if not g_config.gemini.lazy_init:
+            await pool.init()
     except Exception as e:
         logger.exception(f"Failed to initialize Gemini clients: {e}")
         raise
 
-    logger.success(f"Gemini clients initialized: {[c.id for c in pool.clients]}.")
+    if g_config.gemini.lazy_init:
+        logger.success(f"Gemini clients will be initialized on first use: {list(pool.status())}.")
+    else:
+        logger.success(f"Gemini clients initialized: {[c.id for c in pool.clients]}.")
+
+    BatchRunner().resume()
+    # Workers share the LMDB environment, a single one follows the peers
+    if worker_index() == 0:
+        ChangeFeedPuller().start()
+
     logger.success("Gemini API Server ready to serve requests.")
     yield
 
+    await BatchRunner().shutdown()
+    await ChangeFeedPuller().shutdown()
+    if g_config.gemini.persist_session:
+        pool.save_state()
+    await close_handoff_client()
+
 
 def create_app() -> FastAPI:
     app = FastAPI(
@@ -35,24 +63,31 @@ def create_app() -> FastAPI:
     # 添加根路径端点
     @app.get("/")
     async def root():
-        return JSONResponse({
-            "message": "Gemini FastAPI Server",
-            "description": "OpenAI-compatible API for Gemini Web",
-            "version": "1.0.0",
-            "endpoints": {
-                "health": "/health",
-                "models": "/v1/models",
-                "chat": "/v1/chat/completions",
-                "docs": "/docs",
-                "openapi": "/openapi.json"
-            },
-            "status": "running"
-        })
+        return JSONResponse(
+            {
+                "message": "Gemini FastAPI Server",
+                "description": "OpenAI-compatible API for Gemini Web",
+                "version": "1.0.0",
+                "endpoints": {
+                    "health": "/health",
+                    "models": "/v1/models",
+                    "chat": "/v1/chat/completions",
+                    "batches": "/v1/batches",
+                    "docs": "/docs",
+                    "openapi": "/openapi.json",
+                },
+                "status": "running",
+            }
+        )
 
     add_cors_middleware(app)
+    add_access_log_middleware(app)
+    add_capture_middleware(app)
     add_exception_handler(app)
 
     app.include_router(health_router, tags=["Health"])
     app.include_router(chat_router, tags=["Chat"])
+    app.include_router(batch_router, tags=["Batch"])
+    app.include_router(admin_router, tags=["Admin"])
 
     return app
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Dict, List, Literal, Optional, Union
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class ContentItem(BaseModel):
@@ -20,6 +20,10 @@ class Message(BaseModel):
     content: Union[str, List[ContentItem]]
     name: Optional[str] = None
 
+    # Cached by the conversation store, messages are never modified once parsed
+    _digest: Optional[str] = PrivateAttr(default=None)
+    _external: Optional[Tuple["Message", Dict[str, str]]] = PrivateAttr(default=None)
+
 
 class Choice(BaseModel):
     """Choice model"""
@@ -101,3 +105,39 @@ class ConversationInStore(BaseModel):
         ..., description="Metadata for Gemini API to locate the conversation"
     )
     messages: list[Message] = Field(..., description="Message contents in the conversation")
+    parent_metadata: Optional[list[str | None]] = Field(
+        default=None,
+        description="Metadata of the session before the last turn, from which a regenerated or "
+        "edited last turn branches",
+    )
+
+
+class ConversationSummary(BaseModel):
+    """Summary of a stored conversation, listed without decoding its history."""
+
+    key: str
+    client_id: str
+    model: str
+    messages: int
+    size: int
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class ConversationListResponse(BaseModel):
+    """Page of conversation summaries"""
+
+    object: str = "list"
+    data: List[ConversationSummary]
+    next_cursor: Optional[str] = None
+
+
+class ConversationDeleteRequest(BaseModel):
+    """Bulk delete request, by keys or by filters"""
+
+    keys: Optional[List[str]] = None
+    client_id: Optional[str] = None
+    model: Optional[str] = None
+    older_than: Optional[int] = Field(
+        default=None, ge=0, description="Only delete conversations idle for more seconds"
+    )
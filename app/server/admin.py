@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from loguru import logger
+
+from ..models import (
+    ConversationDeleteRequest,
+    ConversationInStore,
+    ConversationListResponse,
+    ConversationSummary,
+)
+from ..services import CompactionUnsupported, get_conversation_store
+from ..utils import g_config
+from .middleware import verify_admin_key
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(verify_admin_key)])
+
+# Number of conversations deleted per write transaction
+_DELETE_CHUNK = 500
+
+
+def _threshold(seconds: Optional[int]) -> Optional[datetime]:
+    return datetime.now() - timedelta(seconds=seconds) if seconds is not None else None
+
+
+@router.get("/changes")
+async def list_changes(
+    since: int = Query(default=0, ge=0, description="Sequence number of the last change seen"),
+    limit: int = Query(default=500, ge=1, le=10000),
+):
+    """
+    Read the change feed of the conversation store as JSON lines, in sequence order.
+    The `X-Last-Sequence` header holds the sequence number of the latest change.
+    """
+    if not g_config.replication.enabled:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Replication is disabled")
+
+    db = get_conversation_store()
+    body = b"".join(orjson.dumps(change) + b"\n" for change in db.iter_changes(since, limit))
+    return Response(
+        content=body,
+        media_type="application/x-ndjson",
+        headers={"X-Last-Sequence": str(db.last_sequence())},
+    )
+
+
+@router.post("/compact")
+async def compact_store():
+    """
+    Rewrite the conversation store without its free pages, returning the disk space
+    left behind by deletions and evictions to the filesystem.
+    """
+    try:
+        return await asyncio.to_thread(get_conversation_store().compact)
+    except CompactionUnsupported as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.get("/conversations", response_model=ConversationListResponse)
+async def list_conversations(
+    cursor: Optional[str] = Query(default=None, description="Cursor of the previous page"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    client_id: Optional[str] = None,
+    model: Optional[str] = None,
+    older_than: Optional[int] = Query(
+        default=None, ge=0, description="Only list conversations idle for more seconds"
+    ),
+    newer_than: Optional[int] = Query(
+        default=None, ge=0, description="Only list conversations updated in the last seconds"
+    ),
+):
+    """
+    List stored conversations in key order. A page may hold fewer than `limit` items
+    when filters are used, keep following `next_cursor` until it is null.
+    """
+    try:
+        summaries, next_cursor = get_conversation_store().list_conversations(
+            cursor=cursor,
+            limit=limit,
+            client_id=client_id,
+            model=model,
+            updated_before=_threshold(older_than),
+            updated_after=_threshold(newer_than),
+        )
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return ConversationListResponse(
+        data=[ConversationSummary.model_validate(s) for s in summaries],
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/conversations/{key}", response_model=ConversationInStore)
+async def get_conversation(key: str):
+    db = get_conversation_store()
+    if not (conv := db.get(key)):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Conversation {key} not found")
+    return db.load_attachments(conv)
+
+
+@router.delete("/conversations/{key}")
+async def delete_conversation(key: str):
+    if not get_conversation_store().delete(key):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Conversation {key} not found")
+    return {"deleted": 1}
+
+
+@router.post("/conversations/delete")
+async def delete_conversations(request: ConversationDeleteRequest):
+    """Delete conversations by keys, or every conversation matching the filters."""
+    db = get_conversation_store()
+
+    if request.keys is not None:
+        deleted = 0
+        for i in range(0, len(request.keys), _DELETE_CHUNK):
+            deleted += db.delete_many(request.keys[i : i + _DELETE_CHUNK])
+            await asyncio.sleep(0)
+        return {"deleted": deleted}
+
+    if request.client_id is None and request.model is None and request.older_than is None:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail="Provide keys or at least one of client_id, model and older_than",
+        )
+
+    # Delete page by page, yielding to the event loop between write transactions
+    deleted = 0
+    cursor = None
+    updated_before = _threshold(request.older_than)
+    while True:
+        summaries, cursor = db.list_conversations(
+            cursor=cursor,
+            limit=_DELETE_CHUNK,
+            client_id=request.client_id,
+            model=request.model,
+            updated_before=updated_before,
+        )
+        if summaries:
+            deleted += db.delete_many([s["key"] for s in summaries])
+        if cursor is None:
+            break
+        await asyncio.sleep(0)
+
+    logger.info(f"Deleted {deleted} conversations through the admin API")
+    return {"deleted": deleted}
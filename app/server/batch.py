@@ -0,0 +1,404 @@
+import asyncio
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from gemini_webapi.constants import Model
+from loguru import logger
+from pydantic import ValidationError
+
+from ..models import ChatCompletionRequest
+from ..services import GeminiClientWrapper, get_conversation_store
+from ..services.quota import is_rate_limit_error
+from ..services.scheduler import DEFAULT_TENANT
+from ..utils import g_config
+from ..utils.singleton import Singleton
+from ..utils.workers import worker_index
+from .chat import create_standard_response, find_reusable_conversation, generate_chat_output
+from .middleware import verify_api_key
+
+router = APIRouter()
+
+# Batches in these states are picked up again after a restart
+_RESUMABLE_STATUSES = ("validating", "in_progress")
+_TERMINAL_STATUSES = ("completed", "cancelled", "failed")
+
+# Field recording when a batch reached each terminal status
+_FINISHED_AT = {"completed": "completed_at", "cancelled": "cancelled_at", "failed": "failed_at"}
+
+# Seconds between two sweeps of the expired batches
+_EXPIRY_INTERVAL = 3600
+
+
+class AccountPacer:
+    """Enforce a minimum interval between requests sent by the same account."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._next_slot: Dict[str, float] = {}
+
+    async def wait(self, client: GeminiClientWrapper) -> None:
+        """Reserve the next send slot of the client and sleep until it is reached."""
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(client.id, 0.0))
+        self._next_slot[client.id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class BatchRunner(metaclass=Singleton):
+    """Process stored batches concurrently across the client pool."""
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        self._pacer = AccountPacer(g_config.batch.account_interval)
+        self._expiry_task: Optional[asyncio.Task] = None
+
+    def start(self, batch_id: str) -> None:
+        """Start processing a batch in the background."""
+        if (task := self._tasks.get(batch_id)) and not task.done():
+            return
+        self._tasks[batch_id] = asyncio.create_task(self._run(batch_id))
+
+    def resume(self) -> None:
+        """Restart the unfinished batches owned by this worker, and finalize cancelled ones."""
+        db = get_conversation_store()
+        for batch in db.list_batches():
+            if batch.get("worker", 0) != worker_index():
+                continue
+            if batch["status"] == "cancelling":
+                # The worker stopped before the cancellation was over
+                batch["status"] = "cancelled"
+                batch["cancelled_at"] = int(time.time())
+                db.save_batch(batch)
+            elif batch["status"] in _RESUMABLE_STATUSES:
+                logger.info(f"Resuming batch {batch['id']}")
+                self.start(batch["id"])
+
+        if g_config.batch.retention and self._expiry_task is None:
+            self._expiry_task = asyncio.create_task(self._expire_loop())
+
+    async def _expire_loop(self) -> None:
+        """Periodically delete the finished batches past `batch.retention`."""
+        while True:
+            try:
+                await self.expire()
+            except Exception as e:
+                logger.error(f"Failed to delete expired batches: {e}")
+            await asyncio.sleep(min(_EXPIRY_INTERVAL, g_config.batch.retention))
+
+    async def expire(self) -> int:
+        """Delete the finished batches of this worker past `batch.retention`, return how many."""
+        db = get_conversation_store()
+        threshold = time.time() - g_config.batch.retention
+        expired = [
+            batch["id"]
+            for batch in db.list_batches()
+            if batch["status"] in _TERMINAL_STATUSES
+            and batch.get("worker", 0) == worker_index()
+            and (batch.get(_FINISHED_AT[batch["status"]]) or batch["created_at"]) < threshold
+        ]
+        for batch_id in expired:
+            # Inputs and results of large batches take a while to delete
+            await asyncio.to_thread(db.delete_batch, batch_id)
+        if expired:
+            logger.info(f"Deleted {len(expired)} expired batches")
+        return len(expired)
+
+    def cancel(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Request the cancellation of a batch."""
+        db = get_conversation_store()
+        batch = self._batches.get(batch_id) or db.get_batch(batch_id)
+        if not batch:
+            return None
+        if batch["status"] not in _TERMINAL_STATUSES:
+            batch["status"] = "cancelling"
+            db.save_batch(batch)
+        if task := self._tasks.get(batch_id):
+            task.cancel()
+        return batch
+
+    async def shutdown(self) -> None:
+        """Stop every running batch, leaving them resumable."""
+        if self._expiry_task:
+            self._expiry_task.cancel()
+            self._expiry_task = None
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, batch_id: str) -> None:
+        db = get_conversation_store()
+        batch = db.get_batch(batch_id)
+        if not batch:
+            return
+        self._batches[batch_id] = batch
+
+        done = {index for index, _ in db.iter_batch_results(batch_id)}
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = batch.get("in_progress_at") or int(time.time())
+        db.save_batch(batch)
+
+        semaphore = asyncio.Semaphore(batch["concurrency"])
+        pending: set[asyncio.Task] = set()
+        try:
+            for index, line in db.iter_batch_inputs(batch_id):
+                if index in done:
+                    continue
+                await semaphore.acquire()
+
+                # The cancellation may have been requested by another worker
+                stored = db.get_batch(batch_id)
+                if stored and stored["status"] == "cancelling":
+                    batch["status"] = "cancelling"
+                    semaphore.release()
+                    break
+
+                task = asyncio.create_task(self._process(batch, index, line))
+                task.add_done_callback(lambda _: semaphore.release())
+                task.add_done_callback(pending.discard)
+                pending.add(task)
+
+            await asyncio.gather(*pending)
+        except BaseException as e:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if batch["status"] == "cancelling":
+                batch["status"] = "cancelled"
+                batch["cancelled_at"] = int(time.time())
+                db.save_batch(batch)
+            elif not isinstance(e, asyncio.CancelledError):
+                # Left in progress, the batch would only be picked up again after a restart
+                logger.opt(exception=e).error(f"Batch {batch_id} failed")
+                batch["status"] = "failed"
+                batch["failed_at"] = int(time.time())
+                db.save_batch(batch)
+            raise
+        finally:
+            self._batches.pop(batch_id, None)
+
+        if batch["status"] == "cancelling":
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+        else:
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+        db.save_batch(batch)
+        logger.info(f"Batch {batch_id} {batch['status']}: {batch['request_counts']}")
+
+    async def _process(self, batch: Dict[str, Any], index: int, line: bytes) -> None:
+        """Run one batch request and checkpoint its result."""
+        custom_id = f"request-{index}"
+        request_id = f"batch_req_{uuid.uuid4().hex}"
+        try:
+            item = orjson.loads(line)
+            custom_id = item.get("custom_id") or custom_id
+            request = ChatCompletionRequest.model_validate(item.get("body", item))
+            model = Model.from_name(request.model)
+            if not request.messages:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="At least one message is required in the conversation.",
+                )
+
+            old_conv = find_reusable_conversation(model, request.messages)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                model_output, model_input = await generate_chat_output(
+                    request,
+                    model,
+                    Path(tmp_dir),
+                    old_conv,
+                    before_send=self._pacer.wait,
+                    tenant=batch.get("tenant", DEFAULT_TENANT),
+                )
+
+            body = create_standard_response(
+                [model_output],
+                f"chatcmpl-{uuid.uuid4()}",
+                int(time.time()),
+                request.model,
+                model_input,
+            )
+            result = {
+                "id": request_id,
+                "custom_id": custom_id,
+                "response": {"status_code": 200, "request_id": request_id, "body": body},
+                "error": None,
+            }
+            batch["request_counts"]["completed"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, HTTPException):
+                status_code, message = e.status_code, str(e.detail)
+            elif is_rate_limit_error(e):
+                status_code = status.HTTP_429_TOO_MANY_REQUESTS
+                message = str(e) or type(e).__name__
+            elif isinstance(e, (ValueError, ValidationError)):
+                status_code, message = status.HTTP_400_BAD_REQUEST, str(e)
+            else:
+                status_code, message = status.HTTP_500_INTERNAL_SERVER_ERROR, str(e)
+            result = {
+                "id": request_id,
+                "custom_id": custom_id,
+                "response": {
+                    "status_code": status_code,
+                    "request_id": request_id,
+                    "body": {"error": {"message": message}},
+                },
+                "error": {"message": message},
+            }
+            batch["request_counts"]["failed"] += 1
+
+        get_conversation_store().save_batch_result(batch, index, orjson.dumps(result))
+
+
+def _parse_batch(body: bytes) -> List[bytes]:
+    """
+    Split a JSONL batch body into its request lines, validating each of them.
+
+    Raises:
+        HTTPException: 400 if the batch is empty, too large, or has an invalid line
+    """
+    lines = [line for line in body.splitlines() if line.strip()]
+    if not lines:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Batch input is empty")
+    if len(lines) > g_config.batch.max_requests:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch exceeds the limit of {g_config.batch.max_requests} requests",
+        )
+
+    for number, line in enumerate(lines, start=1):
+        try:
+            item = orjson.loads(line)
+            if item.get("url", "/v1/chat/completions") != "/v1/chat/completions":
+                raise ValueError(f"Unsupported url: {item['url']}")
+            ChatCompletionRequest.model_validate(item.get("body", item))
+        except (orjson.JSONDecodeError, ValueError, AttributeError) as e:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST, detail=f"Invalid request on line {number}: {e}"
+            )
+    return lines
+
+
+@router.post("/v1/batches")
+async def create_batch(
+    raw_request: Request,
+    concurrency: Optional[int] = Query(default=None, ge=1),
+    tenant: str = Depends(verify_api_key),
+):
+    """
+    Create a batch from a JSONL body, each line being either an OpenAI batch request
+    (`custom_id`, `method`, `url`, `body`) or a bare chat completion request.
+    """
+    # Validating and storing up to `batch.max_requests` lines would stall the event loop
+    lines = await asyncio.to_thread(_parse_batch, await raw_request.body())
+
+    batch = {
+        "id": f"batch_{uuid.uuid4().hex}",
+        "object": "batch",
+        "endpoint": "/v1/chat/completions",
+        "status": "validating",
+        "created_at": int(time.time()),
+        "in_progress_at": None,
+        "completed_at": None,
+        "cancelled_at": None,
+        "failed_at": None,
+        "concurrency": concurrency or g_config.batch.concurrency,
+        "worker": worker_index(),
+        "tenant": tenant,
+        "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+    }
+    await asyncio.to_thread(get_conversation_store().save_batch, batch, lines)
+    BatchRunner().start(batch["id"])
+    return batch
+
+
+def _owned_batch(batch_id: str, tenant: str) -> Dict[str, Any]:
+    """
+    Return a batch created by the tenant.
+
+    Raises:
+        HTTPException: 404 if the batch does not exist or belongs to another tenant
+    """
+    batch = get_conversation_store().get_batch(batch_id)
+    if not batch or batch.get("tenant", DEFAULT_TENANT) != tenant:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Batch {batch_id} not found")
+    return batch
+
+
+@router.get("/v1/batches")
+async def list_batches(tenant: str = Depends(verify_api_key)):
+    batches = get_conversation_store().list_batches()
+    return {
+        "object": "list",
+        "data": [b for b in batches if b.get("tenant", DEFAULT_TENANT) == tenant],
+    }
+
+
+@router.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str, tenant: str = Depends(verify_api_key)):
+    return _owned_batch(batch_id, tenant)
+
+
+@router.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, tenant: str = Depends(verify_api_key)):
+    _owned_batch(batch_id, tenant)
+    if not (batch := BatchRunner().cancel(batch_id)):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Batch {batch_id} not found")
+    return batch
+
+
+@router.delete("/v1/batches/{batch_id}")
+async def delete_batch(batch_id: str, tenant: str = Depends(verify_api_key)):
+    """Delete a finished batch with its inputs and results."""
+    batch = _owned_batch(batch_id, tenant)
+    if batch["status"] not in _TERMINAL_STATUSES:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            detail=f"Batch {batch_id} is {batch['status']}, cancel it first",
+        )
+    await asyncio.to_thread(get_conversation_store().delete_batch, batch_id)
+    return {"id": batch_id, "object": "batch.deleted", "deleted": True}
+
+
+@router.get("/v1/batches/{batch_id}/results")
+async def retrieve_batch_results(
+    batch_id: str,
+    follow: bool = Query(default=False, description="Keep streaming until the batch finishes"),
+    tenant: str = Depends(verify_api_key),
+):
+    """Stream the checkpointed results of a batch as JSONL, in input order."""
+    db = get_conversation_store()
+    _owned_batch(batch_id, tenant)
+
+    async def generate_results():
+        if not follow:
+            for _, line in db.iter_batch_results(batch_id):
+                yield line + b"\n"
+            return
+
+        # Emit results in input order, waiting for the gaps to be filled
+        next_index = 0
+        while True:
+            batch = db.get_batch(batch_id)
+            finished = not batch or batch["status"] in _TERMINAL_STATUSES
+            start_after = next_index - 1 if next_index else None
+            for index, line in db.iter_batch_results(batch_id, start_after=start_after):
+                if index != next_index and not finished:
+                    break
+                yield line + b"\n"
+                next_index = index + 1
+            if finished:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(generate_results(), media_type="application/x-ndjson")
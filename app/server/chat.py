@@ -1,10 +1,14 @@
+import asyncio
+import time
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Awaitable, Callable, Optional, TypeVar
 
 import orjson
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from gemini_webapi import ChatSession, ModelOutput
 from gemini_webapi.constants import Model
 from loguru import logger
 
@@ -18,13 +22,35 @@ from ..models import (
 from ..services import (
     GeminiClientPool,
     GeminiClientWrapper,
-    LMDBConversationStore,
+    StorageFull,
+    get_conversation_store,
 )
+from ..services.compaction import compact_conversation
+from ..services.quota import NoClientAvailable
+from ..services.scheduler import DEFAULT_TENANT, FairScheduler
+from ..services.storage import hash_messages
+from ..utils import access_log, capture, deadline, g_config
 from ..utils.helper import estimate_tokens
-from .middleware import get_temp_dir, verify_api_key
+from ..utils.metrics import counter
+from ..utils.workers import owner_of
+from .handoff import forward_to_worker, is_handoff
+from .middleware import get_temp_dir, parse_chat_request, start_deadline, verify_api_key
 
 router = APIRouter()
 
+_hedged = counter("gemini_hedged_requests_total", "New sessions resent to a second client")
+_hedge_wins = counter(
+    "gemini_hedge_wins_total", "Hedged requests answered first by the second client"
+)
+_cancelled = counter(
+    "gemini_cancelled_requests_total", "Requests cancelled because the client disconnected"
+)
+
+# Non-standard status logged for requests abandoned by the client, as nginx does
+CLIENT_CLOSED_REQUEST = 499
+
+T = TypeVar("T")
+
 
 @router.get("/v1/models", response_model=ModelListResponse)
 async def list_models(api_key: str = Depends(verify_api_key)):
@@ -47,14 +73,26 @@ async def list_models(api_key: str = Depends(verify_api_key)):
     return ModelListResponse(data=models)
 
 
-@router.post("/v1/chat/completions")
+@router.post(
+    "/v1/chat/completions",
+    # The body is parsed by `parse_chat_request`, document it as FastAPI would
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": ChatCompletionRequest.model_json_schema()}},
+            "required": True,
+        }
+    },
+)
 async def create_chat_completion(
-    request: ChatCompletionRequest,
-    api_key: str = Depends(verify_api_key),
+    raw_request: Request,
+    # Start the clock before reading the body
+    timeout: Optional[float] = Depends(start_deadline),
+    # Authenticate before parsing the body, which can weigh megabytes
+    tenant: str = Depends(verify_api_key),
+    request: ChatCompletionRequest = Depends(parse_chat_request),
     tmp_dir: Path = Depends(get_temp_dir),
 ):
     pool = GeminiClientPool()
-    db = LMDBConversationStore()
     model = Model.from_name(request.model)
 
     if len(request.messages) == 0:
@@ -63,50 +101,244 @@ async def create_chat_completion(
             detail="At least one message is required in the conversation.",
         )
 
+    n = request.n or 1
+    if not 1 <= n <= g_config.gemini.max_choices:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"n must be between 1 and {g_config.gemini.max_choices}.",
+        )
+
+    access_log.annotate(
+        tenant=tenant, model=request.model, n=n, stream=bool(request.stream), timeout=timeout
+    )
+    with access_log.stage("lookup"):
+        old_conv = find_reusable_conversation(model, request.messages)
+
+    # The conversation belongs to a client managed by another worker
+    if old_conv and not pool.owns(old_conv.client_id) and not is_handoff(raw_request):
+        if (owner := owner_of(old_conv.client_id)) is not None:
+            access_log.annotate(handoff=owner)
+            try:
+                return await cancel_on_disconnect(
+                    raw_request, forward_to_worker(raw_request, owner)
+                )
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to hand off request to worker {owner}: {e}")
+
+    if g_config.logging.capture.enabled:
+        capture.describe(
+            _thread_key(request.messages),
+            request.messages,
+            g_config.logging.capture.sample_rate,
+            model=request.model,
+            n=n,
+            stream=bool(request.stream),
+            timeout=timeout,
+        )
+
+    # Shed the request now rather than queue it when it cannot be answered in time
+    expected = expected_latency(model)
+    deadline.check("admission", expected + FairScheduler().expected_wait(expected))
+
+    if n == 1:
+        model_output, model_input = await cancel_on_disconnect(
+            raw_request, generate_chat_output(request, model, tmp_dir, old_conv, tenant=tenant)
+        )
+        model_outputs = [model_output]
+    else:
+        model_outputs, model_input = await cancel_on_disconnect(
+            raw_request, generate_chat_choices(request, model, tmp_dir, old_conv, n, tenant)
+        )
+
+    capture.annotate(response_chars=[len(output) for output in model_outputs])
+
+    # Return with streaming or standard response
+    completion_id = f"chatcmpl-{uuid.uuid4()}"
+    timestamp = int(datetime.now(tz=timezone.utc).timestamp())
+    if request.stream:
+        return _create_streaming_response(model_outputs, completion_id, timestamp, request.model)
+    else:
+        # Serialize with orjson, skipping the encoder FastAPI runs on plain dicts
+        result = create_standard_response(
+            model_outputs, completion_id, timestamp, request.model, model_input
+        )
+        return Response(orjson.dumps(result), media_type="application/json")
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    """Return once the client has closed the connection."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, coro: Awaitable[T]) -> T:
+    """
+    Await the coroutine, cancelling it if the client disconnects in the meantime.
+
+    The request body has already been read, so the next ASGI message is the disconnect.
+    Cancelling the generation releases the client at once and skips the persistence of
+    a conversation nobody will continue.
+
+    Raises:
+        HTTPException: With status 499 when the client disconnected
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done() and watcher.exception() is not None:
+            # A broken watcher says nothing about the client, let the generation finish
+            logger.warning(f"Failed to watch for client disconnect: {watcher.exception()!r}")
+            return await task
+    finally:
+        if not task.done():
+            task.cancel()
+        watcher.cancel()
+        await asyncio.gather(task, watcher, return_exceptions=True)
+
+    if not task.cancelled():
+        return task.result()
+
+    _cancelled.inc()
+    logger.info("Client disconnected, upstream generation cancelled")
+    raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed request")
+
+
+def expected_latency(model: Model) -> float:
+    """Seconds an upstream call of the model is expected to take, 0 until observed."""
+    pool = GeminiClientPool()
+    return pool.latency.percentile(model.model_name, g_config.deadline.percentile) or 0.0
+
+
+def _thread_key(messages: list[Message]) -> str:
+    """Identify a conversation by its messages up to the first user message."""
+    first_user = next((i for i, m in enumerate(messages) if m.role == "user"), 0)
+    return hash_messages(messages[: first_user + 1])
+
+
+def find_reusable_conversation(
+    model: Model, messages: list[Message]
+) -> Optional[ConversationInStore]:
+    """
+    Look up the stored conversation that the request continues, if any.
+    """
+    if not _check_reusable(messages):
+        return None
+
+    try:
+        # Exclude the last message from user
+        return get_conversation_store().find(model.model_name, messages[:-1])
+    except Exception as e:
+        logger.warning(f"Error checking LMDB for reusable session: {e}")
+        return None
+
+
+async def generate_chat_output(
+    request: ChatCompletionRequest,
+    model: Model,
+    tmp_dir: Path,
+    old_conv: Optional[ConversationInStore] = None,
+    before_send: Optional[Callable[[GeminiClientWrapper], Awaitable[None]]] = None,
+    tenant: str = DEFAULT_TENANT,
+) -> tuple[str, str]:
+    """
+    Generate the assistant reply for a chat request and persist the conversation.
+
+    Args:
+        request: Chat completion request
+        model: Gemini model to use
+        tmp_dir: Directory for temporary attachment files
+        old_conv: Stored conversation to continue, from `find_reusable_conversation`
+        before_send: Optional hook awaited with the chosen client before sending
+        tenant: Name of the API key the generation is scheduled for
+
+    Returns:
+        tuple[str, str]: The model output and the model input
+    """
+    async with FairScheduler().slot(tenant):
+        return await _generate_chat_output(request, model, tmp_dir, old_conv, before_send)
+
+
+async def _generate_chat_output(
+    request: ChatCompletionRequest,
+    model: Model,
+    tmp_dir: Path,
+    old_conv: Optional[ConversationInStore],
+    before_send: Optional[Callable[[GeminiClientWrapper], Awaitable[None]]],
+) -> tuple[str, str]:
+    pool = GeminiClientPool()
+    db = get_conversation_store()
+
     # Check if conversation is reusable
     session = None
     client = None
-    if _check_reusable(request.messages):
+    hedge = False
+    if old_conv and not pool.is_available(old_conv.client_id, model.model_name):
+        # Send the full history to another client rather than wait for the cooldown
+        logger.info(
+            f"Client {old_conv.client_id} is cooling down for {model.model_name}, "
+            "starting a new session"
+        )
+    elif old_conv:
         try:
-            # Exclude the last message from user
-            if old_conv := db.find(model.model_name, request.messages[:-1]):
-                client = pool.acquire(old_conv.client_id)
-                session = client.start_chat(metadata=old_conv.metadata, model=model)
+            client = pool.acquire(old_conv.client_id)
+            session = client.start_chat(metadata=old_conv.metadata, model=model)
         except Exception as e:
             session = None
-            logger.warning(f"Error checking LMDB for reusable session: {e}")
+            logger.warning(f"Error resuming the stored session: {e}")
 
+    reused = session is not None
     if session:
         # Just send the last message to the existing session
-        model_input, files = await GeminiClientWrapper.process_message(
-            request.messages[-1], tmp_dir, tagged=False
-        )
-        logger.debug(f"Found reusable session: {session.metadata}")
+        with access_log.stage("prepare"):
+            model_input, files = await deadline.within(
+                GeminiClientWrapper.process_message(request.messages[-1], tmp_dir, tagged=False),
+                "prepare",
+            )
+        logger.debug("Found reusable session: {}", session.metadata)
     else:
         # Start a new session and concat messages into a single string
         try:
-            client = pool.acquire()
+            client = pool.acquire(model=model.model_name)
             session = client.start_chat(model=model)
-            model_input, files = await GeminiClientWrapper.process_conversation(
-                request.messages, tmp_dir
-            )
+            with access_log.stage("prepare"):
+                model_input, files = await deadline.within(
+                    GeminiClientWrapper.process_conversation(
+                        compact_conversation(request.messages), tmp_dir
+                    ),
+                    "prepare",
+                )
+        except (NoClientAvailable, deadline.DeadlineExceeded):
+            raise
         except ValueError as e:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
         except Exception as e:
             logger.exception(f"Error in preparing conversation: {e}")
             raise
         logger.debug("New session started.")
+        # A new session does not depend on any client, so it can be hedged on another one
+        hedge = g_config.hedging.enabled and before_send is None
 
     # Generate response
     try:
         assert session and client, "Session and client not available"
-        logger.debug(
-            f"Client ID: {client.id}, Input length: {len(model_input)}, files count: {len(files)}"
-        )
-        response = await session.send_message(model_input, files=files)
+        if hedge:
+            client, session, response = await _send_hedged(
+                client, session, model, model_input, files
+            )
+        else:
+            response = await _send(client, session, model, model_input, files, before_send)
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
         logger.exception(f"Error generating content from Gemini API: {e}")
         raise
+    access_log.annotate(client=client.id, reused=reused)
+    capture.annotate(reused=reused)
 
     # Format the response from API
     model_output = GeminiClientWrapper.extract_output(response, include_thoughts=True)
@@ -121,22 +353,155 @@ async def create_chat_completion(
             client_id=client.id,
             metadata=session.metadata,
             messages=[*cleaned_history, last_message],
+            # The turn can be regenerated from the session it continued
+            parent_metadata=old_conv.metadata if reused and old_conv else None,
         )
-        key = db.store(conv)
-        logger.debug(f"Conversation saved to LMDB with key: {key}")
+        # Also index the history as the client will send it back, i.e. with the thoughts
+        visible = [*request.messages, Message(role="assistant", content=model_output)]
+        with access_log.stage("store"):
+            try:
+                key = db.store(conv, visible_messages=visible)
+            except StorageFull:
+                await asyncio.to_thread(db.make_room)
+                key = db.store(conv, visible_messages=visible)
+        logger.debug("Conversation saved to LMDB with key: {}", key)
     except Exception as e:
         # We can still return the response even if saving fails
         logger.warning(f"Failed to save conversation to LMDB: {e}")
 
-    # Return with streaming or standard response
-    completion_id = f"chatcmpl-{uuid.uuid4()}"
-    timestamp = int(datetime.now(tz=timezone.utc).timestamp())
-    if request.stream:
-        return _create_streaming_response(model_output, completion_id, timestamp, request.model)
-    else:
-        return _create_standard_response(
-            model_output, completion_id, timestamp, request.model, model_input
+    return model_output, model_input
+
+
+async def _send(
+    client: GeminiClientWrapper,
+    session: ChatSession,
+    model: Model,
+    model_input: str,
+    files: list,
+    before_send: Optional[Callable[[GeminiClientWrapper], Awaitable[None]]] = None,
+) -> ModelOutput:
+    """Send the prompt on the session, recording the outcome and latency of the client."""
+    pool = GeminiClientPool()
+    await deadline.within(pool.ensure_ready(client), "init")
+    await pool.pace(client)
+    if before_send:
+        await before_send(client)
+    # The request may have waited for a slot and a token since it was admitted
+    deadline.check("upstream", expected_latency(model))
+    logger.debug(
+        "Client ID: {}, Input length: {}, files count: {}", client.id, len(model_input), len(files)
+    )
+
+    started = time.monotonic()
+    try:
+        with pool.busy(client):
+            response = await deadline.within(
+                session.send_message(model_input, files=files), "upstream"
+            )
+    except deadline.DeadlineExceeded:
+        # The account did nothing wrong, do not count it against its quota
+        raise
+    except Exception as e:
+        pool.report_failure(client, model.model_name, e)
+        raise
+    pool.report_success(client, model.model_name)
+    elapsed = time.monotonic() - started
+    pool.latency.observe(model.model_name, elapsed)
+    access_log.add_stage("upstream", elapsed)
+    capture.annotate(upstream_ms=round(elapsed * 1000, 3))
+    return response
+
+
+async def _send_hedged(
+    client: GeminiClientWrapper,
+    session: ChatSession,
+    model: Model,
+    model_input: str,
+    files: list,
+) -> tuple[GeminiClientWrapper, ChatSession, ModelOutput]:
+    """
+    Send a new session, and resend it on another idle client if no reply arrived within
+    the hedging delay. The first successful reply wins and the other call is cancelled,
+    so that only the session of the winner is persisted.
+
+    Returns:
+        tuple: The client and session which produced the reply, and the reply
+    """
+    pool = GeminiClientPool()
+    attempts = {
+        asyncio.create_task(_send(client, session, model, model_input, files)): (client, session)
+    }
+    primary = next(iter(attempts))
+    try:
+        delay = pool.latency.hedge_delay(model.model_name)
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done and (backup := pool.acquire_idle(model.model_name, exclude=client.id)):
+            backup_session = backup.start_chat(model=model)
+            task = asyncio.create_task(_send(backup, backup_session, model, model_input, files))
+            attempts[task] = (backup, backup_session)
+            _hedged.inc()
+            logger.debug("Hedging request of client {} on client {}", client.id, backup.id)
+
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        _hedge_wins.inc()
+                    return (*attempts[task], task.result())
+
+        # Every attempt failed, report the error of the first client
+        return (client, session, primary.result())
+    finally:
+        for task in attempts:
+            task.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+
+
+async def generate_chat_choices(
+    request: ChatCompletionRequest,
+    model: Model,
+    tmp_dir: Path,
+    old_conv: Optional[ConversationInStore],
+    n: int,
+    tenant: str = DEFAULT_TENANT,
+) -> tuple[list[str], str]:
+    """
+    Generate `n` independent choices in parallel.
+
+    A reusable conversation can only be continued by the client that owns it, so every
+    choice then branches from the same stored session. Otherwise each choice starts a new
+    session on the next client of the round-robin, spreading the fan-out across the pool.
+    Every choice is persisted, so that the conversation can be continued from any of them.
+    Each choice takes its own generation slot of the tenant.
+
+    Returns:
+        tuple[list[str], str]: The model outputs ordered by choice index and the model input
+    """
+    choice_dirs = []
+    for index in range(n):
+        choice_dir = tmp_dir / f"choice-{index}"
+        choice_dir.mkdir(exist_ok=True)
+        choice_dirs.append(choice_dir)
+
+    tasks = [
+        asyncio.create_task(
+            generate_chat_output(request, model, choice_dir, old_conv, tenant=tenant)
         )
+        for choice_dir in choice_dirs
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # Do not leave the other generations running once the request has failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    logger.debug("Generated {} choices in parallel", n)
+    return [model_output for model_output, _ in results], results[0][1]
 
 
 def _check_reusable(messages: list[Message]) -> bool:
@@ -158,55 +523,63 @@ def _check_reusable(messages: list[Message]) -> bool:
 
 
 def _create_streaming_response(
-    model_output: str, completion_id: str, created_time: int, model: str
+    model_outputs: list[str], completion_id: str, created_time: int, model: str
 ) -> StreamingResponse:
-    """Create streaming response"""
+    """Create streaming response, interleaving the chunks of every choice by index"""
 
-    async def generate_stream():
-        # Send start event
+    def chunk(choices: list[dict]) -> str:
         data = {
             "id": completion_id,
             "object": "chat.completion.chunk",
             "created": created_time,
             "model": model,
-            "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}],
+            "choices": choices,
         }
-        yield f"data: {orjson.dumps(data).decode('utf-8')}\n\n"
+        return f"data: {orjson.dumps(data).decode('utf-8')}\n\n"
+
+    async def generate_stream():
+        # Send start event
+        yield chunk(
+            [
+                {"index": index, "delta": {"role": "assistant"}, "finish_reason": None}
+                for index in range(len(model_outputs))
+            ]
+        )
 
         # Stream output text in chunks for efficiency
         chunk_size = 32
-        for i in range(0, len(model_output), chunk_size):
-            chunk = model_output[i : i + chunk_size]
-            data = {
-                "id": completion_id,
-                "object": "chat.completion.chunk",
-                "created": created_time,
-                "model": model,
-                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
-            }
-            yield f"data: {orjson.dumps(data).decode('utf-8')}\n\n"
+        longest = max(len(model_output) for model_output in model_outputs)
+        for i in range(0, longest, chunk_size):
+            for index, model_output in enumerate(model_outputs):
+                if i < len(model_output):
+                    content = model_output[i : i + chunk_size]
+                    yield chunk(
+                        [{"index": index, "delta": {"content": content}, "finish_reason": None}]
+                    )
 
         # Send end event
-        data = {
-            "id": completion_id,
-            "object": "chat.completion.chunk",
-            "created": created_time,
-            "model": model,
-            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
-        }
-        yield f"data: {orjson.dumps(data).decode('utf-8')}\n\n"
+        yield chunk(
+            [
+                {"index": index, "delta": {}, "finish_reason": "stop"}
+                for index in range(len(model_outputs))
+            ]
+        )
         yield "data: [DONE]\n\n"
 
     return StreamingResponse(generate_stream(), media_type="text/event-stream")
 
 
-def _create_standard_response(
-    model_output: str, completion_id: str, created_time: int, model: str, model_input: str
+def create_standard_response(
+    model_outputs: list[str],
+    completion_id: str,
+    created_time: int,
+    model: str,
+    model_input: str,
 ) -> dict:
     """Create standard response"""
     # Calculate token usage
     prompt_tokens = estimate_tokens(model_input)
-    completion_tokens = estimate_tokens(model_output)
+    completion_tokens = sum(estimate_tokens(model_output) for model_output in model_outputs)
     total_tokens = prompt_tokens + completion_tokens
 
     result = {
@@ -216,10 +589,11 @@ def _create_standard_response(
         "model": model,
         "choices": [
             {
-                "index": 0,
+                "index": index,
                 "message": {"role": "assistant", "content": model_output},
                 "finish_reason": "stop",
             }
+            for index, model_output in enumerate(model_outputs)
         ],
         "usage": {
             "prompt_tokens": prompt_tokens,
@@ -228,5 +602,5 @@ def _create_standard_response(
         },
     }
 
-    logger.debug(f"Response created with {total_tokens} total tokens")
+    logger.debug("Response created with {} total tokens", total_tokens)
     return result
@@ -0,0 +1,66 @@
+from typing import Optional
+
+import httpx
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from loguru import logger
+from starlette.background import BackgroundTask
+
+from ..utils import deadline, g_config
+from ..utils.workers import HANDOFF_HEADER, handoff_port, worker_index
+
+# Hop-by-hop headers which must not be copied between connections
+_SKIPPED_HEADERS = {"host", "content-length", "connection", "transfer-encoding", "keep-alive"}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        # Generation may take minutes, only bound the connection phase
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0))
+    return _client
+
+
+async def close_handoff_client() -> None:
+    """Close the HTTP client used for worker handoff."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def is_handoff(request: Request) -> bool:
+    """Check whether the request was already handed off by another worker."""
+    return HANDOFF_HEADER in request.headers
+
+
+async def forward_to_worker(request: Request, worker: int) -> StreamingResponse:
+    """
+    Replay the request on the loopback listener of the given worker and stream its
+    response back unchanged.
+    """
+    client = _get_client()
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _SKIPPED_HEADERS}
+    headers[HANDOFF_HEADER] = str(worker_index())
+    if (remaining := deadline.remaining()) is not None:
+        # The owning worker gets what is left of the budget, not the original timeout
+        headers[g_config.deadline.header.lower()] = f"{max(remaining, 0.001):.3f}"
+    url = f"http://127.0.0.1:{handoff_port(worker)}{request.url.path}"
+
+    upstream = await client.send(
+        client.build_request("POST", url, content=await request.body(), headers=headers),
+        stream=True,
+    )
+    logger.debug("Request handed off to worker {}, status {}", worker, upstream.status_code)
+
+    response_headers = {
+        k: v for k, v in upstream.headers.items() if k.lower() not in _SKIPPED_HEADERS
+    }
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers=response_headers,
+        background=BackgroundTask(upstream.aclose),
+    )
@@ -1,8 +1,12 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from loguru import logger
 
 from ..models import HealthCheckResponse
-from ..services import GeminiClientPool, LMDBConversationStore
+from ..services import GeminiClientPool, get_conversation_store
+from ..utils import g_config
+from ..utils.metrics import render_metrics
+from .middleware import verify_metrics_key
 
 router = APIRouter()
 
@@ -10,17 +14,20 @@ router = APIRouter()
 @router.get("/health", response_model=HealthCheckResponse)
 async def health_check():
     pool = GeminiClientPool()
-    db = LMDBConversationStore()
+    db = get_conversation_store()
 
-    try:
-        await pool.init()
-    except Exception as e:
-        logger.error(f"Failed to initialize Gemini clients: {e}")
-        return HealthCheckResponse(ok=False, error=str(e))
+    # Lazily initialized clients are not forced to start by health checks
+    lazy = g_config.gemini.lazy_init
+    if not lazy:
+        try:
+            await pool.init()
+        except Exception as e:
+            logger.error(f"Failed to initialize Gemini clients: {e}")
+            return HealthCheckResponse(ok=False, error=str(e))
 
     client_status = pool.status()
 
-    if not all(client_status.values()):
+    if not lazy and not all(client_status.values()):
         logger.warning("One or more Gemini clients not running")
 
     stat = db.stats()
@@ -30,4 +37,14 @@ async def health_check():
             ok=False, error="LMDB conversation store unavailable", clients=client_status
         )
 
-    return HealthCheckResponse(ok=all(client_status.values()), storage=stat, clients=client_status)
+    return HealthCheckResponse(
+        ok=lazy or all(client_status.values()), storage=stat, clients=client_status
+    )
+
+
+@router.get(
+    "/metrics", response_class=PlainTextResponse, dependencies=[Depends(verify_metrics_key)]
+)
+async def metrics():
+    """Expose the counters of this process in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,12 +1,21 @@
+import math
 import tempfile
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Optional
 
 from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import ValidationError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from ..utils import g_config
+from ..models import ChatCompletionRequest
+from ..services.quota import NoClientAvailable, is_rate_limit_error
+from ..services.scheduler import DEFAULT_TENANT
+from ..utils import access_log, capture, deadline, g_config
 
 
 def global_exception_handler(request: Request, exc: Exception):
@@ -16,6 +25,22 @@ def global_exception_handler(request: Request, exc: Exception):
             content={"error": {"message": exc.detail}},
         )
 
+    if isinstance(exc, deadline.DeadlineExceeded):
+        return ORJSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"error": {"message": str(exc)}},
+        )
+
+    if is_rate_limit_error(exc):
+        headers = None
+        if isinstance(exc, NoClientAvailable):
+            headers = {"Retry-After": str(math.ceil(exc.retry_after))}
+        return ORJSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"error": {"message": str(exc) or type(exc).__name__}},
+            headers=headers,
+        )
+
     return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"error": {"message": str(exc)}}
     )
@@ -29,26 +54,167 @@ def get_temp_dir():
         temp_dir.cleanup()
 
 
+async def start_deadline(request: Request) -> Optional[float]:
+    """
+    Start the deadline of the request, from the seconds its caller waits for the response
+    given in the `deadline.header` header, or `deadline.default_timeout`.
+    """
+    header = g_config.deadline.header
+    timeout = g_config.deadline.default_timeout
+    if (value := request.headers.get(header)) is not None:
+        try:
+            timeout = float(value)
+        except ValueError:
+            timeout = None
+        if timeout is None or not timeout > 0:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                detail=f"{header} must be a positive number of seconds",
+            )
+    deadline.start(timeout)
+    return timeout
+
+
+async def parse_chat_request(request: Request) -> ChatCompletionRequest:
+    """
+    Validate the body of a chat request straight from its JSON bytes.
+
+    FastAPI would decode multi-megabyte bodies into Python objects with the standard
+    library first, pydantic parses and validates them in a single pass instead.
+    """
+    try:
+        return ChatCompletionRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        errors = []
+        for error in e.errors(include_url=False):
+            error["loc"] = ("body", *error["loc"])
+            if error["type"] == "json_invalid":
+                # Do not echo a malformed body back, it can weigh megabytes
+                error["input"] = {}
+            errors.append(error)
+        raise RequestValidationError(errors) from e
+
+
+@lru_cache(maxsize=1)
+def _tenants_by_key() -> Dict[str, str]:
+    tenants = {entry.key: entry.name for entry in g_config.server.api_keys}
+    if g_config.server.api_key:
+        tenants[g_config.server.api_key] = DEFAULT_TENANT
+    return tenants
+
+
 def verify_api_key(
     credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
-):
-    if not g_config.server.api_key:
-        return ""
+) -> str:
+    """Authenticate the request and return the name of the tenant owning its API key."""
+    tenants = _tenants_by_key()
+    if not tenants:
+        return DEFAULT_TENANT
 
     if credentials is None or credentials.scheme.lower() != "bearer":
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing token")
 
-    api_key = credentials.credentials
-    if api_key != g_config.server.api_key:
+    if (tenant := tenants.get(credentials.credentials)) is None:
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Wrong API key")
 
-    return api_key
+    return tenant
+
+
+def verify_admin_key(
+    credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
+):
+    if not g_config.server.admin_key:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Admin API is disabled")
+
+    if credentials is None or credentials.scheme.lower() != "bearer":
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing token")
+
+    if credentials.credentials != g_config.server.admin_key:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Wrong admin key")
+
+    return credentials.credentials
+
+
+def verify_metrics_key(
+    credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
+) -> None:
+    """Require the admin key for `/metrics` once one is configured, the endpoint is open otherwise."""
+    if g_config.server.admin_key:
+        verify_admin_key(credentials)
 
 
 def add_exception_handler(app: FastAPI):
     app.add_exception_handler(Exception, global_exception_handler)
 
 
+class AccessLogMiddleware:
+    """Write an access log entry per HTTP request, with the bytes it received and sent."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        entry = access_log.begin(scope["method"], scope["path"])
+
+        async def receive_counted() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                entry["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                entry["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                entry["bytes_out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            access_log.finish(entry, g_config.logging.access_log.sample_rate)
+
+
+def add_access_log_middleware(app: FastAPI):
+    if g_config.logging.access_log.enabled:
+        app.add_middleware(AccessLogMiddleware)
+
+
+class CaptureMiddleware:
+    """Capture the shape and outcome of every chat request, described by the chat route."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] != "/v1/chat/completions":
+            await self.app(scope, receive, send)
+            return
+
+        entry = capture.begin()
+        status: Optional[int] = None
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            capture.finish(entry, status)
+
+
+def add_capture_middleware(app: FastAPI):
+    if g_config.logging.capture.enabled:
+        app.add_middleware(CaptureMiddleware)
+
+
 def add_cors_middleware(app: FastAPI):
     if g_config.cors.enabled:
         cors = g_config.cors
@@ -1,9 +1,23 @@
 from .client import GeminiClientWrapper
 from .lmdb import LMDBConversationStore
+from .memory import MemoryConversationStore
 from .pool import GeminiClientPool
+from .replication import ChangeFeedPuller
+from .storage import (
+    CompactionUnsupported,
+    ConversationStore,
+    StorageFull,
+    get_conversation_store,
+)
 
 __all__ = [
+    "ChangeFeedPuller",
+    "CompactionUnsupported",
+    "ConversationStore",
     "GeminiClientPool",
     "GeminiClientWrapper",
     "LMDBConversationStore",
+    "MemoryConversationStore",
+    "StorageFull",
+    "get_conversation_store",
 ]
@@ -1,7 +1,13 @@
+import asyncio
 import re
+import time
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 from gemini_webapi import GeminiClient, ModelOutput
+from gemini_webapi.constants import Headers
+from gemini_webapi.utils import rotate_tasks
+from httpx import AsyncClient
 
 from ..models import Message
 from ..utils import g_config
@@ -26,6 +32,69 @@ class GeminiClientWrapper(GeminiClient):
 
         await super().init(**kwargs)
 
+    async def resume(self, access_token: str, **kwargs) -> None:
+        """
+        Start the client with a previously obtained access token, skipping the
+        handshake performed by `init`. Mirrors the setup done by `GeminiClient.init`.
+        """
+        kwargs.setdefault("timeout", g_config.gemini.timeout)
+        kwargs.setdefault("auto_refresh", g_config.gemini.auto_refresh)
+        kwargs.setdefault("refresh_interval", g_config.gemini.refresh_interval)
+
+        self.client = AsyncClient(
+            http2=True,
+            timeout=kwargs["timeout"],
+            proxy=self.proxy,
+            follow_redirects=True,
+            headers=Headers.GEMINI.value,
+            cookies=self.cookies,
+            **self.kwargs,
+        )
+        self.access_token = access_token
+        self.timeout = kwargs["timeout"]
+        self.auto_refresh = kwargs["auto_refresh"]
+        self.refresh_interval = kwargs["refresh_interval"]
+        self.running = True
+
+        if task := rotate_tasks.get(self.cookies["__Secure-1PSID"]):
+            task.cancel()
+        if self.auto_refresh:
+            rotate_tasks[self.cookies["__Secure-1PSID"]] = asyncio.create_task(
+                self.start_auto_refresh()
+            )
+
+    def export_state(self) -> Dict[str, Any]:
+        """
+        Export the refreshed cookies and access token so that they can be restored
+        after a restart.
+        """
+        return {
+            "cookies": {k: v for k, v in self.cookies.items()},
+            "access_token": self.access_token,
+            "saved_at": time.time(),
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> Optional[str]:
+        """
+        Restore cookies exported by `export_state`.
+
+        The state is ignored if it belongs to a different account than the configured
+        `__Secure-1PSID`.
+
+        Returns:
+            The persisted access token if it is still within `gemini.session_ttl`
+        """
+        cookies = state.get("cookies") or {}
+        if cookies.get("__Secure-1PSID") != self.cookies.get("__Secure-1PSID"):
+            return None
+
+        self.cookies = {**self.cookies, **cookies}
+
+        age = time.time() - state.get("saved_at", 0)
+        if state.get("access_token") and age < g_config.gemini.session_ttl:
+            return state["access_token"]
+        return None
+
     @staticmethod
     async def process_message(
         message: Message, tempdir: Path | None = None, tagged: bool = True
@@ -0,0 +1,144 @@
+from loguru import logger
+
+from ..models import Message
+from ..utils import g_config
+from ..utils.helper import add_tag, estimate_tokens
+from ..utils.metrics import counter
+
+# Rough cost of one attachment, Gemini bills a typical image as 258 tokens
+ATTACHMENT_TOKENS = 258
+
+_compactions = counter(
+    "gemini_history_compactions_total", "Full-history prompts that exceeded the size limit"
+)
+_checked = counter("gemini_history_checks_total", "Full-history prompts checked for compaction")
+_trimmed_tokens = counter(
+    "gemini_history_trimmed_tokens_total", "Estimated prompt tokens removed by compaction"
+)
+_truncated_messages = counter(
+    "gemini_history_truncated_messages_total", "Older messages truncated by compaction"
+)
+_dropped_messages = counter(
+    "gemini_history_dropped_messages_total", "Older messages dropped by compaction"
+)
+_dropped_attachments = counter(
+    "gemini_history_dropped_attachments_total", "Stale attachments dropped by compaction"
+)
+
+
+def _message_text(message: Message) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(item.text for item in message.content if item.type == "text" and item.text)
+
+
+def _attachment_count(message: Message) -> int:
+    if isinstance(message.content, str):
+        return 0
+    return sum(1 for item in message.content if item.type != "text")
+
+
+def _message_tokens(message: Message) -> int:
+    """Estimate the prompt tokens of a message, including its role tags and attachments."""
+    text = add_tag(message.role, _message_text(message))
+    return estimate_tokens(text) + _attachment_count(message) * ATTACHMENT_TOKENS
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Keep the head and tail of the text, marking how much was cut in between."""
+    if len(text) <= limit:
+        return text
+    head = limit * 2 // 3
+    tail = limit - head
+    cut = len(text) - head - tail
+    return f"{text[:head]}\n[... {cut} characters truncated ...]\n{text[len(text) - tail :]}"
+
+
+def compact_conversation(messages: list[Message]) -> list[Message]:
+    """
+    Cap the estimated size of a conversation sent in full to a new session.
+
+    System messages and the `keep_recent` latest messages are always kept verbatim. When
+    the history exceeds `max_prompt_tokens`, older messages are compacted in steps, each
+    applied from the oldest message on until the history fits:
+
+    1. attachments of older messages are replaced by a placeholder,
+    2. older messages are truncated to `truncate_chars`,
+    3. older messages are dropped, leaving a note of how many were omitted.
+
+    The stored conversation is not affected, only the prompt built from it.
+    """
+    config = g_config.compaction
+    if not config.enabled:
+        return messages
+
+    _checked.inc()
+    costs = [_message_tokens(m) for m in messages]
+    before = total = sum(costs)
+    if total <= config.max_prompt_tokens:
+        return messages
+
+    compacted = list(messages)
+    older = [
+        i for i in range(max(0, len(messages) - config.keep_recent)) if messages[i].role != "system"
+    ]
+
+    def replace(index: int, message: Message) -> None:
+        nonlocal total
+        compacted[index] = message
+        cost = _message_tokens(message)
+        total += cost - costs[index]
+        costs[index] = cost
+
+    # Step 1: drop stale attachments
+    dropped_attachments = 0
+    for i in older:
+        if total <= config.max_prompt_tokens:
+            break
+        if count := _attachment_count(compacted[i]):
+            text = _message_text(compacted[i])
+            note = f"[{count} attachment(s) omitted]"
+            replace(i, Message(role=compacted[i].role, content=f"{text}\n{note}".strip()))
+            dropped_attachments += count
+
+    # Step 2: truncate older messages
+    truncated: set[int] = set()
+    for i in older:
+        if total <= config.max_prompt_tokens:
+            break
+        text = _message_text(compacted[i])
+        if len(text) > config.truncate_chars:
+            replace(
+                i, Message(role=compacted[i].role, content=_truncate(text, config.truncate_chars))
+            )
+            truncated.add(i)
+
+    # Step 3: drop older messages entirely
+    dropped: set[int] = set()
+    for i in older:
+        if total <= config.max_prompt_tokens:
+            break
+        dropped.add(i)
+        total -= costs[i]
+
+    if dropped:
+        note = Message(role="system", content=f"[{len(dropped)} earlier messages omitted]")
+        position = min(dropped)
+        compacted = [
+            note if i == position else m
+            for i, m in enumerate(compacted)
+            if i == position or i not in dropped
+        ]
+        total += _message_tokens(note)
+        truncated -= dropped
+
+    _compactions.inc()
+    _trimmed_tokens.inc(before - total)
+    _truncated_messages.inc(len(truncated))
+    _dropped_messages.inc(len(dropped))
+    _dropped_attachments.inc(dropped_attachments)
+    logger.info(
+        f"Compacted history from ~{before} to ~{total} tokens: {dropped_attachments} attachments "
+        f"omitted, {len(truncated)} messages truncated, {len(dropped)} messages dropped"
+    )
+    return compacted
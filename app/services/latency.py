@@ -0,0 +1,39 @@
+import math
+from collections import deque
+from typing import Dict, Optional
+
+from ..utils import g_config
+
+
+class LatencyTracker:
+    """Sliding window of the upstream latencies observed for each model."""
+
+    def __init__(self) -> None:
+        self._samples: Dict[str, deque[float]] = {}
+
+    def observe(self, model: str, seconds: float) -> None:
+        """Record the duration of a successful upstream call."""
+        if (samples := self._samples.get(model)) is None:
+            samples = self._samples[model] = deque(maxlen=g_config.hedging.window)
+        samples.append(seconds)
+
+    def percentile(self, model: str, pct: float) -> Optional[float]:
+        """Return the given percentile of the recent latencies, None without samples."""
+        samples = self._samples.get(model)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """
+        Return how long to wait for a new session before hedging it on another client,
+        or None while too few latencies were observed to estimate it.
+        """
+        config = g_config.hedging
+        samples = self._samples.get(model)
+        if not samples or len(samples) < config.min_samples:
+            return None
+        delay = self.percentile(model, config.percentile) or config.min_delay
+        return min(config.max_delay, max(config.min_delay, delay))
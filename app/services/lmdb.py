@@ -1,9 +1,12 @@
-import hashlib
-import re
+import os
+import shutil
+import threading
+import time
 from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 import lmdb
 import orjson
@@ -11,33 +14,70 @@ from loguru import logger
 
 from ..models import ConversationInStore, Message
 from ..utils import g_config
+from ..utils.metrics import counter
 from ..utils.singleton import Singleton
+from .storage import ConversationStore, StorageFull, _hash_conversation, local_node_id
 
+# Trim the change feed every this many changes
+_TRIM_INTERVAL = 256
 
-def _hash_message(message: Message) -> str:
-    """Generate a hash for a single message."""
-    # Convert message to dict and sort keys for consistent hashing
-    message_dict = message.model_dump(mode="json")
-    message_bytes = orjson.dumps(message_dict, option=orjson.OPT_SORT_KEYS)
-    return hashlib.sha256(message_bytes).hexdigest()
+# Conversations deleted per write transaction when evicting, so that writers interleave
+_EVICTION_BATCH = 32
 
+# Batch input lines written, or batch records deleted, per write transaction
+_BATCH_CHUNK = 1024
 
-def _hash_conversation(client_id: str, model: str, messages: List[Message]) -> str:
-    """Generate a hash for a list of messages and client id."""
-    # Create a combined hash from all individual message hashes
-    combined_hash = hashlib.sha256()
-    combined_hash.update(client_id.encode("utf-8"))
-    combined_hash.update(model.encode("utf-8"))
-    for message in messages:
-        message_hash = _hash_message(message)
-        combined_hash.update(message_hash.encode("utf-8"))
-    return combined_hash.hexdigest()
+# Compacting copies taken before giving up on a store written during every one of them
+_COMPACT_ATTEMPTS = 5
 
+_evictions = counter(
+    "gemini_storage_evictions_total", "Least recently used conversations evicted from the store"
+)
 
-class LMDBConversationStore(metaclass=Singleton):
+
+def _allocated_bytes(path: Path) -> int:
+    """Disk space used by the data file of an environment, which is sparse with writemap."""
+    try:
+        return (path / "data.mdb").stat().st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+def _other_reader_pids(env: lmdb.Environment) -> Set[int]:
+    """Return the other live processes that have the environment open for reading."""
+    env.reader_check()
+    # One line per reader slot after the header: pid, thread and transaction id
+    pids = {int(line.split()[0]) for line in env.readers().splitlines()[1:] if line.strip()}
+    pids.discard(os.getpid())
+    return pids
+
+
+class LMDBConversationStore(ConversationStore, metaclass=Singleton):
     """LMDB-based storage for Message lists with hash-based key-value operations."""
 
-    HASH_LOOKUP_PREFIX = "hash:"
+    # Named sub-databases
+    CLIENT_STATE_DB = b"client_state"
+    BATCH_DB = b"batches"
+    BATCH_INPUT_DB = b"batch_inputs"
+    BATCH_RESULT_DB = b"batch_results"
+    CONVERSATION_META_DB = b"conversation_meta"
+    CHANGES_DB = b"changes"
+    PEER_CURSOR_DB = b"peer_cursors"
+    BLOB_DB = b"blobs"
+    BLOB_REF_DB = b"blob_refs"
+    ACCESS_DB = b"last_access"
+    SUB_DATABASES = (
+        CLIENT_STATE_DB,
+        BATCH_DB,
+        BATCH_INPUT_DB,
+        BATCH_RESULT_DB,
+        CONVERSATION_META_DB,
+        CHANGES_DB,
+        PEER_CURSOR_DB,
+        BLOB_DB,
+        BLOB_REF_DB,
+        ACCESS_DB,
+    )
 
     def __init__(self, db_path: Optional[str] = None, max_db_size: Optional[int] = None):
         """
@@ -56,6 +96,15 @@ class LMDBConversationStore(metaclass=Singleton):
         self.db_path: Path = Path(db_path)
         self.max_db_size: int = max_db_size
         self._env: lmdb.Environment | None = None
+        self._dbs: Dict[bytes, Any] = {}
+        # Reads are recorded here and persisted by the next write, not by a write of their own
+        self._accessed: Dict[str, float] = {}
+        self._evicting = threading.Lock()
+        # Transactions in progress, drained before the environment is swapped by compact()
+        self._gate = threading.Condition()
+        self._active = 0
+        self._swapping: Optional[int] = None
+        self._local = threading.local()
 
         self._ensure_db_path()
         self._init_environment()
@@ -70,38 +119,124 @@ class LMDBConversationStore(metaclass=Singleton):
             self._env = lmdb.open(
                 str(self.db_path),
                 map_size=self.max_db_size,
-                max_dbs=3,  # main, metadata, and index databases
+                max_dbs=16,  # main database plus named sub-databases
                 writemap=True,
                 readahead=False,
                 meminit=False,
             )
+            self._dbs = {name: self._env.open_db(name) for name in self.SUB_DATABASES}
             logger.info(f"LMDB environment initialized at {self.db_path}")
         except Exception as e:
             logger.error(f"Failed to initialize LMDB environment: {e}")
             raise
 
+        self._backfill_summaries()
+
+    def _backfill_summaries(self) -> None:
+        """Create the missing conversation summaries of a store written by an older version."""
+        assert self._env
+        with self._get_transaction(write=False) as txn:
+            main_entries = txn.stat()["entries"] - len(self.SUB_DATABASES)
+            meta_entries = txn.stat(self._dbs[self.CONVERSATION_META_DB])["entries"]
+
+        # Every conversation has a record, a hash mapping, at most one visible history
+        # mapping and two mappings of the history before its last turn in the main database
+        if meta_entries * 5 >= main_entries:
+            return
+
+        logger.info("Backfilling conversation summaries, this may take a while")
+        created = 0
+        dangling: List[bytes] = []
+        pending: List[Tuple[bytes, bytes]] = []
+        for key, value in self._iter_range(None, b""):
+            if key in self._dbs:
+                continue
+            if key.startswith(self.HASH_LOOKUP_PREFIX.encode("utf-8")):
+                # Hash mappings left behind by deleted conversations
+                if not self.exists(value.decode("utf-8")):
+                    dangling.append(key)
+                continue
+            try:
+                conv = ConversationInStore.model_validate(orjson.loads(value))
+            except Exception:
+                continue
+            summary = self._summarize(key.decode("utf-8"), conv, value)
+            # Recorded as a write would, so that deleting the conversation releases them;
+            # the reference counts are those of the imported `blob_refs` sub-database
+            _, aliases = self._index_hashes(conv)
+            if aliases:
+                summary["aliases"] = aliases
+            if blobs := self._referenced_blobs(conv):
+                summary["blobs"] = blobs
+            pending.append((key, orjson.dumps(summary)))
+            if len(pending) >= 1000:
+                created += self._put_summaries(pending)
+                pending = []
+        created += self._put_summaries(pending)
+
+        with self._get_transaction(write=True) as txn:
+            for key in dangling:
+                txn.delete(key)
+        logger.info(
+            f"Backfilled {created} conversation summaries, "
+            f"removed {len(dangling)} dangling hash mappings"
+        )
+
+    def _put_summaries(self, summaries: List[Tuple[bytes, bytes]]) -> int:
+        """Write the given summaries unless they already exist."""
+        with self._get_transaction(write=True, db=self._dbs[self.CONVERSATION_META_DB]) as txn:
+            return sum(txn.put(key, value, overwrite=False) for key, value in summaries)
+
     @contextmanager
-    def _get_transaction(self, write: bool = False):
+    def _get_transaction(self, write: bool = False, db=None):
         """Get LMDB transaction context manager."""
-        if not self._env:
-            raise RuntimeError("LMDB environment not initialized")
+        depth = getattr(self._local, "depth", 0)
+        with self._gate:
+            # Nested transactions of a thread go through, its outer one holds the swap back
+            while not depth and self._swapping not in (None, threading.get_ident()):
+                self._gate.wait()
+            if not self._env:
+                raise RuntimeError("LMDB environment not initialized")
+            self._active += 1
+        self._local.depth = depth + 1
 
-        txn: lmdb.Transaction = self._env.begin(write=write)
         try:
-            yield txn
-            if write:
-                txn.commit()
-        except Exception:
-            if write:
-                txn.abort()
-            raise
+            txn: lmdb.Transaction = self._env.begin(write=write, db=db)
+            try:
+                yield txn
+                if write:
+                    txn.commit()
+            except Exception:
+                if write:
+                    txn.abort()
+                raise
+        finally:
+            self._local.depth = depth
+            with self._gate:
+                self._active -= 1
+                if not self._active:
+                    self._gate.notify_all()
+
+    @contextmanager
+    def _drained(self) -> Iterator[None]:
+        """Hold new transactions of other threads back and wait for the running ones."""
+        with self._gate:
+            while self._swapping is not None:
+                self._gate.wait()
+            self._swapping = threading.get_ident()
+            self._gate.wait_for(lambda: not self._active)
+        try:
+            yield
         finally:
-            pass  # Transaction is automatically cleaned up
+            with self._gate:
+                self._swapping = None
+                self._gate.notify_all()
 
     def store(
         self,
         conv: ConversationInStore,
         custom_key: Optional[str] = None,
+        visible_messages: Optional[List[Message]] = None,
     ) -> str:
         """
         Store a conversation model in LMDB.
@@ -109,15 +244,19 @@ class LMDBConversationStore(metaclass=Singleton):
         Args:
             conv: Conversation model to store
             custom_key: Optional custom key, if not provided, hash will be used
+            visible_messages: History as seen by the client, indexed as well when it differs
 
         Returns:
             str: The key used to store the messages (hash or custom key)
+
+        Raises:
+            StorageFull: If the map is full, until `make_room` evicted conversations
         """
         if not conv:
             raise ValueError("Messages list cannot be empty")
 
         # Generate hash for the message list
-        message_hash = _hash_conversation(conv.client_id, conv.model, conv.messages)
+        message_hash, aliases = self._index_hashes(conv, visible_messages)
         storage_key = custom_key or message_hash
 
         # Prepare data for storage
@@ -126,26 +265,166 @@ class LMDBConversationStore(metaclass=Singleton):
             conv.created_at = now
         conv.updated_at = now
 
-        value = orjson.dumps(conv.model_dump(mode="json"))
+        stored, blobs = self._externalize(conv)
+        value = orjson.dumps(stored.model_dump(mode="json"))
 
         try:
-            with self._get_transaction(write=True) as txn:
-                # Store main data
-                txn.put(storage_key.encode("utf-8"), value, overwrite=True)
-
-                # Store hash -> key mapping for reverse lookup
-                txn.put(
-                    f"{self.HASH_LOOKUP_PREFIX}{message_hash}".encode("utf-8"),
-                    storage_key.encode("utf-8"),
-                )
-
-                logger.debug(f"Stored {len(conv.messages)} messages with key: {storage_key}")
-                return storage_key
-
+            self._write(storage_key, message_hash, stored, value, aliases, blobs)
+        except lmdb.MapFullError as e:
+            # Evicting here would block the event loop of the caller for the whole pass
+            raise StorageFull("LMDB map is full") from e
         except Exception as e:
             logger.error(f"Failed to store conversation: {e}")
             raise
 
+        logger.debug("Stored {} messages with key: {}", len(conv.messages), storage_key)
+        self._check_capacity()
+        return storage_key
+
+    def make_room(self) -> None:
+        """Evict the least recently used conversations after the map got full."""
+        logger.warning("LMDB map is full, evicting least recently used conversations")
+        with self._evicting:
+            self._evict()
+
+    def _write(
+        self,
+        storage_key: str,
+        message_hash: str,
+        conv: ConversationInStore,
+        value: bytes,
+        aliases: List[str],
+        blobs: Dict[str, str],
+    ) -> None:
+        """Write a conversation of this node, with the accesses recorded since the last write."""
+        with self._get_transaction(write=True) as txn:
+            self._put_in_transaction(txn, storage_key, message_hash, conv, value, aliases, blobs)
+            self._log_change(txn, "put", storage_key, value, local_node_id(), aliases, blobs)
+            self._flush_accesses(txn)
+
+    def _put_in_transaction(
+        self,
+        txn: lmdb.Transaction,
+        storage_key: str,
+        message_hash: str,
+        conv: ConversationInStore,
+        value: bytes,
+        aliases: List[str],
+        blobs: Dict[str, str],
+    ) -> None:
+        """
+        Write a conversation with its summary, hash mappings and attachments in the given
+        transaction.
+        """
+        meta_db = self._dbs[self.CONVERSATION_META_DB]
+        summary = self._summarize(storage_key, conv, value)
+        # Kept with the summary, so that deleting the conversation removes them too
+        if aliases:
+            summary["aliases"] = aliases
+        if blobs:
+            summary["blobs"] = list(blobs)
+
+        key_bytes = storage_key.encode("utf-8")
+
+        # Retain the new attachments before releasing those of the overwritten version
+        self._retain_blobs(txn, blobs)
+        if previous := txn.get(key_bytes, db=meta_db):
+            previous_summary = orjson.loads(previous)
+            self._release_blobs(txn, previous_summary.get("blobs", []))
+            # The overwritten history may differ, its mappings would resolve to this record
+            if data := txn.get(key_bytes):
+                self._drop_lookups(txn, key_bytes, orjson.loads(data), previous_summary)
+
+        # Store main data
+        txn.put(key_bytes, value, overwrite=True)
+        txn.put(key_bytes, orjson.dumps(summary), db=meta_db)
+        txn.put(key_bytes, str(time.time()).encode("utf-8"), db=self._dbs[self.ACCESS_DB])
+
+        # Store hash -> key mappings for reverse lookup
+        for lookup_hash in (message_hash, *aliases):
+            txn.put(
+                f"{self.HASH_LOOKUP_PREFIX}{lookup_hash}".encode("utf-8"),
+                storage_key.encode("utf-8"),
+            )
+
+    def _retain_blobs(self, txn: lmdb.Transaction, blobs: Dict[str, str]) -> None:
+        """Reference attachments from one more conversation, writing the new ones."""
+        blob_db, ref_db = self._dbs[self.BLOB_DB], self._dbs[self.BLOB_REF_DB]
+        for digest, data in blobs.items():
+            key = digest.encode("utf-8")
+            refs = int(txn.get(key, db=ref_db) or 0)
+            if not refs:
+                txn.put(key, data.encode("utf-8"), db=blob_db)
+            txn.put(key, str(refs + 1).encode("utf-8"), db=ref_db)
+
+    def _release_blobs(self, txn: lmdb.Transaction, digests: List[str]) -> None:
+        """Drop one reference to attachments, deleting those no conversation refers to."""
+        blob_db, ref_db = self._dbs[self.BLOB_DB], self._dbs[self.BLOB_REF_DB]
+        for digest in digests:
+            key = digest.encode("utf-8")
+            refs = int(txn.get(key, db=ref_db) or 0) - 1
+            if refs > 0:
+                txn.put(key, str(refs).encode("utf-8"), db=ref_db)
+            else:
+                txn.delete(key, db=ref_db)
+                txn.delete(key, db=blob_db)
+
+    def get_blob(self, digest: str) -> Optional[str]:
+        """Return the data of a stored attachment, or None if not found."""
+        with self._get_transaction(write=False, db=self._dbs[self.BLOB_DB]) as txn:
+            data = txn.get(digest.encode("utf-8"))
+            return data.decode("utf-8") if data else None  # type: ignore
+
+    @staticmethod
+    def _sequence_key(sequence: int) -> bytes:
+        return f"{sequence:016d}".encode("utf-8")
+
+    def _log_change(
+        self,
+        txn: lmdb.Transaction,
+        op: str,
+        key: str,
+        value: Optional[bytes],
+        origin: str,
+        aliases: Optional[List[str]] = None,
+        blobs: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Append a change to the feed in the given transaction, when replication is enabled.
+
+        The next sequence number is read inside the write transaction, so that it stays
+        monotonic across the worker processes sharing the environment.
+        """
+        if not g_config.replication.enabled:
+            return
+
+        changes_db = self._dbs[self.CHANGES_DB]
+        cursor = txn.cursor(db=changes_db)
+        sequence = int(cursor.key()) + 1 if cursor.last() else 1
+
+        change = {
+            "seq": sequence,
+            "op": op,
+            "key": key,
+            "origin": origin,
+            "ts": datetime.now().isoformat(),
+        }
+        if value is not None:
+            change["value"] = orjson.Fragment(value)
+        if aliases:
+            change["aliases"] = aliases
+        if blobs:
+            # Peers receive the attachments the conversation refers to with it
+            change["blobs"] = blobs
+        txn.put(self._sequence_key(sequence), orjson.dumps(change), db=changes_db)
+
+        # Keep the most recent changes only, peers lagging further behind resynchronize
+        if sequence % _TRIM_INTERVAL == 0:
+            threshold = self._sequence_key(sequence - g_config.replication.retain_changes)
+            if cursor.first():
+                while cursor.key() <= threshold and cursor.delete():
+                    pass
+
     def get(self, key: str) -> Optional[ConversationInStore]:
         """
         Retrieve conversation data by key.
@@ -165,62 +444,27 @@ class LMDBConversationStore(metaclass=Singleton):
                 storage_data = orjson.loads(data)  # type: ignore
                 conv = ConversationInStore.model_validate(storage_data)
 
-                logger.debug(f"Retrieved {len(conv.messages)} messages for key: {key}")
+                self._accessed[key] = time.time()
+                logger.debug("Retrieved {} messages for key: {}", len(conv.messages), key)
                 return conv
 
         except Exception as e:
             logger.error(f"Failed to retrieve messages for key {key}: {e}")
             return None
 
-    def find(self, model: str, messages: List[Message]) -> Optional[ConversationInStore]:
-        """
-        Search conversation data by message list.
-
-        Args:
-            model: Model name of the conversations
-            messages: List of messages to search for
-
-        Returns:
-            Conversation or None if not found
-        """
-        if not messages:
-            return None
-
-        # --- Find with raw messages ---
-        if conv := self._find_by_message_list(model, messages):
-            logger.debug("Found conversation with raw message history.")
-            return conv
+    def _lookup_hash(self, message_hash: str) -> Optional[str]:
+        key = f"{self.HASH_LOOKUP_PREFIX}{message_hash}"
+        with self._get_transaction(write=False) as txn:
+            mapped = txn.get(key.encode("utf-8"))
+            return mapped.decode("utf-8") if mapped else None  # type: ignore
 
-        # --- Find with cleaned messages ---
-        cleaned_messages = self.sanitize_assistant_messages(messages)
-        if conv := self._find_by_message_list(model, cleaned_messages):
-            logger.debug("Found conversation with cleaned message history.")
-            return conv
-
-        logger.debug("No conversation found for either raw or cleaned history.")
-        return None
-
-    def _find_by_message_list(
-        self, model: str, messages: List[Message]
-    ) -> Optional[ConversationInStore]:
-        """Internal find implementation based on a message list."""
-        for c in g_config.gemini.clients:
-            message_hash = _hash_conversation(c.id, model, messages)
-
-            key = f"{self.HASH_LOOKUP_PREFIX}{message_hash}"
-            try:
-                with self._get_transaction(write=False) as txn:
-                    if mapped := txn.get(key.encode("utf-8")):  # type: ignore
-                        return self.get(mapped.decode("utf-8"))  # type: ignore
-            except Exception as e:
-                logger.error(
-                    f"Failed to retrieve messages by message list for hash {message_hash} and client {c.id}: {e}"
-                )
-                continue
-
-            if conv := self.get(message_hash):
-                return conv
-        return None
+    def _iter_summaries(
+        self, prefix: bytes = b"", start_after: Optional[bytes] = None
+    ) -> Iterator[Tuple[bytes, Dict[str, Any]]]:
+        for key, value in self._iter_range(
+            self.CONVERSATION_META_DB, prefix, start_after=start_after
+        ):
+            yield key, orjson.loads(value)
 
     def exists(self, key: str) -> bool:
         """
@@ -251,64 +495,442 @@ class LMDBConversationStore(metaclass=Singleton):
         """
         try:
             with self._get_transaction(write=True) as txn:
-                # Get data first to clean up hash mapping
-                data = txn.get(key.encode("utf-8"))
-                if not data:
-                    return None
+                conv = self._delete_in_transaction(txn, key)
+                if conv:
+                    logger.debug("Deleted messages with key: {}", key)
+                return conv
 
-                storage_data = orjson.loads(data)  # type: ignore
-                conv = ConversationInStore.model_validate(storage_data)
-                message_hash = _hash_conversation(conv.client_id, conv.model, conv.messages)
+        except Exception as e:
+            logger.error(f"Failed to delete key {key}: {e}")
+            return None
 
-                # Delete main data
-                txn.delete(key.encode("utf-8"))
+    def _delete_in_transaction(
+        self,
+        txn: lmdb.Transaction,
+        key: str,
+        origin: Optional[str] = None,
+        replicate: bool = True,
+    ) -> Optional[ConversationInStore]:
+        """
+        Delete a conversation with its summary, hash mappings and attachments in the given
+        transaction.
 
-                # Clean up hash mapping if it exists
-                if message_hash and key != message_hash:
-                    txn.delete(f"{self.HASH_LOOKUP_PREFIX}{message_hash}".encode("utf-8"))
+        The deletion is recorded in the change feed with the given origin, this node by
+        default, unless it must not be replicated.
+        """
+        key_bytes = key.encode("utf-8")
+        meta_db = self._dbs[self.CONVERSATION_META_DB]
+
+        # Get data first to clean up hash mapping
+        data = txn.get(key_bytes)
+        if not data:
+            # Drop the summary of a conversation removed behind our back
+            txn.delete(key_bytes, db=meta_db)
+            return None
 
-                logger.debug(f"Deleted messages with key: {key}")
-                return conv
+        summary = orjson.loads(txn.get(key_bytes, db=meta_db) or b"{}")
+        conv = self._drop_lookups(txn, key_bytes, orjson.loads(data), summary)
+        self._release_blobs(txn, summary.get("blobs", []))
 
+        # Delete main data
+        txn.delete(key_bytes)
+        txn.delete(key_bytes, db=meta_db)
+        txn.delete(key_bytes, db=self._dbs[self.ACCESS_DB])
+
+        if replicate:
+            self._log_change(txn, "delete", key, None, origin or local_node_id())
+        return conv
+
+    def _drop_lookups(
+        self,
+        txn: lmdb.Transaction,
+        key_bytes: bytes,
+        storage_data: Dict[str, Any],
+        summary: Dict[str, Any],
+    ) -> ConversationInStore:
+        """
+        Delete the hash mappings of a stored conversation that still point to it, and
+        return the conversation.
+        """
+        conv = ConversationInStore.model_validate(storage_data)
+        message_hash = _hash_conversation(conv.client_id, conv.model, conv.messages)
+        for lookup_hash in (message_hash, *summary.get("aliases", [])):
+            lookup_key = f"{self.HASH_LOOKUP_PREFIX}{lookup_hash}".encode("utf-8")
+            if txn.get(lookup_key) == key_bytes:
+                txn.delete(lookup_key)
+        return conv
+
+    def _flush_accesses(self, txn: lmdb.Transaction) -> None:
+        """Persist the last accesses recorded by reads in the given write transaction."""
+        accessed, self._accessed = self._accessed, {}
+        meta_db, access_db = self._dbs[self.CONVERSATION_META_DB], self._dbs[self.ACCESS_DB]
+        for key, timestamp in accessed.items():
+            key_bytes = key.encode("utf-8")
+            # Skip conversations deleted since they were read
+            if txn.get(key_bytes, db=meta_db) is not None:
+                txn.put(key_bytes, str(timestamp).encode("utf-8"), db=access_db)
+
+    def _used_bytes(self) -> int:
+        """Size of the pages holding data, which unlike the map size drops after deletions."""
+        with self._get_transaction(write=False) as txn:
+            stats = [txn.stat()] + [txn.stat(db) for db in self._dbs.values()]
+        pages = sum(s["branch_pages"] + s["leaf_pages"] + s["overflow_pages"] for s in stats)
+        return pages * stats[0]["psize"]
+
+    def _check_capacity(self) -> None:
+        """Start evicting in the background once the store crosses its high-water mark."""
+        high_water = g_config.storage.evict_high_water * self.max_db_size
+        if self._used_bytes() < high_water or not self._evicting.acquire(blocking=False):
+            return
+
+        def run() -> None:
+            try:
+                self._evict()
+            except Exception as e:
+                logger.error(f"Failed to evict conversations: {e}")
+            finally:
+                self._evicting.release()
+
+        threading.Thread(target=run, name="lmdb-eviction", daemon=True).start()
+
+    def _eviction_order(self) -> List[str]:
+        """Return the keys of the conversations, from the least to the most recently used."""
+        last_access: Dict[bytes, float] = {}
+        with self._get_transaction(write=False) as txn:
+            for key, value in txn.cursor(db=self._dbs[self.CONVERSATION_META_DB]):
+                # Conversations written by an older version were last used when last updated
+                updated_at = orjson.loads(value).get("updated_at")
+                last_access[key] = (
+                    datetime.fromisoformat(updated_at).timestamp() if updated_at else 0.0
+                )
+            for key, value in txn.cursor(db=self._dbs[self.ACCESS_DB]):
+                if key in last_access:
+                    last_access[key] = float(value)
+        for key, timestamp in list(self._accessed.items()):
+            if (key_bytes := key.encode("utf-8")) in last_access:
+                last_access[key_bytes] = timestamp
+        return [key.decode("utf-8") for key in sorted(last_access, key=last_access.__getitem__)]
+
+    def _evict(self) -> int:
+        """
+        Evict the least recently used conversations until the store is back under its
+        low-water mark. Conversations are deleted in small write transactions, readers
+        are never blocked and writers interleave. Evictions are not replicated, every node
+        manages its own capacity.
+        """
+        low_water = g_config.storage.evict_low_water * self.max_db_size
+        used = self._used_bytes()
+        if used <= low_water:
+            return 0
+
+        started = time.monotonic()
+        evicted = 0
+        keys = self._eviction_order()
+        for start in range(0, len(keys), _EVICTION_BATCH):
+            with self._get_transaction(write=True) as txn:
+                for key in keys[start : start + _EVICTION_BATCH]:
+                    evicted += self._delete_in_transaction(txn, key, replicate=False) is not None
+            if self._used_bytes() <= low_water:
+                break
+
+        _evictions.inc(evicted)
+        logger.info(
+            f"Evicted {evicted} least recently used conversations in "
+            f"{time.monotonic() - started:.2f}s, store usage {used} -> {self._used_bytes()} bytes"
+        )
+        return evicted
+
+    def delete_many(self, keys: List[str]) -> int:
+        """
+        Delete several conversations in a single write transaction.
+
+        Args:
+            keys: Storage keys to delete
+
+        Returns:
+            int: The number of deleted conversations
+        """
+        deleted = 0
+        with self._get_transaction(write=True) as txn:
+            for key in keys:
+                if self._delete_in_transaction(txn, key):
+                    deleted += 1
+
+        logger.debug(f"Deleted {deleted} conversations")
+        return deleted
+
+    def save_client_state(self, client_id: str, state: Dict[str, Any]) -> None:
+        """
+        Persist the session state of a Gemini client.
+
+        Args:
+            client_id: Identifier of the Gemini client
+            state: Session state as returned by `GeminiClientWrapper.export_state`
+        """
+        try:
+            with self._get_transaction(write=True, db=self._dbs[self.CLIENT_STATE_DB]) as txn:
+                txn.put(client_id.encode("utf-8"), orjson.dumps(state))
+            logger.debug(f"Saved session state for client {client_id}")
         except Exception as e:
-            logger.error(f"Failed to delete key {key}: {e}")
-            return None
+            logger.error(f"Failed to save session state for client {client_id}: {e}")
 
-    def keys(self, prefix: str = "", limit: Optional[int] = None) -> List[str]:
+    def load_client_state(self, client_id: str) -> Optional[Dict[str, Any]]:
         """
-        List all keys in the store, optionally filtered by prefix.
+        Load the persisted session state of a Gemini client.
 
         Args:
-            prefix: Optional prefix to filter keys
-            limit: Optional limit on number of keys returned
+            client_id: Identifier of the Gemini client
 
         Returns:
-            List of keys
+            Session state or None if not found
         """
-        keys = []
         try:
-            with self._get_transaction(write=False) as txn:
-                cursor = txn.cursor()
-                cursor.first()
+            with self._get_transaction(write=False, db=self._dbs[self.CLIENT_STATE_DB]) as txn:
+                data = txn.get(client_id.encode("utf-8"))
+                return orjson.loads(data) if data else None  # type: ignore
+        except Exception as e:
+            logger.error(f"Failed to load session state for client {client_id}: {e}")
+            return None
 
-                count = 0
-                for key, _ in cursor:
-                    key_str = key.decode("utf-8")
-                    # Skip internal hash mappings
-                    if key_str.startswith(self.HASH_LOOKUP_PREFIX):
+    def _iter_range(
+        self,
+        db_name: Optional[bytes],
+        prefix: bytes,
+        start_after: Optional[bytes] = None,
+        page: int = 256,
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Iterate over the records of a sub-database, or of the main database if `db_name`
+        is None, whose keys start with prefix.
+
+        Records are read in pages, each in a short read transaction, so that callers can
+        interleave writes and awaits with the iteration.
+        """
+        cursor_key = start_after
+        while True:
+            batch: List[Tuple[bytes, bytes]] = []
+            db = self._dbs[db_name] if db_name else None
+            with self._get_transaction(write=False, db=db) as txn:
+                cursor = txn.cursor()
+                seek = cursor_key or prefix
+                if not (cursor.set_range(seek) if seek else cursor.first()):
+                    return
+                for key, value in cursor:
+                    if not key.startswith(prefix):
+                        break
+                    if key == start_after:
                         continue
+                    batch.append((key, value))
+                    if len(batch) >= page:
+                        break
 
-                    if not prefix or key_str.startswith(prefix):
-                        keys.append(key_str)
-                        count += 1
+            yield from batch
+            if len(batch) < page:
+                return
+            cursor_key = start_after = batch[-1][0]
 
-                        if limit and count >= limit:
-                            break
+    @staticmethod
+    def _batch_item_key(batch_id: str, index: int) -> bytes:
+        return f"{batch_id}:{index:08d}".encode("utf-8")
 
-        except Exception as e:
-            logger.error(f"Failed to list keys: {e}")
+    def save_batch(self, batch: Dict[str, Any], inputs: Optional[List[bytes]] = None) -> None:
+        """
+        Persist the metadata of a batch, together with its input lines if provided.
 
-        return keys
+        Args:
+            batch: Batch metadata, must contain an `id`
+            inputs: Raw request lines, written in chunks before the metadata, so that other
+                writers interleave and the batch only shows up once complete
+        """
+        batch_id = batch["id"]
+        input_db = self._dbs[self.BATCH_INPUT_DB]
+        for start in range(0, len(inputs or []), _BATCH_CHUNK):
+            with self._get_transaction(write=True, db=input_db) as txn:
+                for index, line in enumerate(inputs[start : start + _BATCH_CHUNK], start):
+                    txn.put(self._batch_item_key(batch_id, index), line)
+        with self._get_transaction(write=True, db=self._dbs[self.BATCH_DB]) as txn:
+            txn.put(batch_id.encode("utf-8"), orjson.dumps(batch))
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Return the metadata of a batch, or None if not found."""
+        with self._get_transaction(write=False, db=self._dbs[self.BATCH_DB]) as txn:
+            data = txn.get(batch_id.encode("utf-8"))
+            return orjson.loads(data) if data else None  # type: ignore
+
+    def list_batches(self) -> List[Dict[str, Any]]:
+        """Return the metadata of every batch."""
+        return [orjson.loads(value) for _, value in self._iter_range(self.BATCH_DB, b"")]
+
+    def iter_batch_inputs(self, batch_id: str) -> Iterator[Tuple[int, bytes]]:
+        """Iterate over the input lines of a batch as (index, line) pairs."""
+        prefix = f"{batch_id}:".encode("utf-8")
+        for key, value in self._iter_range(self.BATCH_INPUT_DB, prefix):
+            yield int(key[len(prefix) :]), value
+
+    def save_batch_result(self, batch: Dict[str, Any], index: int, result: bytes) -> None:
+        """Checkpoint the result of one batch item together with the updated batch metadata."""
+        batch_id = batch["id"]
+        with self._get_transaction(write=True, db=self._dbs[self.BATCH_DB]) as txn:
+            txn.put(batch_id.encode("utf-8"), orjson.dumps(batch))
+            txn.put(
+                self._batch_item_key(batch_id, index), result, db=self._dbs[self.BATCH_RESULT_DB]
+            )
+
+    def delete_batch(self, batch_id: str) -> bool:
+        """
+        Delete a batch with its inputs and results, in chunks so that other writers
+        interleave. The metadata goes last, a batch interrupted midway can be deleted again.
+        """
+        prefix = f"{batch_id}:".encode("utf-8")
+        for db_name in (self.BATCH_INPUT_DB, self.BATCH_RESULT_DB):
+            while keys := [
+                key for key, _ in islice(self._iter_range(db_name, prefix), _BATCH_CHUNK)
+            ]:
+                with self._get_transaction(write=True, db=self._dbs[db_name]) as txn:
+                    for key in keys:
+                        txn.delete(key)
+        with self._get_transaction(write=True, db=self._dbs[self.BATCH_DB]) as txn:
+            return txn.delete(batch_id.encode("utf-8"))
+
+    def iter_batch_results(
+        self, batch_id: str, start_after: Optional[int] = None
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Iterate over the checkpointed results of a batch as (index, line) pairs."""
+        prefix = f"{batch_id}:".encode("utf-8")
+        start = self._batch_item_key(batch_id, start_after) if start_after is not None else None
+        for key, value in self._iter_range(self.BATCH_RESULT_DB, prefix, start_after=start):
+            yield int(key[len(prefix) :]), value
+
+    def last_sequence(self) -> int:
+        """Return the sequence number of the latest change, 0 if the feed is empty."""
+        with self._get_transaction(write=False, db=self._dbs[self.CHANGES_DB]) as txn:
+            cursor = txn.cursor()
+            return int(cursor.key()) if cursor.last() else 0
+
+    def iter_changes(self, since: int = 0, limit: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the changes recorded after the given sequence number.
+
+        Args:
+            since: Sequence number of the last change already seen
+            limit: Maximum number of changes returned
+
+        Returns:
+            Iterator over the changes in sequence order
+        """
+        start = self._sequence_key(since) if since > 0 else None
+        page = min(limit, 256)
+        for count, (_, value) in enumerate(
+            self._iter_range(self.CHANGES_DB, b"", start_after=start, page=page), start=1
+        ):
+            yield orjson.loads(value)
+            if count >= limit:
+                return
+
+    def apply_change(self, change: Dict[str, Any]) -> bool:
+        """
+        Apply a change received from a peer.
+
+        Puts are resolved by last writer wins on `updated_at`, so that replaying a change,
+        or receiving it from several peers, is harmless. Applied changes are recorded in
+        the local feed with their original origin, so that they propagate further.
+
+        Returns:
+            bool: Whether the store was modified
+        """
+        key = change["key"]
+        origin = change.get("origin") or "unknown"
+        with self._get_transaction(write=True) as txn:
+            if change["op"] == "delete":
+                return self._delete_in_transaction(txn, key, origin=origin) is not None
+
+            existing = txn.get(key.encode("utf-8"))
+            if existing and not self._is_newer(change["value"], orjson.loads(existing)):
+                return False
+
+            conv, blobs, value = self._decode_change(change)
+            message_hash = _hash_conversation(conv.client_id, conv.model, conv.messages)
+            aliases = change.get("aliases", [])
+            self._put_in_transaction(txn, key, message_hash, conv, value, aliases, blobs)
+            self._log_change(txn, "put", key, value, origin, aliases, blobs)
+            return True
+
+    def get_peer_cursor(self, peer: str) -> int:
+        """Return the sequence number of the last change applied from a peer."""
+        with self._get_transaction(write=False, db=self._dbs[self.PEER_CURSOR_DB]) as txn:
+            data = txn.get(peer.encode("utf-8"))
+            return int(data) if data else 0
+
+    def save_peer_cursor(self, peer: str, sequence: int) -> None:
+        """Persist the sequence number of the last change applied from a peer."""
+        with self._get_transaction(write=True, db=self._dbs[self.PEER_CURSOR_DB]) as txn:
+            txn.put(peer.encode("utf-8"), str(sequence).encode("utf-8"))
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Rewrite the database without its free pages and return the disk space reclaimed.
+
+        The compacting copy is written to a sibling directory while the store keeps serving.
+        Transactions are then drained, only for the copy to replace the data file, unless
+        writes landed since it was taken: the copy is then taken again, transactions no
+        longer held back. LMDB never shrinks its file otherwise.
+
+        Raises:
+            RuntimeError: If other processes use the store, or writes landed during every copy
+        """
+        if not self._env:
+            raise RuntimeError("LMDB environment not initialized")
+        if pids := _other_reader_pids(self._env):
+            raise RuntimeError(
+                f"LMDB environment is open in other processes {sorted(pids)}, "
+                "compact it with scripts/compact_lmdb.py while the server is stopped"
+            )
+
+        started = time.monotonic()
+        target = self.db_path.with_name(f"{self.db_path.name}.compact")
+        bytes_before = _allocated_bytes(self.db_path)
+
+        def copy() -> int:
+            shutil.rmtree(target, ignore_errors=True)
+            target.mkdir(parents=True)
+            assert self._env
+            txn_id = self._env.info()["last_txnid"]
+            self._env.copy(str(target), compact=True)
+            return txn_id
+
+        with self._evicting:
+            try:
+                for _ in range(_COMPACT_ATTEMPTS):
+                    copied = copy()
+                    # Only the swap holds transactions back, never a copy of the whole store
+                    with self._drained():
+                        if self._env.info()["last_txnid"] != copied:
+                            continue
+                        self._env.close()
+                        self._env = None
+                        try:
+                            os.replace(target / "data.mdb", self.db_path / "data.mdb")
+                        finally:
+                            self._init_environment()
+                        break
+                else:
+                    raise RuntimeError(
+                        f"LMDB was written during {_COMPACT_ATTEMPTS} compacting copies in a row, "
+                        "retry when the store is less busy"
+                    )
+            finally:
+                shutil.rmtree(target, ignore_errors=True)
+
+        bytes_after = _allocated_bytes(self.db_path)
+        logger.info(
+            f"Compacted LMDB in {time.monotonic() - started:.2f}s, "
+            f"{bytes_before} -> {bytes_after} bytes on disk"
+        )
+        return {
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_reclaimed": max(0, bytes_before - bytes_after),
+        }
 
     def stats(self) -> Dict[str, Any]:
         """
@@ -337,32 +959,3 @@ class LMDBConversationStore(metaclass=Singleton):
     def __del__(self):
         """Cleanup on destruction."""
         self.close()
-
-    @staticmethod
-    def remove_think_tags(text: str) -> str:
-        """
-        Remove <think>...</think> tags at the start of text and strip whitespace.
-        """
-        cleaned_content = re.sub(r"^(\s*<think>.*?</think>\n?)", "", text, flags=re.DOTALL)
-        return cleaned_content.strip()
-
-    @staticmethod
-    def sanitize_assistant_messages(messages: list[Message]) -> list[Message]:
-        """
-        Create a new list of messages with assistant content cleaned of <think> tags.
-        This is useful for store the chat history.
-        """
-        cleaned_messages = []
-        for msg in messages:
-            if msg.role == "assistant" and isinstance(msg.content, str):
-                normalized_content = LMDBConversationStore.remove_think_tags(msg.content)
-                # Only create a new object if content actually changed
-                if normalized_content != msg.content:
-                    cleaned_msg = Message(role=msg.role, content=normalized_content, name=msg.name)
-                    cleaned_messages.append(cleaned_msg)
-                else:
-                    cleaned_messages.append(msg)
-            else:
-                cleaned_messages.append(msg)
-
-        return cleaned_messages
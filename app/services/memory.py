@@ -0,0 +1,375 @@
+import bisect
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from loguru import logger
+
+from ..models import ConversationInStore, Message
+from ..utils import g_config
+from ..utils.metrics import counter
+from ..utils.singleton import Singleton
+from .storage import (
+    CompactionUnsupported,
+    ConversationStore,
+    _hash_conversation,
+    local_node_id,
+)
+
+_evictions = counter(
+    "gemini_storage_evictions_total", "Least recently used conversations evicted from the store"
+)
+
+
+class MemoryConversationStore(ConversationStore, metaclass=Singleton):
+    """
+    Bounded in-memory storage, for ephemeral deployments and benchmarks.
+
+    Conversations are kept serialized, so that the size limit is enforced on the same
+    bytes LMDB would store, and the least recently used ones are evicted once the total
+    size exceeds `max_size`. Nothing survives a restart, and every worker process has its
+    own store.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        """
+        Initialize the in-memory store.
+
+        Args:
+            max_size: Maximum total size of the stored conversations in bytes
+        """
+        self.max_size: int = max_size or g_config.storage.max_size
+        self._size = 0
+
+        # Serialized conversations, from the least to the most recently used
+        self._records: OrderedDict[str, bytes] = OrderedDict()
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._sorted_keys: List[str] = []
+        self._hashes: Dict[str, str] = {}
+        # Lookup hashes of each key: its history and the visible form of it
+        self._key_hashes: Dict[str, List[str]] = {}
+        # Attachments by digest, with the number of conversations referring to them
+        self._blobs: Dict[str, str] = {}
+        self._blob_refs: Dict[str, int] = {}
+        self._key_blobs: Dict[str, List[str]] = {}
+
+        self._client_states: Dict[str, bytes] = {}
+        self._batches: Dict[str, bytes] = {}
+        self._batch_inputs: Dict[str, List[bytes]] = {}
+        self._batch_results: Dict[str, Dict[int, bytes]] = {}
+
+        # Serialized changes, the last one has sequence number `_sequence`
+        self._changes: deque[bytes] = deque(maxlen=g_config.replication.retain_changes)
+        self._sequence = 0
+        self._peer_cursors: Dict[str, int] = {}
+
+        logger.info(f"In-memory conversation store initialized, limited to {self.max_size} bytes")
+
+    def store(
+        self,
+        conv: ConversationInStore,
+        custom_key: Optional[str] = None,
+        visible_messages: Optional[List[Message]] = None,
+    ) -> str:
+        """
+        Store a conversation model in memory, evicting older conversations if needed.
+
+        Args:
+            conv: Conversation model to store
+            custom_key: Optional custom key, if not provided, hash will be used
+            visible_messages: History as seen by the client, indexed as well when it differs
+
+        Returns:
+            str: The key used to store the messages (hash or custom key)
+        """
+        if not conv:
+            raise ValueError("Messages list cannot be empty")
+
+        message_hash, aliases = self._index_hashes(conv, visible_messages)
+        storage_key = custom_key or message_hash
+
+        now = datetime.now()
+        if conv.created_at is None:
+            conv.created_at = now
+        conv.updated_at = now
+
+        stored, blobs = self._externalize(conv)
+        value = orjson.dumps(stored.model_dump(mode="json"))
+        size = len(value) + sum(len(data) for data in blobs.values())
+        if size > self.max_size:
+            raise ValueError(f"Conversation of {size} bytes exceeds the store size limit")
+
+        self._put(storage_key, message_hash, stored, value, aliases, blobs)
+        self._log_change("put", storage_key, value, local_node_id(), aliases, blobs)
+        logger.debug("Stored {} messages with key: {}", len(conv.messages), storage_key)
+        return storage_key
+
+    def _put(
+        self,
+        storage_key: str,
+        message_hash: str,
+        conv: ConversationInStore,
+        value: bytes,
+        aliases: List[str],
+        blobs: Dict[str, str],
+    ) -> None:
+        """Write a conversation with its summary, hash mappings and attachments."""
+        # Retain the new attachments before releasing those of the overwritten version
+        for digest, data in blobs.items():
+            if digest not in self._blobs:
+                self._blobs[digest] = data
+                self._size += len(data)
+            self._blob_refs[digest] = self._blob_refs.get(digest, 0) + 1
+
+        if storage_key in self._records:
+            self._size -= len(self._records.pop(storage_key))
+            self._unmap(storage_key)
+        else:
+            bisect.insort(self._sorted_keys, storage_key)
+        self._key_blobs[storage_key] = list(blobs)
+        self._records[storage_key] = value
+        self._size += len(value)
+        self._summaries[storage_key] = self._summarize(storage_key, conv, value)
+        lookup_hashes = [message_hash, *aliases]
+        for lookup_hash in lookup_hashes:
+            self._hashes[lookup_hash] = storage_key
+        self._key_hashes[storage_key] = lookup_hashes
+
+        self._evict(keep=storage_key)
+
+    def _unmap(self, key: str) -> None:
+        """Drop the hash mappings of a key which still point to it, and its attachments."""
+        for lookup_hash in self._key_hashes.pop(key, []):
+            if self._hashes.get(lookup_hash) == key:
+                del self._hashes[lookup_hash]
+        for digest in self._key_blobs.pop(key, []):
+            self._blob_refs[digest] -= 1
+            if not self._blob_refs[digest]:
+                del self._blob_refs[digest]
+                self._size -= len(self._blobs.pop(digest))
+
+    def get_blob(self, digest: str) -> Optional[str]:
+        return self._blobs.get(digest)
+
+    def _log_change(
+        self,
+        op: str,
+        key: str,
+        value: Optional[bytes],
+        origin: str,
+        aliases: Optional[List[str]] = None,
+        blobs: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Append a change to the feed, when replication is enabled."""
+        if not g_config.replication.enabled:
+            return
+        self._sequence += 1
+        change: Dict[str, Any] = {
+            "seq": self._sequence,
+            "op": op,
+            "key": key,
+            "origin": origin,
+            "ts": datetime.now().isoformat(),
+        }
+        if value is not None:
+            change["value"] = orjson.Fragment(value)
+        if aliases:
+            change["aliases"] = aliases
+        if blobs:
+            change["blobs"] = blobs
+        self._changes.append(orjson.dumps(change))
+
+    def _evict(self, keep: str) -> None:
+        """Evict the least recently used conversations until the size limit is met."""
+        while self._size > self.max_size:
+            key = next(iter(self._records))
+            if key == keep:
+                break
+            self._remove(key)
+            _evictions.inc()
+            logger.debug("Evicted conversation with key: {}", key)
+
+    def _remove(self, key: str) -> Optional[bytes]:
+        """Remove a conversation together with its summary and hash mappings."""
+        value = self._records.pop(key, None)
+        if value is None:
+            return None
+
+        self._size -= len(value)
+        self._summaries.pop(key, None)
+        index = bisect.bisect_left(self._sorted_keys, key)
+        if index < len(self._sorted_keys) and self._sorted_keys[index] == key:
+            del self._sorted_keys[index]
+
+        self._unmap(key)
+        return value
+
+    def get(self, key: str) -> Optional[ConversationInStore]:
+        """
+        Retrieve conversation data by key, marking it as recently used.
+
+        Args:
+            key: Storage key (hash or custom key)
+
+        Returns:
+            Conversation or None if not found
+        """
+        data = self._records.get(key)
+        if data is None:
+            return None
+
+        self._records.move_to_end(key)
+        conv = ConversationInStore.model_validate(orjson.loads(data))
+        logger.debug("Retrieved {} messages for key: {}", len(conv.messages), key)
+        return conv
+
+    def _lookup_hash(self, message_hash: str) -> Optional[str]:
+        return self._hashes.get(message_hash)
+
+    def _iter_summaries(
+        self, prefix: bytes = b"", start_after: Optional[bytes] = None
+    ) -> Iterator[Tuple[bytes, Dict[str, Any]]]:
+        prefix_str = prefix.decode("utf-8")
+        if start_after is not None:
+            index = bisect.bisect_right(self._sorted_keys, start_after.decode("utf-8"))
+        else:
+            index = bisect.bisect_left(self._sorted_keys, prefix_str)
+
+        while index < len(self._sorted_keys):
+            key = self._sorted_keys[index]
+            if not key.startswith(prefix_str):
+                if key > prefix_str:
+                    return
+            else:
+                yield key.encode("utf-8"), self._summaries[key]
+            index += 1
+
+    def exists(self, key: str) -> bool:
+        return key in self._records
+
+    def delete(self, key: str) -> Optional[ConversationInStore]:
+        """
+        Delete conversation model by key.
+
+        Args:
+            key: Storage key to delete
+
+        Returns:
+            ConversationInStore: The deleted conversation data, or None if not found
+        """
+        value = self._remove(key)
+        if value is None:
+            return None
+        self._log_change("delete", key, None, local_node_id())
+        logger.debug("Deleted messages with key: {}", key)
+        return ConversationInStore.model_validate(orjson.loads(value))
+
+    def delete_many(self, keys: List[str]) -> int:
+        deleted = 0
+        for key in keys:
+            if self._remove(key) is not None:
+                self._log_change("delete", key, None, local_node_id())
+                deleted += 1
+        return deleted
+
+    def save_client_state(self, client_id: str, state: Dict[str, Any]) -> None:
+        self._client_states[client_id] = orjson.dumps(state)
+
+    def load_client_state(self, client_id: str) -> Optional[Dict[str, Any]]:
+        data = self._client_states.get(client_id)
+        return orjson.loads(data) if data else None
+
+    def save_batch(self, batch: Dict[str, Any], inputs: Optional[List[bytes]] = None) -> None:
+        self._batches[batch["id"]] = orjson.dumps(batch)
+        if inputs:
+            self._batch_inputs[batch["id"]] = list(inputs)
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        data = self._batches.get(batch_id)
+        return orjson.loads(data) if data else None
+
+    def list_batches(self) -> List[Dict[str, Any]]:
+        return [orjson.loads(self._batches[batch_id]) for batch_id in sorted(self._batches)]
+
+    def iter_batch_inputs(self, batch_id: str) -> Iterator[Tuple[int, bytes]]:
+        yield from enumerate(self._batch_inputs.get(batch_id, []))
+
+    def save_batch_result(self, batch: Dict[str, Any], index: int, result: bytes) -> None:
+        self._batches[batch["id"]] = orjson.dumps(batch)
+        self._batch_results.setdefault(batch["id"], {})[index] = result
+
+    def delete_batch(self, batch_id: str) -> bool:
+        self._batch_inputs.pop(batch_id, None)
+        self._batch_results.pop(batch_id, None)
+        return self._batches.pop(batch_id, None) is not None
+
+    def iter_batch_results(
+        self, batch_id: str, start_after: Optional[int] = None
+    ) -> Iterator[Tuple[int, bytes]]:
+        results = self._batch_results.get(batch_id, {})
+        for index in sorted(results):
+            if start_after is None or index > start_after:
+                yield index, results[index]
+
+    def last_sequence(self) -> int:
+        return self._sequence
+
+    def iter_changes(self, since: int = 0, limit: int = 500) -> Iterator[Dict[str, Any]]:
+        # Sequence numbers are contiguous, so the position of a change follows from it
+        first = self._sequence - len(self._changes) + 1
+        start = max(0, since - first + 1)
+        for index in range(start, min(start + limit, len(self._changes))):
+            yield orjson.loads(self._changes[index])
+
+    def apply_change(self, change: Dict[str, Any]) -> bool:
+        key = change["key"]
+        origin = change.get("origin") or "unknown"
+        if change["op"] == "delete":
+            if self._remove(key) is None:
+                return False
+            self._log_change("delete", key, None, origin)
+            return True
+
+        existing = self._records.get(key)
+        if existing and not self._is_newer(change["value"], orjson.loads(existing)):
+            return False
+
+        conv, blobs, value = self._decode_change(change)
+        if len(value) + sum(len(data) for data in blobs.values()) > self.max_size:
+            return False
+        message_hash = _hash_conversation(conv.client_id, conv.model, conv.messages)
+        aliases = change.get("aliases", [])
+        self._put(key, message_hash, conv, value, aliases, blobs)
+        self._log_change("put", key, value, origin, aliases, blobs)
+        return True
+
+    def get_peer_cursor(self, peer: str) -> int:
+        return self._peer_cursors.get(peer, 0)
+
+    def save_peer_cursor(self, peer: str, sequence: int) -> None:
+        self._peer_cursors[peer] = sequence
+
+    def compact(self) -> Dict[str, int]:
+        # Memory is returned as records are deleted, there is nothing to rewrite
+        raise CompactionUnsupported("The memory backend cannot be compacted")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "entries": len(self._records),
+            "blobs": len(self._blobs),
+            "size": self._size,
+            "max_size": self.max_size,
+        }
+
+    def close(self) -> None:
+        self._records.clear()
+        self._summaries.clear()
+        self._sorted_keys.clear()
+        self._hashes.clear()
+        self._key_hashes.clear()
+        self._blobs.clear()
+        self._blob_refs.clear()
+        self._key_blobs.clear()
+        self._size = 0
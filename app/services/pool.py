@@ -1,9 +1,18 @@
-from collections import deque
-from typing import Dict, List, Optional
+import asyncio
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
 
-from ..utils import g_config
+from gemini_webapi.exceptions import APIError, AuthError
+from loguru import logger
+
+from ..utils import deadline, g_config
 from ..utils.singleton import Singleton
+from ..utils.workers import is_local, worker_index
 from .client import GeminiClientWrapper
+from .latency import LatencyTracker
+from .quota import NoClientAvailable, QuotaTracker
+from .storage import get_conversation_store
 
 
 class GeminiClientPool(metaclass=Singleton):
@@ -13,11 +22,23 @@ class GeminiClientPool(metaclass=Singleton):
         self._clients: List[GeminiClientWrapper] = []
         self._id_map: Dict[str, GeminiClientWrapper] = {}
         self._round_robin: deque[GeminiClientWrapper] = deque()
+        self._init_tasks: Dict[str, asyncio.Task] = {}
+        self._persist_task: Optional[asyncio.Task] = None
+        # Clients running on a resumed access token that no request has validated yet
+        self._resumed: Set[str] = set()
+        # Clients whose resumed access token was rejected, which must perform the handshake
+        self._stale: Set[str] = set()
+        self._quota = QuotaTracker()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self.latency = LatencyTracker()
 
         if len(g_config.gemini.clients) == 0:
             raise ValueError("No Gemini clients configured")
 
+        # In multi-worker mode, each worker only manages its own share of the clients
         for c in g_config.gemini.clients:
+            if not is_local(c.id):
+                continue
             client = GeminiClientWrapper(
                 client_id=c.id,
                 secure_1psid=c.secure_1psid,
@@ -27,29 +48,187 @@ class GeminiClientPool(metaclass=Singleton):
             self._id_map[c.id] = client
             self._round_robin.append(client)
 
+        if len(self._clients) == 0:
+            raise ValueError(f"No Gemini clients assigned to worker {worker_index()}")
+
     async def init(self) -> None:
         """Initialize all clients in the pool."""
         for client in self._clients:
-            if not client.running:
-                await client.init(
-                    timeout=g_config.gemini.timeout,
-                    auto_refresh=g_config.gemini.auto_refresh,
-                    verbose=g_config.gemini.verbose,
-                    refresh_interval=g_config.gemini.refresh_interval,
-                )
-
-    def acquire(self, client_id: Optional[str] = None) -> GeminiClientWrapper:
-        """Return a client by id or using round-robin."""
+            await self.ensure_ready(client)
+
+    async def ensure_ready(self, client: GeminiClientWrapper) -> None:
+        """
+        Initialize the client if it is not running yet.
+
+        Concurrent callers share a single in-flight init, so that lazily initialized
+        clients only perform one handshake even under a burst of first requests.
+        """
+        if client.running:
+            return
+
+        task = self._init_tasks.get(client.id)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._start(client))
+            self._init_tasks[client.id] = task
+
+        # Shield the shared task from the cancellation of any single caller
+        await asyncio.shield(task)
+
+    async def _start(self, client: GeminiClientWrapper) -> None:
+        """Start a client, resuming its persisted session state when possible."""
+        kwargs = {
+            "timeout": g_config.gemini.timeout,
+            "auto_refresh": g_config.gemini.auto_refresh,
+            "refresh_interval": g_config.gemini.refresh_interval,
+        }
+
+        access_token = None
+        if g_config.gemini.persist_session:
+            if state := get_conversation_store().load_client_state(client.id):
+                access_token = client.restore_state(state)
+
+        resumed = False
+        if access_token and client.id not in self._stale:
+            try:
+                await client.resume(access_token, **kwargs)
+                resumed = True
+            except Exception as e:
+                logger.warning(f"Client {client.id} failed to resume its session state: {e}")
+
+        if resumed:
+            self._resumed.add(client.id)
+            logger.info(f"Client {client.id} resumed from persisted session state")
+        else:
+            if client.client is not None:
+                # Left over by a failed resume or a resumed session whose token was rejected
+                await client.client.aclose()
+            await client.init(verbose=g_config.gemini.verbose, **kwargs)
+            self._stale.discard(client.id)
+
+        if g_config.gemini.persist_session:
+            self.save_state(client)
+            if self._persist_task is None:
+                self._persist_task = asyncio.create_task(self._persist_loop())
+
+    async def _persist_loop(self) -> None:
+        """Periodically persist the cookies rotated by the auto refresh tasks."""
+        while True:
+            await asyncio.sleep(g_config.gemini.refresh_interval)
+            self.save_state()
+
+    def save_state(self, client: Optional[GeminiClientWrapper] = None) -> None:
+        """Persist the session state of the given client, or of every running client."""
+        db = get_conversation_store()
+        for c in [client] if client else self._clients:
+            if c.running:
+                db.save_client_state(c.id, c.export_state())
+
+    def acquire(
+        self, client_id: Optional[str] = None, model: Optional[str] = None
+    ) -> GeminiClientWrapper:
+        """
+        Return a client by id or using round-robin.
+
+        When a model is given, round-robin skips the clients cooling down for it and
+        prefers the next client with a request token available.
+
+        Raises:
+            NoClientAvailable: If every client is cooling down for the model
+        """
         if client_id:
             client = self._id_map.get(client_id)
             if not client:
                 raise ValueError(f"Client id {client_id} not found")
             return client
 
-        client = self._round_robin[0]
-        self._round_robin.rotate(-1)
+        if model is None or not g_config.quota.enabled:
+            client = self._round_robin[0]
+            self._round_robin.rotate(-1)
+            return client
+
+        chosen, chosen_wait = None, 0.0
+        for position, client in enumerate(self._round_robin):
+            if self._quota.cooldown_remaining(client.id, model) > 0:
+                continue
+            wait = self._quota.wait_time(client.id)
+            if chosen is None or wait < chosen_wait:
+                chosen, chosen_wait = position, wait
+            if wait == 0:
+                break
+
+        if chosen is None:
+            retry_after = min(self._quota.cooldown_remaining(c.id, model) for c in self._clients)
+            raise NoClientAvailable(model, retry_after)
+
+        client = self._round_robin[chosen]
+        self._round_robin.rotate(-(chosen + 1))
         return client
 
+    def acquire_idle(self, model: str, exclude: str) -> Optional[GeminiClientWrapper]:
+        """
+        Return a client without any request in flight, available for the model and with a
+        request token, other than `exclude`, or None if there is none.
+        """
+        for client in self._round_robin:
+            if client.id == exclude or self._in_flight[client.id] or not client.running:
+                continue
+            if not self.is_available(client.id, model):
+                continue
+            if g_config.quota.enabled and self._quota.wait_time(client.id) > 0:
+                continue
+            return client
+        return None
+
+    @contextmanager
+    def busy(self, client: GeminiClientWrapper) -> Iterator[None]:
+        """Count a request in flight on the client for the duration of the block."""
+        self._in_flight[client.id] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[client.id] -= 1
+
+    def is_available(self, client_id: str, model: str) -> bool:
+        """Check whether the client is not cooling down for the model."""
+        return not g_config.quota.enabled or self._quota.cooldown_remaining(client_id, model) == 0
+
+    async def pace(self, client: GeminiClientWrapper) -> None:
+        """
+        Wait for a request token of the client before sending to the upstream.
+
+        Raises:
+            DeadlineExceeded: If the token comes after the deadline of the request
+        """
+        if not g_config.quota.enabled:
+            return
+        deadline.check("pace", self._quota.wait_time(client.id))
+        if (delay := self._quota.reserve(client.id)) > 0:
+            logger.debug("Pacing client {} for {:.2f}s", client.id, delay)
+            await asyncio.sleep(delay)
+
+    def report_success(self, client: GeminiClientWrapper, model: str) -> None:
+        """Record a successful upstream call of the client."""
+        # The resumed access token, if any, is valid
+        self._resumed.discard(client.id)
+        if g_config.quota.enabled:
+            self._quota.record_success(client.id, model)
+
+    def report_failure(self, client: GeminiClientWrapper, model: str, exc: BaseException) -> None:
+        """Record a failed upstream call, cooling the client down for the model if needed."""
+        if client.id in self._resumed and isinstance(exc, (APIError, AuthError)):
+            # The persisted access token was likely rejected: initialize the client again
+            # on its next use rather than keep failing until `gemini.session_ttl` expires
+            logger.warning(f"Client {client.id} failed on its resumed session, reinitializing")
+            self._resumed.discard(client.id)
+            self._stale.add(client.id)
+            client.running = False
+        if g_config.quota.enabled:
+            self._quota.record_failure(client.id, model, exc)
+
+    def owns(self, client_id: str) -> bool:
+        """Check whether the client is managed by this pool."""
+        return client_id in self._id_map
+
     @property
     def clients(self) -> List[GeminiClientWrapper]:
         """Return managed clients."""
@@ -0,0 +1,154 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from gemini_webapi.exceptions import (
+    GeminiError,
+    TemporarilyBlocked,
+    UsageLimitExceeded,
+)
+from loguru import logger
+
+from ..utils import g_config
+from ..utils.metrics import counter
+
+_cooldowns = counter(
+    "gemini_client_cooldowns_total", "Accounts cooled down for a model after a failure"
+)
+_rate_limited = counter(
+    "gemini_client_rate_limited_total", "Upstream calls rejected by a usage limit or a block"
+)
+
+
+class NoClientAvailable(Exception):
+    """Raised when every account is cooling down for the requested model."""
+
+    def __init__(self, model: str, retry_after: float) -> None:
+        super().__init__(
+            f"Every Gemini account is rate limited for model {model}, "
+            f"retry in {int(retry_after) + 1} seconds"
+        )
+        self.model = model
+        self.retry_after = retry_after
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Check whether an upstream error means an account is exhausted or blocked."""
+    return isinstance(exc, (UsageLimitExceeded, TemporarilyBlocked, NoClientAvailable))
+
+
+@dataclass
+class _Bucket:
+    """Adaptive token bucket pacing the requests of one account."""
+
+    rate: float
+    tokens: float
+    updated: float = field(default_factory=time.monotonic)
+
+    def refill(self, now: float, burst: int) -> None:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+
+@dataclass
+class _ModelState:
+    """Health of one account for one model."""
+
+    failures: int = 0
+    cooldowns: int = 0
+    cooldown_until: float = 0.0
+
+
+class QuotaTracker:
+    """
+    Track the usage signals of every (account, model) pair.
+
+    Each account is paced by a token bucket whose rate adapts to the upstream: it is
+    halved whenever the account is rate limited and grows back by one request per minute
+    with every success. An account is cooled down for a model when it reports a usage
+    limit or keeps failing, and for every model when it is temporarily blocked. Repeated
+    cooldowns double in length until a request succeeds again.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, _Bucket] = {}
+        self._states: Dict[Tuple[str, str], _ModelState] = {}
+        # Accounts blocked for every model
+        self._blocked_until: Dict[str, float] = {}
+
+    def _bucket(self, client_id: str) -> _Bucket:
+        if (bucket := self._buckets.get(client_id)) is None:
+            config = g_config.quota
+            bucket = _Bucket(rate=config.requests_per_minute, tokens=config.burst)
+            self._buckets[client_id] = bucket
+        return bucket
+
+    def _state(self, client_id: str, model: str) -> _ModelState:
+        return self._states.setdefault((client_id, model), _ModelState())
+
+    def cooldown_remaining(self, client_id: str, model: str) -> float:
+        """Return the seconds left before the account may serve the model again."""
+        now = time.monotonic()
+        state = self._states.get((client_id, model))
+        until = max(self._blocked_until.get(client_id, 0.0), state.cooldown_until if state else 0)
+        return max(0.0, until - now)
+
+    def wait_time(self, client_id: str) -> float:
+        """Return the seconds to wait before the account has a request token."""
+        bucket = self._bucket(client_id)
+        bucket.refill(time.monotonic(), g_config.quota.burst)
+        if bucket.tokens >= 1:
+            return 0.0
+        return (1 - bucket.tokens) * 60 / bucket.rate
+
+    def reserve(self, client_id: str) -> float:
+        """Take a request token of the account, returning how long to wait for it."""
+        delay = self.wait_time(client_id)
+        self._bucket(client_id).tokens -= 1
+        return delay
+
+    def record_success(self, client_id: str, model: str) -> None:
+        """Reset the failures of the pair and speed the account pacing back up."""
+        if state := self._states.get((client_id, model)):
+            state.failures = 0
+            state.cooldowns = 0
+        bucket = self._bucket(client_id)
+        bucket.rate = min(g_config.quota.requests_per_minute, bucket.rate + 1)
+
+    def record_failure(self, client_id: str, model: str, exc: BaseException) -> None:
+        """Classify an upstream failure and cool the account down if needed."""
+        config = g_config.quota
+        state = self._state(client_id, model)
+        now = time.monotonic()
+
+        if isinstance(exc, UsageLimitExceeded):
+            duration = config.usage_limit_cooldown
+            state.cooldown_until = now + duration
+            reason = "usage_limit"
+        elif isinstance(exc, TemporarilyBlocked):
+            duration = min(config.max_cooldown, config.blocked_cooldown * 2**state.cooldowns)
+            self._blocked_until[client_id] = now + duration
+            state.cooldowns += 1
+            reason = "blocked"
+        elif isinstance(exc, GeminiError):
+            state.failures += 1
+            if state.failures < config.failure_threshold:
+                return
+            duration = min(config.max_cooldown, config.failure_cooldown * 2**state.cooldowns)
+            state.cooldown_until = now + duration
+            state.cooldowns += 1
+            state.failures = 0
+            reason = "failures"
+        else:
+            # Client side or transport errors say nothing about the account quota
+            return
+
+        if reason != "failures":
+            _rate_limited.inc(client=client_id, model=model, reason=reason)
+            bucket = self._bucket(client_id)
+            bucket.rate = max(config.min_requests_per_minute, bucket.rate / 2)
+
+        _cooldowns.inc(client=client_id, model=model, reason=reason)
+        logger.warning(
+            f"Client {client_id} cooled down for {duration:.0f}s on model {model} ({reason}): {exc}"
+        )
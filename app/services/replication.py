@@ -0,0 +1,114 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import httpx
+import orjson
+from loguru import logger
+
+from ..utils import g_config
+from ..utils.metrics import counter
+from ..utils.singleton import Singleton
+from .storage import get_conversation_store, local_node_id
+
+_applied = counter(
+    "gemini_replication_applied_total", "Changes received from peers and applied locally"
+)
+_errors = counter("gemini_replication_errors_total", "Failed polls of the peers' change feeds")
+
+
+class ChangeFeedPuller(metaclass=Singleton):
+    """
+    Follow the change feeds of the configured peers and apply their changes locally.
+
+    Each peer is polled by its own task. The sequence number of the last applied change
+    is persisted per peer, so that a restarted node resumes where it stopped.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: List[asyncio.Task] = []
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def start(self) -> None:
+        """Start following every configured peer."""
+        config = g_config.replication
+        if not config.enabled or not config.peers or self._tasks:
+            return
+
+        headers: Dict[str, str] = {}
+        if config.peer_key:
+            headers["Authorization"] = f"Bearer {config.peer_key}"
+        self._client = httpx.AsyncClient(headers=headers, timeout=httpx.Timeout(30.0, connect=5.0))
+        self._tasks = [asyncio.create_task(self._follow(peer.rstrip("/"))) for peer in config.peers]
+        logger.info(f"Following the change feeds of {len(self._tasks)} peers as {local_node_id()}")
+
+    async def shutdown(self) -> None:
+        """Stop following the peers."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _follow(self, peer: str) -> None:
+        config = g_config.replication
+        db = get_conversation_store()
+        node_id = local_node_id()
+        since = db.get_peer_cursor(peer)
+        failures = 0
+
+        while True:
+            try:
+                assert self._client
+                response = await self._client.get(
+                    f"{peer}/admin/changes", params={"since": since, "limit": config.batch_size}
+                )
+                response.raise_for_status()
+            except Exception as e:
+                _errors.inc(peer=peer)
+                failures += 1
+                if failures == 1:
+                    logger.warning(f"Failed to read the change feed of {peer}: {e}")
+                await asyncio.sleep(min(config.poll_interval * 2**failures, 60.0))
+                continue
+
+            if failures:
+                logger.info(f"Change feed of {peer} is reachable again")
+                failures = 0
+
+            last_sequence = int(response.headers.get("X-Last-Sequence", 0))
+            if last_sequence < since:
+                # The store of the peer was reset, start over from its first change
+                logger.warning(f"Change feed of {peer} restarted at {last_sequence}, resyncing")
+                since = 0
+                continue
+
+            changes = [orjson.loads(line) for line in response.content.splitlines() if line]
+            if changes and changes[0]["seq"] > since + 1 and since > 0:
+                logger.warning(
+                    f"Missed changes {since + 1} to {changes[0]['seq'] - 1} of {peer}, "
+                    "they were trimmed from its feed"
+                )
+
+            applied = 0
+            for change in changes:
+                # Changes made here come back through peers which applied them
+                if change.get("origin") != node_id:
+                    try:
+                        applied += db.apply_change(change)
+                    except Exception as e:
+                        logger.error(f"Failed to apply change {change['seq']} of {peer}: {e}")
+                since = change["seq"]
+
+            if changes:
+                db.save_peer_cursor(peer, since)
+                if applied:
+                    _applied.inc(applied, peer=peer)
+                    logger.debug(f"Applied {applied} of {len(changes)} changes from {peer}")
+
+            if len(changes) < config.batch_size:
+                await asyncio.sleep(config.poll_interval)
+            else:
+                # Let request handlers run between large batches
+                await asyncio.sleep(0)
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Optional
+
+from loguru import logger
+
+from ..utils import access_log, deadline, g_config
+from ..utils.metrics import counter
+from ..utils.singleton import Singleton
+from .pool import GeminiClientPool
+
+# Tenant of the requests authenticated by `server.api_key`, or not authenticated at all
+DEFAULT_TENANT = "default"
+
+# Concurrent generations per client of the worker when `server.max_concurrency` is unset
+SLOTS_PER_CLIENT = 4
+
+_requests = counter("gemini_tenant_requests_total", "Requests scheduled per API key and outcome")
+_request_seconds = counter(
+    "gemini_tenant_request_seconds_total", "Seconds spent generating the requests of an API key"
+)
+_queue_seconds = counter(
+    "gemini_tenant_queue_seconds_total", "Seconds the requests of an API key waited for a slot"
+)
+
+
+@dataclass
+class _Tenant:
+    weight: float
+    max_concurrency: Optional[int]
+    in_flight: int = 0
+    # Virtual time of the next request, advanced by 1 / weight per started request
+    virtual_time: float = 0.0
+    waiters: deque[asyncio.Future] = field(default_factory=deque)
+
+    def eligible(self) -> bool:
+        return bool(self.waiters) and (
+            self.max_concurrency is None or self.in_flight < self.max_concurrency
+        )
+
+
+class FairScheduler(metaclass=Singleton):
+    """
+    Share the generation capacity of a worker between API keys.
+
+    At most `capacity` requests are generated at once. Beyond it, requests wait in one
+    queue per API key, and freed slots go to the key with the lowest virtual time, which
+    advances by the inverse of its weight with every started request: under contention,
+    keys get slots in proportion to their weights, whatever the number of requests they
+    queue. A key never runs more than its own `max_concurrency` requests at once.
+    """
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        self._capacity = capacity
+        self._tenants: Dict[str, _Tenant] = {}
+        self._in_flight = 0
+        self._virtual_clock = 0.0
+
+    @property
+    def capacity(self) -> int:
+        if self._capacity is None:
+            self._capacity = g_config.server.max_concurrency or SLOTS_PER_CLIENT * len(
+                GeminiClientPool().clients
+            )
+        return self._capacity
+
+    def expected_wait(self, service_time: float) -> float:
+        """
+        Estimate how long a new request waits for a slot, when requests are generated in
+        `service_time` seconds: slots free up at `capacity / service_time` per second.
+        """
+        if self._in_flight < self.capacity:
+            return 0.0
+        queued = sum(len(t.waiters) for t in self._tenants.values())
+        return service_time * (queued + 1) / self.capacity
+
+    def _tenant(self, name: str) -> _Tenant:
+        if (tenant := self._tenants.get(name)) is None:
+            settings = next((k for k in g_config.server.api_keys if k.name == name), None)
+            tenant = _Tenant(
+                weight=settings.weight if settings else 1.0,
+                max_concurrency=settings.max_concurrency if settings else None,
+            )
+            self._tenants[name] = tenant
+        return tenant
+
+    def _start(self, tenant: _Tenant) -> None:
+        tenant.in_flight += 1
+        tenant.virtual_time += 1 / tenant.weight
+        self._in_flight += 1
+
+    def _release(self, tenant: _Tenant) -> None:
+        tenant.in_flight -= 1
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand the free slots to the waiting tenants with the lowest virtual time."""
+        while self._in_flight < self.capacity:
+            eligible = [t for t in self._tenants.values() if t.eligible()]
+            if not eligible:
+                return
+            tenant = min(eligible, key=lambda t: t.virtual_time)
+            waiter = tenant.waiters.popleft()
+            if waiter.done():
+                # Cancelled in the same loop step, its request no longer needs the slot
+                continue
+            self._virtual_clock = tenant.virtual_time
+            self._start(tenant)
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, name: str) -> AsyncIterator[None]:
+        """Wait for a generation slot of the tenant and hold it for the duration of the block."""
+        tenant = self._tenant(name)
+        if not tenant.waiters and not tenant.in_flight:
+            # An idle tenant does not bank the share it left unused
+            tenant.virtual_time = max(tenant.virtual_time, self._virtual_clock)
+
+        queued = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        tenant.waiters.append(waiter)
+        self._dispatch()
+        try:
+            await deadline.within(waiter, "queue")
+        except (asyncio.CancelledError, deadline.DeadlineExceeded) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted as the request got cancelled
+                self._release(tenant)
+            elif waiter in tenant.waiters:
+                # Unless already dropped by `_dispatch`
+                tenant.waiters.remove(waiter)
+            shed = isinstance(e, deadline.DeadlineExceeded)
+            _requests.inc(tenant=name, status="shed" if shed else "cancelled")
+            raise
+
+        started = time.monotonic()
+        if (waited := started - queued) > 1:
+            logger.debug("Request of {} waited {:.2f}s for a generation slot", name, waited)
+        _queue_seconds.inc(waited, tenant=name)
+        access_log.add_stage("queue", waited)
+
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._release(tenant)
+            _requests.inc(tenant=name, status=outcome)
+            _request_seconds.inc(time.monotonic() - started, tenant=name)
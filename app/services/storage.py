@@ -0,0 +1,585 @@
+import base64
+import hashlib
+import re
+import socket
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+from loguru import logger
+
+from ..models import ContentItem, ConversationInStore, Message
+from ..utils import g_config
+
+# Attachments are stored once, stored messages refer to them as `blob:<sha256 of the data>`
+BLOB_REF_PREFIX = "blob:"
+
+# Content item types carrying attachments, with the field and key holding their data
+_ATTACHMENT_FIELDS = {"image_url": ("image_url", "url"), "file": ("file", "file_data")}
+
+
+def _externalize_item(item: ContentItem, blobs: Dict[str, str]) -> ContentItem:
+    """Replace the inline data of an attachment with a reference to its blob."""
+    if item.type not in _ATTACHMENT_FIELDS:
+        return item
+    field, key = _ATTACHMENT_FIELDS[item.type]
+    payload = getattr(item, field) or {}
+    data = payload.get(key)
+    if not data or data.startswith(BLOB_REF_PREFIX):
+        return item
+    # Remote image URLs are small, only inline images are externalized
+    if field == "image_url" and not data.startswith("data:"):
+        return item
+    digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+    blobs[digest] = data
+    return item.model_copy(update={field: {**payload, key: f"{BLOB_REF_PREFIX}{digest}"}})
+
+
+def _externalize(message: Message) -> Tuple[Message, Dict[str, str]]:
+    """
+    Return the message as stored, with its attachments replaced by references, together
+    with the attachments by digest. Computed once per message object.
+    """
+    if isinstance(message.content, str):
+        return message, {}
+    if message._external is None:
+        blobs: Dict[str, str] = {}
+        items = [_externalize_item(item, blobs) for item in message.content]
+        if not blobs:
+            return message, {}
+        external = Message(role=message.role, content=items, name=message.name)
+        message._external = (external, blobs)
+    return message._external
+
+
+def _hash_message(message: Message) -> str:
+    """Generate a hash for a single message, computed once per message object."""
+    if message._digest is None:
+        # Attachments are hashed by reference, as they are stored
+        stored, _ = _externalize(message)
+        # Convert message to dict and sort keys for consistent hashing
+        message_dict = stored.model_dump(mode="json")
+        message_bytes = orjson.dumps(message_dict, option=orjson.OPT_SORT_KEYS)
+        message._digest = hashlib.sha256(message_bytes).hexdigest()
+    return message._digest
+
+
+def _combine_hashes(client_id: str, model: str, message_hashes: Iterable[str]) -> str:
+    """Combine the hashes of the messages of a history with its client id and model."""
+    combined_hash = hashlib.sha256()
+    combined_hash.update(client_id.encode("utf-8"))
+    combined_hash.update(model.encode("utf-8"))
+    for message_hash in message_hashes:
+        combined_hash.update(message_hash.encode("utf-8"))
+    return combined_hash.hexdigest()
+
+
+def _hash_conversation(client_id: str, model: str, messages: List[Message]) -> str:
+    """Generate a hash for a list of messages and client id."""
+    # Create a combined hash from all individual message hashes
+    return _combine_hashes(client_id, model, (_hash_message(m) for m in messages))
+
+
+def hash_messages(messages: Iterable[Message]) -> str:
+    """Hash a sequence of messages the way the store hashes histories, for any client and model."""
+    return _combine_hashes("", "", (_hash_message(m) for m in messages))
+
+
+def local_node_id() -> str:
+    """Name of this node in the change feed, used to skip changes that originate here."""
+    return g_config.replication.node_id or f"{socket.gethostname()}:{g_config.server.port}"
+
+
+class StorageFull(Exception):
+    """Raised by `ConversationStore.store` when there is no room left for the conversation."""
+
+
+class CompactionUnsupported(Exception):
+    """Raised by `ConversationStore.compact` on backends with no free space to return."""
+
+
+class ConversationStore(ABC):
+    """
+    Interface of the conversation storage backends.
+
+    Backends implement the abstract key-value operations, while lookups by message
+    history, summary filtering and pagination are shared.
+    """
+
+    HASH_LOOKUP_PREFIX = "hash:"
+
+    # Maximum number of summaries examined to fill one page of a filtered listing
+    MAX_SCAN_PER_PAGE = 10000
+
+    @abstractmethod
+    def store(
+        self,
+        conv: ConversationInStore,
+        custom_key: Optional[str] = None,
+        visible_messages: Optional[List[Message]] = None,
+    ) -> str:
+        """
+        Store a conversation and return its key.
+
+        `visible_messages` is the history as the client sees it, with the thoughts that are
+        not stored, indexed as well so that `find` resolves it on the first probe.
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[ConversationInStore]:
+        """Retrieve a conversation by key."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Check if a key exists in the store."""
+
+    @abstractmethod
+    def delete(self, key: str) -> Optional[ConversationInStore]:
+        """Delete a conversation by key and return it."""
+
+    @abstractmethod
+    def delete_many(self, keys: List[str]) -> int:
+        """Delete several conversations and return how many were deleted."""
+
+    @abstractmethod
+    def get_blob(self, digest: str) -> Optional[str]:
+        """Return the data of a stored attachment, or None if not found."""
+
+    @abstractmethod
+    def _lookup_hash(self, message_hash: str) -> Optional[str]:
+        """Return the key of the conversation stored under the given history hash."""
+
+    @abstractmethod
+    def _iter_summaries(
+        self, prefix: bytes = b"", start_after: Optional[bytes] = None
+    ) -> Iterator[Tuple[bytes, Dict[str, Any]]]:
+        """Iterate over conversation summaries in key order."""
+
+    @abstractmethod
+    def save_client_state(self, client_id: str, state: Dict[str, Any]) -> None:
+        """Persist the session state of a Gemini client."""
+
+    @abstractmethod
+    def load_client_state(self, client_id: str) -> Optional[Dict[str, Any]]:
+        """Load the persisted session state of a Gemini client."""
+
+    @abstractmethod
+    def save_batch(self, batch: Dict[str, Any], inputs: Optional[List[bytes]] = None) -> None:
+        """Persist the metadata of a batch, together with its input lines if provided."""
+
+    @abstractmethod
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Return the metadata of a batch, or None if not found."""
+
+    @abstractmethod
+    def list_batches(self) -> List[Dict[str, Any]]:
+        """Return the metadata of every batch."""
+
+    @abstractmethod
+    def iter_batch_inputs(self, batch_id: str) -> Iterator[Tuple[int, bytes]]:
+        """Iterate over the input lines of a batch as (index, line) pairs."""
+
+    @abstractmethod
+    def save_batch_result(self, batch: Dict[str, Any], index: int, result: bytes) -> None:
+        """Checkpoint the result of one batch item together with the updated batch metadata."""
+
+    @abstractmethod
+    def delete_batch(self, batch_id: str) -> bool:
+        """Delete a batch with its inputs and results, return whether it existed."""
+
+    @abstractmethod
+    def iter_batch_results(
+        self, batch_id: str, start_after: Optional[int] = None
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Iterate over the checkpointed results of a batch as (index, line) pairs."""
+
+    @abstractmethod
+    def last_sequence(self) -> int:
+        """Return the sequence number of the latest change, 0 if the feed is empty."""
+
+    @abstractmethod
+    def iter_changes(self, since: int = 0, limit: int = 500) -> Iterator[Dict[str, Any]]:
+        """Iterate over the changes recorded after the given sequence number."""
+
+    @abstractmethod
+    def apply_change(self, change: Dict[str, Any]) -> bool:
+        """Apply a change received from a peer, return whether the store was modified."""
+
+    @abstractmethod
+    def get_peer_cursor(self, peer: str) -> int:
+        """Return the sequence number of the last change applied from a peer."""
+
+    @abstractmethod
+    def save_peer_cursor(self, peer: str, sequence: int) -> None:
+        """Persist the sequence number of the last change applied from a peer."""
+
+    @abstractmethod
+    def compact(self) -> Dict[str, int]:
+        """
+        Return the free space of the store to the filesystem, reporting the bytes reclaimed.
+
+        Raises:
+            CompactionUnsupported: If the backend cannot be compacted
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Get storage statistics."""
+
+    def make_room(self) -> None:
+        """
+        Free space after `store` raised `StorageFull`. Blocking, to be run off the event loop.
+
+        Optional: backends that never raise `StorageFull` do not override it.
+        """
+
+    def close(self) -> None:
+        """Release the resources of the store."""
+
+    def find(self, model: str, messages: List[Message]) -> Optional[ConversationInStore]:
+        """
+        Search conversation data by message list.
+
+        Args:
+            model: Model name of the conversations
+            messages: List of messages to search for
+
+        Returns:
+            Conversation or None if not found
+        """
+        if not messages:
+            return None
+
+        # Messages are hashed once, only the cheap combination is repeated per client
+        message_hashes = [_hash_message(m) for m in messages]
+
+        # --- Find with raw messages ---
+        if conv := self._find_by_hashes(model, message_hashes):
+            logger.debug("Found conversation with raw message history.")
+            return conv
+
+        # --- Find with cleaned messages ---
+        cleaned_messages = self.sanitize_assistant_messages(messages)
+        changed = [i for i, m in enumerate(cleaned_messages) if m is not messages[i]]
+        if not changed:
+            logger.debug("No conversation found for the message history.")
+            return None
+
+        for i in changed:
+            message_hashes[i] = _hash_message(cleaned_messages[i])
+        if conv := self._find_by_hashes(model, message_hashes):
+            logger.debug("Found conversation with cleaned message history.")
+            return conv
+
+        logger.debug("No conversation found for either raw or cleaned history.")
+        return None
+
+    def _find_by_hashes(
+        self, model: str, message_hashes: List[str]
+    ) -> Optional[ConversationInStore]:
+        """Internal find implementation based on the hashes of a message list."""
+        for c in g_config.gemini.clients:
+            message_hash = _combine_hashes(c.id, model, message_hashes)
+
+            try:
+                if mapped := self._lookup_hash(message_hash):
+                    conv = self.get(mapped)
+                    return self._branch(conv, len(message_hashes)) if conv else None
+            except Exception as e:
+                logger.error(
+                    f"Failed to retrieve messages by message list for hash {message_hash} and client {c.id}: {e}"
+                )
+                continue
+
+            if conv := self.get(message_hash):
+                return conv
+        return None
+
+    def keys(self, prefix: str = "", limit: Optional[int] = None) -> List[str]:
+        """
+        List all keys in the store, optionally filtered by prefix.
+
+        Args:
+            prefix: Optional prefix to filter keys
+            limit: Optional limit on number of keys returned
+
+        Returns:
+            List of keys
+        """
+        keys = []
+        try:
+            for key, _ in self._iter_summaries(prefix.encode("utf-8")):
+                keys.append(key.decode("utf-8"))
+                if limit and len(keys) >= limit:
+                    break
+        except Exception as e:
+            logger.error(f"Failed to list keys: {e}")
+
+        return keys
+
+    def list_conversations(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        client_id: Optional[str] = None,
+        model: Optional[str] = None,
+        updated_before: Optional[datetime] = None,
+        updated_after: Optional[datetime] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        List conversation summaries in key order, one page at a time.
+
+        Args:
+            cursor: Opaque cursor returned with the previous page
+            limit: Maximum number of summaries returned
+            client_id: Only list conversations of this client
+            model: Only list conversations of this model
+            updated_before: Only list conversations last updated before this time
+            updated_after: Only list conversations last updated after this time
+
+        Returns:
+            tuple: The summaries, and the cursor of the next page or None on the last page
+        """
+        start_after = self._decode_cursor(cursor) if cursor else None
+
+        summaries: List[Dict[str, Any]] = []
+        scanned = 0
+        last_key = None
+        for key, summary in self._iter_summaries(start_after=start_after):
+            last_key = key
+            scanned += 1
+            if self._match_summary(summary, client_id, model, updated_before, updated_after):
+                summaries.append(summary)
+                if len(summaries) >= limit:
+                    break
+            # Return a partial page for sparse filters rather than scanning the whole store
+            if scanned >= self.MAX_SCAN_PER_PAGE:
+                break
+        else:
+            return summaries, None
+
+        return summaries, self._encode_cursor(last_key)
+
+    def load_attachments(self, conv: ConversationInStore) -> ConversationInStore:
+        """Return the conversation with the references to its attachments replaced by data."""
+        messages = []
+        for message in conv.messages:
+            if isinstance(message.content, str):
+                messages.append(message)
+                continue
+            items = []
+            for item in message.content:
+                field, key = _ATTACHMENT_FIELDS.get(item.type, (None, None))
+                payload = getattr(item, field) if field else None
+                ref = payload.get(key, "") if payload else ""
+                if ref.startswith(BLOB_REF_PREFIX) and (
+                    data := self.get_blob(ref[len(BLOB_REF_PREFIX) :])
+                ):
+                    item = item.model_copy(update={field: {**payload, key: data}})
+                items.append(item)
+            messages.append(Message(role=message.role, content=items, name=message.name))
+        return conv.model_copy(update={"messages": messages})
+
+    @staticmethod
+    def _externalize(conv: ConversationInStore) -> Tuple[ConversationInStore, Dict[str, str]]:
+        """
+        Return the conversation as stored, with its attachments replaced by references,
+        together with the attachments by digest.
+        """
+        messages = []
+        blobs: Dict[str, str] = {}
+        for message in conv.messages:
+            stored, attachments = _externalize(message)
+            messages.append(stored)
+            blobs.update(attachments)
+        if not blobs:
+            return conv, {}
+        return conv.model_copy(update={"messages": messages}), blobs
+
+    @staticmethod
+    def _referenced_blobs(conv: ConversationInStore) -> List[str]:
+        """Return the digests of the attachments a stored conversation refers to."""
+        digests: List[str] = []
+        for message in conv.messages:
+            if isinstance(message.content, str):
+                continue
+            for item in message.content:
+                field, key = _ATTACHMENT_FIELDS.get(item.type, (None, None))
+                payload = getattr(item, field) if field else None
+                ref = payload.get(key, "") if payload else ""
+                if ref.startswith(BLOB_REF_PREFIX) and ref[len(BLOB_REF_PREFIX) :] not in digests:
+                    digests.append(ref[len(BLOB_REF_PREFIX) :])
+        return digests
+
+    @classmethod
+    def _decode_change(
+        cls, change: Dict[str, Any]
+    ) -> Tuple[ConversationInStore, Dict[str, str], bytes]:
+        """
+        Decode the conversation of a replicated put, with the attachments it refers to.
+
+        Peers running an older version send attachments inline, they are externalized here.
+        """
+        conv, inline = cls._externalize(ConversationInStore.model_validate(change["value"]))
+        value = orjson.dumps(conv.model_dump(mode="json") if inline else change["value"])
+        return conv, {**change.get("blobs", {}), **inline}, value
+
+    @staticmethod
+    def _index_hashes(
+        conv: ConversationInStore, visible_messages: Optional[List[Message]] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Hash the history of a conversation, and its visible form when it differs.
+
+        When the conversation knows the session state before its last turn, the history
+        without that turn is indexed as well, in both forms: a regenerated or edited last
+        turn is then found here and branches from the parent state, even once the
+        conversation stored by the previous turn is gone.
+
+        Returns:
+            tuple: The history hash, and the hashes of the other forms to index
+        """
+        hashes = [_hash_message(m) for m in conv.messages]
+        message_hash = _combine_hashes(conv.client_id, conv.model, hashes)
+
+        forms = [hashes]
+        if visible_messages:
+            # Messages left untouched by sanitizing are the same objects, reuse their hashes
+            if len(visible_messages) == len(hashes):
+                forms.append(
+                    [
+                        h if v is m else _hash_message(v)
+                        for v, m, h in zip(visible_messages, conv.messages, hashes)
+                    ]
+                )
+            else:
+                forms.append([_hash_message(v) for v in visible_messages])
+        if conv.parent_metadata is not None and len(hashes) > 2:
+            forms.extend([form[:-2] for form in forms])
+
+        aliases: List[str] = []
+        for form in forms[1:]:
+            alias = _combine_hashes(conv.client_id, conv.model, form)
+            if alias != message_hash and alias not in aliases:
+                aliases.append(alias)
+        return message_hash, aliases
+
+    @staticmethod
+    def _branch(conv: ConversationInStore, length: int) -> ConversationInStore:
+        """
+        Return the conversation as it was before its last turn when `length` messages were
+        looked up: the history found by a regenerated or edited last turn, whose session
+        state is the parent one.
+        """
+        if length == len(conv.messages) - 2 and conv.parent_metadata is not None:
+            return conv.model_copy(
+                update={
+                    "messages": conv.messages[:length],
+                    "metadata": conv.parent_metadata,
+                    "parent_metadata": None,
+                }
+            )
+        return conv
+
+    @staticmethod
+    def _is_newer(incoming: Dict[str, Any], existing: Optional[Dict[str, Any]]) -> bool:
+        """Check whether a replicated conversation is newer than the local copy."""
+        if not existing or not existing.get("updated_at"):
+            return True
+        if not incoming.get("updated_at"):
+            return False
+        return datetime.fromisoformat(incoming["updated_at"]) > datetime.fromisoformat(
+            existing["updated_at"]
+        )
+
+    @staticmethod
+    def _summarize(key: str, conv: ConversationInStore, value: bytes) -> Dict[str, Any]:
+        """Build the summary of a conversation, listed without decoding its history."""
+        return {
+            "key": key,
+            "client_id": conv.client_id,
+            "model": conv.model,
+            "messages": len(conv.messages),
+            "size": len(value),
+            "created_at": conv.created_at.isoformat() if conv.created_at else None,
+            "updated_at": conv.updated_at.isoformat() if conv.updated_at else None,
+        }
+
+    @staticmethod
+    def _match_summary(
+        summary: Dict[str, Any],
+        client_id: Optional[str],
+        model: Optional[str],
+        updated_before: Optional[datetime],
+        updated_after: Optional[datetime],
+    ) -> bool:
+        if client_id and summary["client_id"] != client_id:
+            return False
+        if model and summary["model"] != model:
+            return False
+        if updated_before or updated_after:
+            timestamp = summary.get("updated_at") or summary.get("created_at")
+            if not timestamp:
+                return False
+            updated_at = datetime.fromisoformat(timestamp)
+            if updated_before and updated_at >= updated_before:
+                return False
+            if updated_after and updated_at <= updated_after:
+                return False
+        return True
+
+    @staticmethod
+    def _encode_cursor(key: bytes) -> str:
+        return base64.urlsafe_b64encode(key).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> bytes:
+        try:
+            key = base64.b64decode(cursor + "=" * (-len(cursor) % 4), b"-_", validate=True)
+        except ValueError as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+        if not key:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return key
+
+    @staticmethod
+    def remove_think_tags(text: str) -> str:
+        """
+        Remove <think>...</think> tags at the start of text and strip whitespace.
+        """
+        cleaned_content = re.sub(r"^(\s*<think>.*?</think>\n?)", "", text, flags=re.DOTALL)
+        return cleaned_content.strip()
+
+    @staticmethod
+    def sanitize_assistant_messages(messages: list[Message]) -> list[Message]:
+        """
+        Create a new list of messages with assistant content cleaned of <think> tags.
+        This is useful for store the chat history.
+        """
+        cleaned_messages = []
+        for msg in messages:
+            if msg.role == "assistant" and isinstance(msg.content, str):
+                normalized_content = ConversationStore.remove_think_tags(msg.content)
+                # Only create a new object if content actually changed
+                if normalized_content != msg.content:
+                    cleaned_msg = Message(role=msg.role, content=normalized_content, name=msg.name)
+                    cleaned_messages.append(cleaned_msg)
+                else:
+                    cleaned_messages.append(msg)
+            else:
+                cleaned_messages.append(msg)
+
+        return cleaned_messages
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the conversation store of the backend selected by `storage.backend`."""
+    if g_config.storage.backend == "memory":
+        from .memory import MemoryConversationStore
+
+        return MemoryConversationStore()
+
+    from .lmdb import LMDBConversationStore
+
+    return LMDBConversationStore()
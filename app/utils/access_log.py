@@ -0,0 +1,74 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+import orjson
+from loguru import logger
+
+# Records bound with this key go to the access log sink only
+ACCESS_LOG_EXTRA = "access_log"
+
+_access_logger = logger.bind(**{ACCESS_LOG_EXTRA: True})
+
+# Entry of the request being served, None when the access log is disabled
+_entry: ContextVar[Optional[Dict[str, Any]]] = ContextVar("access_log_entry", default=None)
+
+
+def begin(method: str, path: str) -> Dict[str, Any]:
+    """Start the access log entry of a request, which the handlers annotate."""
+    entry: Dict[str, Any] = {
+        "ts": datetime.now(tz=timezone.utc).isoformat(timespec="milliseconds"),
+        "method": method,
+        "path": path,
+        "status": None,
+        "bytes_in": 0,
+        "bytes_out": 0,
+        "_started": time.perf_counter(),
+    }
+    entry["_token"] = _entry.set(entry)
+    return entry
+
+
+def finish(entry: Dict[str, Any], sample_rate: float) -> None:
+    """Write the entry of a finished request, if it is sampled or failed."""
+    _entry.reset(entry.pop("_token"))
+    duration = time.perf_counter() - entry.pop("_started")
+    if entry["status"] is None:
+        # The request failed before a response was started
+        entry["status"] = 500
+    elif entry["status"] < 400 and random.random() >= sample_rate:
+        return
+    entry["duration_ms"] = round(duration * 1000, 3)
+    _access_logger.info(orjson.dumps(entry).decode("utf-8"))
+
+
+def annotate(**fields: Any) -> None:
+    """Add fields to the access log entry of the current request."""
+    if (entry := _entry.get()) is not None:
+        entry.update(fields)
+
+
+def add_stage(name: str, seconds: float) -> None:
+    """
+    Add the duration of a stage to the current entry, in milliseconds. Stages run by
+    parallel tasks of the request, e.g. hedged calls, are summed.
+    """
+    if (entry := _entry.get()) is not None:
+        stages = entry.setdefault("stages_ms", {})
+        stages[name] = round(stages.get(name, 0.0) + seconds * 1000, 3)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as a stage of the current request."""
+    if _entry.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - started)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import orjson
+from loguru import logger
+
+from ..models import Message
+
+# Records bound with this key go to the capture sink only
+CAPTURE_EXTRA = "capture"
+
+_capture_logger = logger.bind(**{CAPTURE_EXTRA: True})
+
+# Conversations are identified by a salted digest, which cannot be matched across files
+_SALT = os.urandom(16)
+
+# Conversations whose last request time is remembered, to measure the time between turns
+_MAX_THREADS = 100_000
+
+_last_seen: OrderedDict[str, float] = OrderedDict()
+
+# Entry of the chat request being served, None when the capture is disabled
+_entry: ContextVar[Optional[Dict[str, Any]]] = ContextVar("capture_entry", default=None)
+
+
+def _attachment_bytes(data: str) -> int:
+    """Decoded size of base64 data, with or without a `data:` URL header."""
+    return len(data.partition(",")[2] if data.startswith("data:") else data) * 3 // 4
+
+
+def message_shape(message: Message) -> Dict[str, Any]:
+    """Describe a message by its role and sizes, without any of its content."""
+    if isinstance(message.content, str):
+        return {"role": message.role, "chars": len(message.content)}
+
+    chars = 0
+    attachments: List[Dict[str, Any]] = []
+    for item in message.content:
+        if item.type == "text":
+            chars += len(item.text or "")
+        elif item.type == "image_url" and item.image_url:
+            url = item.image_url.get("url", "")
+            if url.startswith("data:"):
+                attachments.append({"type": "image_url", "bytes": _attachment_bytes(url)})
+            else:
+                attachments.append({"type": "image_url", "remote": True})
+        elif item.type == "file" and item.file:
+            data = item.file.get("file_data", "")
+            attachments.append({"type": "file", "bytes": _attachment_bytes(data)})
+    shape: Dict[str, Any] = {"role": message.role, "chars": chars}
+    if attachments:
+        shape["attachments"] = attachments
+    return shape
+
+
+def begin() -> Dict[str, Any]:
+    """Start the capture entry of a chat request, which the handlers describe."""
+    entry: Dict[str, Any] = {"_started": time.perf_counter()}
+    entry["_token"] = _entry.set(entry)
+    return entry
+
+
+def describe(thread_key: str, messages: List[Message], sample_rate: float, **fields: Any) -> None:
+    """
+    Record the shape of the current chat request.
+
+    Requests are sampled by conversation, identified by `thread_key`, so that sampled
+    conversations are captured with all their turns.
+    """
+    if (entry := _entry.get()) is None:
+        return
+    thread = hashlib.blake2b(_SALT + thread_key.encode("utf-8"), digest_size=8).hexdigest()
+    if int(thread, 16) / 2**64 >= sample_rate:
+        entry["_skip"] = True
+        return
+
+    now = time.monotonic()
+    previous = _last_seen.pop(thread, None)
+    _last_seen[thread] = now
+    if len(_last_seen) > _MAX_THREADS:
+        _last_seen.popitem(last=False)
+
+    entry.update(
+        ts=datetime.now(tz=timezone.utc).isoformat(timespec="milliseconds"),
+        thread=thread,
+        since_previous_s=round(now - previous, 3) if previous is not None else None,
+        messages=[message_shape(m) for m in messages],
+        **fields,
+    )
+
+
+def annotate(**fields: Any) -> None:
+    """Add outcome fields to the capture entry of the current chat request."""
+    if (entry := _entry.get()) is not None:
+        entry.update(fields)
+
+
+def finish(entry: Dict[str, Any], status: Optional[int]) -> None:
+    """Write the entry of a finished chat request, unless it was not sampled or described."""
+    _entry.reset(entry.pop("_token"))
+    if entry.pop("_skip", False) or "messages" not in entry:
+        return
+    entry["status"] = status or 500
+    entry["duration_ms"] = round((time.perf_counter() - entry.pop("_started")) * 1000, 3)
+    _capture_logger.info(orjson.dumps(entry).decode("utf-8"))
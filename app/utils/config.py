@@ -3,7 +3,7 @@ import sys
 from typing import Literal, Optional
 
 from loguru import logger
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field, ValidationError, model_validator
 from pydantic_settings import (
     BaseSettings,
     SettingsConfigDict,
@@ -13,6 +13,19 @@ from pydantic_settings import (
 CONFIG_PATH = "config/config.yaml"
 
 
+class APIKeySettings(BaseModel):
+    """API key of one tenant sharing the server."""
+
+    name: str = Field(..., description="Name of the tenant, used in logs and metrics")
+    key: str = Field(..., description="API key of the tenant")
+    weight: float = Field(
+        default=1.0, gt=0, description="Share of the generation capacity under contention"
+    )
+    max_concurrency: Optional[int] = Field(
+        default=None, ge=1, description="Maximum requests of the tenant generated at once"
+    )
+
+
 class ServerConfig(BaseModel):
     """Server configuration"""
 
@@ -22,6 +35,33 @@ class ServerConfig(BaseModel):
         default=None,
         description="API key for authentication, if set, will enable API key validation",
     )
+    api_keys: list[APIKeySettings] = Field(
+        default=[],
+        description="API keys of the tenants sharing the server, accepted along with api_key",
+    )
+    max_concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Requests generated at once by each worker, queued fairly between API keys "
+        "beyond it (defaults to 4 per client of the worker)",
+    )
+    admin_key: Optional[str] = Field(
+        default=None,
+        description="API key for the admin endpoints and /metrics, the admin API is disabled "
+        "and /metrics is public when unset",
+    )
+    workers: int = Field(
+        default=1,
+        ge=1,
+        description="Number of worker processes, Gemini clients are partitioned across workers",
+    )
+    handoff_port: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=65535,
+        description="Base loopback port for worker handoff, worker N listens on handoff_port + N "
+        "(defaults to port + 1)",
+    )
 
 
 class GeminiClientSettings(BaseModel):
@@ -44,6 +84,27 @@ class GeminiConfig(BaseModel):
         default=540, ge=1, description="Interval in seconds to refresh Gemini cookies"
     )
     verbose: bool = Field(False, description="Enable verbose logging for Gemini API requests")
+    persist_session: bool = Field(
+        False,
+        description="Persist refreshed cookies and access tokens in the storage, in plaintext, "
+        "and restore them at startup",
+    )
+    session_ttl: int = Field(
+        default=600,
+        ge=0,
+        description="Max age in seconds of a persisted access token that is reused without "
+        "a handshake, 0 to always perform the handshake",
+    )
+    lazy_init: bool = Field(
+        False,
+        description="Initialize each client on first use instead of at startup, "
+        "useful for serverless deployments",
+    )
+    max_choices: int = Field(
+        default=4,
+        ge=1,
+        description="Maximum number of choices (`n`) generated in parallel for one request",
+    )
 
 
 class CORSConfig(BaseModel):
@@ -63,8 +124,13 @@ class CORSConfig(BaseModel):
 
 
 class StorageConfig(BaseModel):
-    """LMDB Storage configuration"""
+    """Storage configuration"""
 
+    backend: Literal["lmdb", "memory"] = Field(
+        default="lmdb",
+        description="Storage backend, 'memory' keeps a bounded store in each process, "
+        "lost on restart",
+    )
     path: str = Field(
         default="data/lmdb",
         description="Path to the storage directory where data will be saved",
@@ -72,8 +138,214 @@ class StorageConfig(BaseModel):
     max_size: int = Field(
         default=1024**2 * 128,  # 128 MB
         ge=1,
-        description="Maximum size of the storage in bytes",
+        description="Maximum size of the storage in bytes, the memory backend evicts the "
+        "least recently used conversations beyond it",
+    )
+    evict_high_water: float = Field(
+        default=0.8,
+        gt=0.0,
+        le=1.0,
+        description="Fraction of max_size used by the LMDB backend above which the least "
+        "recently used conversations are evicted",
+    )
+    evict_low_water: float = Field(
+        default=0.6,
+        gt=0.0,
+        le=1.0,
+        description="Fraction of max_size the LMDB backend evicts down to",
+    )
+
+    @model_validator(mode="after")
+    def check_water_marks(self) -> "StorageConfig":
+        if self.evict_low_water >= self.evict_high_water:
+            raise ValueError("evict_low_water must be lower than evict_high_water")
+        return self
+
+
+class BatchConfig(BaseModel):
+    """Batch API configuration"""
+
+    concurrency: int = Field(
+        default=4, ge=1, description="Default number of batch requests processed concurrently"
+    )
+    account_interval: float = Field(
+        default=1.0,
+        ge=0,
+        description="Minimum interval in seconds between batch requests sent by the same account",
+    )
+    max_requests: int = Field(
+        default=50000, ge=1, description="Maximum number of requests in a single batch"
+    )
+    retention: int = Field(
+        default=604800,
+        ge=0,
+        description="Seconds a finished batch is kept with its inputs and results, "
+        "0 to keep finished batches until deleted",
+    )
+
+
+class QuotaConfig(BaseModel):
+    """Per-account pacing and cooldown of rate limited accounts"""
+
+    enabled: bool = Field(
+        default=False, description="Pace each account and route around exhausted accounts"
+    )
+    requests_per_minute: float = Field(
+        default=60.0, gt=0, description="Maximum request rate of one account"
+    )
+    min_requests_per_minute: float = Field(
+        default=2.0, gt=0, description="Lowest rate an account is slowed down to once limited"
+    )
+    burst: int = Field(default=10, ge=1, description="Requests an idle account may send at once")
+    usage_limit_cooldown: int = Field(
+        default=3600,
+        ge=0,
+        description="Seconds an account is not used for a model after hitting its usage limit",
+    )
+    blocked_cooldown: int = Field(
+        default=300,
+        ge=0,
+        description="Seconds an account is not used after being temporarily blocked, doubled "
+        "on each repeated block",
+    )
+    failure_threshold: int = Field(
+        default=3, ge=1, description="Consecutive upstream errors before cooling an account down"
+    )
+    failure_cooldown: int = Field(
+        default=30,
+        ge=0,
+        description="Seconds an account is not used for a model after repeated errors, doubled "
+        "on each repeated cooldown",
+    )
+    max_cooldown: int = Field(default=3600, ge=0, description="Upper bound of a cooldown")
+
+
+class HedgingConfig(BaseModel):
+    """Hedging of slow new sessions on a second client"""
+
+    enabled: bool = Field(
+        default=False,
+        description="Resend a new session to another idle client when the first one is slow",
+    )
+    percentile: float = Field(
+        default=95.0,
+        gt=0,
+        le=100,
+        description="Latency percentile of recent calls after which a request is hedged",
+    )
+    min_delay: float = Field(default=1.0, ge=0, description="Lower bound of the hedging delay")
+    max_delay: float = Field(default=30.0, ge=0, description="Upper bound of the hedging delay")
+    min_samples: int = Field(
+        default=20, ge=1, description="Latencies observed for a model before hedging it"
+    )
+    window: int = Field(
+        default=200, ge=1, description="Number of recent latencies kept for each model"
+    )
+
+
+class DeadlineConfig(BaseModel):
+    """Per-request deadlines and load shedding"""
+
+    header: str = Field(
+        default="X-Request-Timeout",
+        description="Request header holding the seconds the caller waits for the response",
+    )
+    default_timeout: Optional[float] = Field(
+        default=None,
+        gt=0,
+        description="Deadline in seconds of the requests without the header, none by default",
+    )
+    percentile: float = Field(
+        default=50.0,
+        gt=0,
+        le=100,
+        description="Latency percentile of recent calls a request is expected to take upstream",
+    )
+
+
+class ReplicationConfig(BaseModel):
+    """Replication of the conversation store between nodes"""
+
+    enabled: bool = Field(
+        default=False,
+        description="Record a change feed of conversation writes, served to peers on "
+        "/admin/changes, and follow the feeds of the configured peers",
+    )
+    node_id: Optional[str] = Field(
+        default=None, description="Unique name of this node, defaults to hostname:port"
+    )
+    peers: list[str] = Field(
+        default=[], description="Base URLs of the peers whose change feeds are followed"
+    )
+    peer_key: Optional[str] = Field(
+        default=None, description="Admin key used to read the change feeds of the peers"
+    )
+    poll_interval: float = Field(
+        default=1.0, gt=0, description="Seconds to wait before polling an idle peer again"
+    )
+    batch_size: int = Field(default=500, ge=1, description="Changes fetched per request")
+    retain_changes: int = Field(
+        default=100000, ge=1, description="Number of most recent changes kept in the feed"
+    )
+
+
+class CompactionConfig(BaseModel):
+    """History compaction configuration, applied when a conversation is sent in full"""
+
+    enabled: bool = Field(default=False, description="Enable history compaction")
+    max_prompt_tokens: int = Field(
+        default=32000,
+        ge=1,
+        description="Estimated prompt size in tokens above which older turns are compacted",
+    )
+    keep_recent: int = Field(
+        default=6, ge=1, description="Number of most recent messages always kept verbatim"
+    )
+    truncate_chars: int = Field(
+        default=600,
+        ge=0,
+        description="Older messages are truncated to this many characters when compacting",
+    )
+
+
+class AccessLogConfig(BaseModel):
+    """Structured access log configuration, one JSON object per request"""
+
+    enabled: bool = Field(default=False, description="Write the access log")
+    path: str = Field(
+        default="logs/access.jsonl",
+        description="Access log file, suffixed with the worker index when running several workers",
+    )
+    sample_rate: float = Field(
+        default=1.0,
+        ge=0.0,
+        le=1.0,
+        description="Fraction of successful requests logged, failed requests are always logged",
+    )
+    rotation: str = Field(
+        default="100 MB", description="Size or interval at which the access log file is rotated"
     )
+    retention: int = Field(default=5, ge=1, description="Number of rotated access logs kept")
+
+
+class CaptureConfig(BaseModel):
+    """Capture of anonymized chat request shapes, replayed by benchmarks/replay.py"""
+
+    enabled: bool = Field(default=False, description="Write the capture file")
+    path: str = Field(
+        default="logs/capture.jsonl",
+        description="Capture file, suffixed with the worker index when running several workers",
+    )
+    sample_rate: float = Field(
+        default=1.0,
+        ge=0.0,
+        le=1.0,
+        description="Fraction of conversations captured, with all their turns",
+    )
+    rotation: str = Field(
+        default="100 MB", description="Size or interval at which the capture file is rotated"
+    )
+    retention: int = Field(default=5, ge=1, description="Number of rotated capture files kept")
 
 
 class LoggingConfig(BaseModel):
@@ -83,6 +355,12 @@ class LoggingConfig(BaseModel):
         default="DEBUG",
         description="Logging level",
     )
+    access_log: AccessLogConfig = Field(
+        default=AccessLogConfig(), description="Structured per-request access log"
+    )
+    capture: CaptureConfig = Field(
+        default=CaptureConfig(), description="Anonymized capture of the chat traffic"
+    )
 
 
 class Config(BaseSettings):
@@ -108,6 +386,36 @@ class Config(BaseSettings):
         description="Storage configuration, defines where and how data will be stored",
     )
 
+    batch: BatchConfig = Field(
+        default=BatchConfig(),
+        description="Batch API configuration, defines concurrency and per-account pacing",
+    )
+
+    quota: QuotaConfig = Field(
+        default=QuotaConfig(),
+        description="Quota configuration, paces accounts and cools down exhausted ones",
+    )
+
+    hedging: HedgingConfig = Field(
+        default=HedgingConfig(),
+        description="Hedging configuration, cuts the tail latency of new sessions",
+    )
+
+    deadline: DeadlineConfig = Field(
+        default=DeadlineConfig(),
+        description="Deadline configuration, sheds requests that cannot finish in time",
+    )
+
+    replication: ReplicationConfig = Field(
+        default=ReplicationConfig(),
+        description="Replication configuration, keeps the conversation stores of nodes in sync",
+    )
+
+    compaction: CompactionConfig = Field(
+        default=CompactionConfig(),
+        description="History compaction configuration, caps the size of full-history prompts",
+    )
+
     # Logging configuration
     logging: LoggingConfig = Field(
         default=LoggingConfig(),
@@ -189,6 +497,8 @@ def initialize_config() -> Config:
     Returns:
         Config: Configuration object
     """
+    # Keep a copy of the client variables so that they can be restored for child processes
+    saved_env = {k: v for k, v in os.environ.items() if k.startswith("CONFIG_GEMINI__CLIENTS__")}
     try:
         # First, extract and remove Gemini clients related environment variables
         env_clients_overrides = extract_gemini_clients_env()
@@ -205,3 +515,5 @@ def initialize_config() -> Config:
     except ValidationError as e:
         logger.error(f"Configuration validation failed: {e!s}")
         sys.exit(1)
+    finally:
+        os.environ.update(saved_env)
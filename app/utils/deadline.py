@@ -0,0 +1,72 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+from . import access_log
+from .metrics import counter
+
+T = TypeVar("T")
+
+_shed = counter(
+    "gemini_shed_requests_total", "Requests given up on as they could not finish before deadline"
+)
+
+# Monotonic time by which the request being served must be answered, None without deadline
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request cannot be answered before its deadline."""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"Request cannot be answered before its deadline ({stage})")
+        self.stage = stage
+
+
+def start(timeout: Optional[float]) -> None:
+    """Give the current request `timeout` seconds from now, or no deadline if None."""
+    _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline of the current request, None without a deadline."""
+    if (deadline := _deadline.get()) is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def _shed_at(stage: str) -> DeadlineExceeded:
+    _shed.inc(stage=stage)
+    access_log.annotate(shed=stage)
+    return DeadlineExceeded(stage)
+
+
+def check(stage: str, estimate: float = 0.0) -> None:
+    """
+    Give up on the current request before a stage expected to take `estimate` seconds,
+    if it would not be over before the deadline.
+
+    Raises:
+        DeadlineExceeded: If the remaining budget is shorter than the estimate
+    """
+    if (left := remaining()) is not None and left <= estimate:
+        raise _shed_at(stage)
+
+
+async def within(aw: Awaitable[T], stage: str) -> T:
+    """
+    Await a stage of the current request, cancelling it once the deadline passes.
+
+    Raises:
+        DeadlineExceeded: If the deadline passed before the stage was over
+    """
+    if (left := remaining()) is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, max(0.0, left))
+    except TimeoutError:
+        if (left := remaining()) is not None and left > 0:
+            # Raised by the stage itself, not by the deadline
+            raise
+        raise _shed_at(stage) from None
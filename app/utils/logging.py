@@ -1,16 +1,23 @@
 import inspect
 import logging
+import os
 import sys
-from typing import Literal
+from typing import Literal, Optional, Union
 
 from loguru import logger
 
+from .access_log import ACCESS_LOG_EXTRA
+from .capture import CAPTURE_EXTRA
+from .config import AccessLogConfig, CaptureConfig
+
 
 def setup_logging(
     level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "DEBUG",
     diagnose: bool = True,
     backtrace: bool = True,
     colorize: bool = True,
+    access_log: Optional[AccessLogConfig] = None,
+    capture: Optional[CaptureConfig] = None,
 ) -> None:
     """
     Setup loguru logging configuration to unify all project logging output
@@ -20,6 +27,8 @@ def setup_logging(
         diagnose: Whether to enable diagnostic information
         backtrace: Whether to enable backtrace information
         colorize: Whether to enable colors
+        access_log: Access log configuration, written to its own file when enabled
+        capture: Traffic capture configuration, written to its own file when enabled
     """
     # Reset all logger handlers
     logger.remove()
@@ -32,15 +41,47 @@ def setup_logging(
         backtrace=backtrace,
         diagnose=diagnose,
         enqueue=True,
+        filter=lambda record: (
+            ACCESS_LOG_EXTRA not in record["extra"] and CAPTURE_EXTRA not in record["extra"]
+        ),
     )
 
+    if access_log and access_log.enabled:
+        _add_jsonl_sink(access_log, ACCESS_LOG_EXTRA)
+    if capture and capture.enabled:
+        _add_jsonl_sink(capture, CAPTURE_EXTRA)
+
     # Setup standard logging library interceptor
-    _setup_logging_intercept()
+    _setup_logging_intercept(level)
 
     logger.debug("Logger initialized.")
 
 
-def _setup_logging_intercept() -> None:
+def _add_jsonl_sink(config: Union[AccessLogConfig, CaptureConfig], extra: str) -> None:
+    """Write the records bound with `extra` as JSON lines to a rotated file, off the event loop."""
+    # Imported here, the worker helpers need the configuration this package initializes
+    from .workers import worker_count, worker_index
+
+    path = config.path
+    if worker_count() > 1:
+        # Workers rotate their own file, a shared one would be rotated several times
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{worker_index()}{ext}"
+
+    logger.add(
+        path,
+        level="INFO",
+        format="{message}",
+        filter=lambda record: extra in record["extra"],
+        rotation=config.rotation,
+        retention=config.retention,
+        enqueue=True,
+        backtrace=False,
+        diagnose=False,
+    )
+
+
+def _setup_logging_intercept(level: str = "INFO") -> None:
     """Setup standard logging library interceptor to redirect to loguru"""
 
     class InterceptHandler(logging.Handler):
@@ -64,5 +105,8 @@ def _setup_logging_intercept() -> None:
 
             logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
 
-    # Remove all existing handlers and add our interceptor
-    logging.basicConfig(handlers=[InterceptHandler()], level="INFO", force=True)
+    # Remove all existing handlers and add our interceptor. Records below the log level are
+    # dropped by the standard library, before the interceptor walks the stack for them, and
+    # the debug output of third-party libraries is never forwarded.
+    stdlib_level = max(logging.INFO, logging.getLevelName(level))
+    logging.basicConfig(handlers=[InterceptHandler()], level=stdlib_level, force=True)
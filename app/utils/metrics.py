@@ -0,0 +1,48 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    """Escape a label value as required by the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._values[tuple(sorted(labels.items()))] += amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(
+                f"{self.name}{{{label_str}}} {value:g}" if labels else f"{self.name} {value:g}"
+            )
+        return "\n".join(lines)
+
+
+_registry: Dict[str, Counter] = {}
+
+
+def counter(name: str, description: str) -> Counter:
+    """Return the counter registered under name, creating it on first use."""
+    if name not in _registry:
+        _registry[name] = Counter(name, description)
+    return _registry[name]
+
+
+def render_metrics() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in _registry.values()) + "\n"
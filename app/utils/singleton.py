@@ -1,7 +1,10 @@
+from abc import ABCMeta
 from typing import ClassVar, Dict
 
 
-class Singleton(type):
+class Singleton(ABCMeta):
+    """Metaclass of the classes with a single instance, which may implement an ABC."""
+
     _instances: ClassVar[Dict[type, object]] = {}
 
     def __call__(cls, *args, **kwargs):
@@ -0,0 +1,47 @@
+import os
+from typing import Optional
+
+from . import g_config
+
+WORKER_INDEX_ENV = "GEMINI_FASTAPI_WORKER_INDEX"
+WORKER_COUNT_ENV = "GEMINI_FASTAPI_WORKER_COUNT"
+HANDOFF_HEADER = "X-Gemini-Handoff"
+
+
+def worker_index() -> int:
+    """Index of the current worker process, 0 in single-process mode."""
+    return int(os.getenv(WORKER_INDEX_ENV, "0"))
+
+
+def worker_count() -> int:
+    """Number of worker processes sharing the configured clients."""
+    return max(1, int(os.getenv(WORKER_COUNT_ENV, "1")))
+
+
+def effective_workers() -> int:
+    """Configured worker count, capped so that every worker owns at least one client."""
+    return max(1, min(g_config.server.workers, len(g_config.gemini.clients)))
+
+
+def owner_of(client_id: str) -> Optional[int]:
+    """
+    Return the index of the worker that owns the given client.
+
+    Clients are assigned round-robin by their position in the configuration, which
+    every worker reads identically.
+    """
+    for idx, c in enumerate(g_config.gemini.clients):
+        if c.id == client_id:
+            return idx % worker_count()
+    return None
+
+
+def is_local(client_id: str) -> bool:
+    """Check whether the given client is managed by the current worker."""
+    return owner_of(client_id) == worker_index()
+
+
+def handoff_port(worker: int) -> int:
+    """Loopback port on which the given worker accepts handed-off requests."""
+    base = g_config.server.handoff_port or g_config.server.port + 1
+    return base + worker
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import orjson
+
+from .common import prepare_environment
+
+
+async def _child(args: argparse.Namespace, started: float) -> Dict[str, float]:
+    """Import the Vercel adapter, run the lifespan and serve one chat request."""
+    from .fake_backend import FakeBackendConfig, install_fake_backend
+
+    install_fake_backend(
+        FakeBackendConfig(latency="constant", latency_mean=0.0, init_latency=args.init_latency)
+    )
+
+    import httpx
+
+    import vercel_adapter
+
+    imported = time.perf_counter()
+
+    app = vercel_adapter.app
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            resp = await client.post(
+                "/v1/chat/completions",
+                json={"model": args.model, "messages": [{"role": "user", "content": "Hi"}]},
+            )
+            resp.raise_for_status()
+        answered = time.perf_counter()
+
+    return {
+        "import_ms": (imported - started) * 1000,
+        "startup_ms": (ready - imported) * 1000,
+        "first_response_ms": (answered - ready) * 1000,
+        "total_ms": (answered - started) * 1000,
+    }
+
+
+def _run_mode(args: argparse.Namespace, lazy: bool) -> Dict[str, Any]:
+    """Spawn fresh interpreters to measure cold starts in the given mode."""
+    env = dict(os.environ, CONFIG_GEMINI__LAZY_INIT="true" if lazy else "false")
+    cmd = [
+        sys.executable,
+        "-m",
+        "benchmarks.cold_start",
+        "--child",
+        "--clients",
+        str(args.clients),
+        "--init-latency",
+        str(args.init_latency),
+        "--model",
+        args.model,
+    ]
+
+    runs: List[Dict[str, float]] = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        out = subprocess.run(cmd, env=env, check=True, capture_output=True).stdout
+        result = orjson.loads(out.splitlines()[-1])
+        result["process_ms"] = (time.perf_counter() - start) * 1000
+        runs.append(result)
+
+    return {
+        metric: round(statistics.median(r[metric] for r in runs), 3)
+        for metric in ("import_ms", "startup_ms", "first_response_ms", "total_ms", "process_ms")
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure cold starts of the Vercel adapter")
+    parser.add_argument("--clients", type=int, default=4, help="Number of fake accounts")
+    parser.add_argument(
+        "--init-latency", type=float, default=1.0, help="Seconds per client handshake"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per mode")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        started = time.perf_counter()
+        prepare_environment(args.clients)
+        result = asyncio.run(_child(args, started))
+        print(orjson.dumps(result).decode())
+        return
+
+    report = {
+        "params": {
+            "clients": args.clients,
+            "init_latency_s": args.init_latency,
+            "runs": args.runs,
+        },
+        "eager": _run_mode(args, lazy=False),
+        "lazy": _run_mode(args, lazy=True),
+    }
+    print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import math
+import os
+import tempfile
+from typing import Any, Dict, List, Sequence
+
+
+def prepare_environment(num_clients: int, storage_path: str | None = None) -> str:
+    """
+    Point the application config at synthetic clients and a throwaway LMDB directory.
+
+    Must be called before anything under `app` is imported, since the configuration
+    is read once at import time.
+
+    Returns:
+        str: The storage path in use
+    """
+    storage_path = storage_path or tempfile.mkdtemp(prefix="gemini-bench-")
+    os.environ["CONFIG_STORAGE__PATH"] = str(storage_path)
+    os.environ.setdefault("CONFIG_LOGGING__LEVEL", "WARNING")
+    os.environ.pop("CONFIG_SERVER__API_KEY", None)
+    # Measure the server rather than the per-account pacing
+    os.environ.setdefault("CONFIG_QUOTA__REQUESTS_PER_MINUTE", "1000000")
+
+    for idx in range(num_clients):
+        prefix = f"CONFIG_GEMINI__CLIENTS__{idx}__"
+        os.environ[f"{prefix}ID"] = f"bench-{idx}"
+        os.environ[f"{prefix}SECURE_1PSID"] = f"bench-1psid-{idx}"
+        os.environ[f"{prefix}SECURE_1PSIDTS"] = f"bench-1psidts-{idx}"
+
+    return storage_path
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Return the nearest-rank percentile of the given values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float | None = None) -> Dict[str, Any]:
+    """Summarize a list of latencies (seconds) into count, throughput and percentiles."""
+    count = len(latencies)
+    summary: Dict[str, Any] = {
+        "count": count,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if count else 0.0,
+    }
+    if elapsed:
+        summary["throughput_rps"] = round(count / elapsed, 3)
+    return summary
@@ -0,0 +1,198 @@
+import asyncio
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional
+
+
+@dataclass
+class FakeBackendConfig:
+    """Behaviour of the simulated Gemini backend."""
+
+    latency: Literal["constant", "uniform", "lognormal"] = "lognormal"
+    latency_mean: float = 0.5  # seconds
+    latency_sigma: float = 0.5  # spread for uniform / lognormal distributions
+    per_kchar_latency: float = 0.0  # extra seconds per 1000 prompt characters
+    init_latency: float = 0.0  # seconds spent in client init
+    failure_rate: float = 0.0  # probability that send_message raises
+    thoughts_rate: float = 0.0  # probability that a response carries thoughts
+    response_chars: int = 600
+    seed: Optional[int] = None
+
+    def sample_latency(self, rng: random.Random, prompt_chars: int = 0) -> float:
+        """Draw a response latency from the configured distribution."""
+        if self.latency == "constant":
+            base = self.latency_mean
+        elif self.latency == "uniform":
+            base = rng.uniform(
+                max(0.0, self.latency_mean - self.latency_sigma),
+                self.latency_mean + self.latency_sigma,
+            )
+        else:
+            # Parameterize so that the median equals latency_mean
+            base = rng.lognormvariate(0.0, self.latency_sigma) * self.latency_mean
+        return base + self.per_kchar_latency * prompt_chars / 1000
+
+
+@dataclass
+class FakeBackendStats:
+    """Counters collected by all fake clients."""
+
+    inits: int = 0
+    calls: int = 0
+    failures: int = 0
+    reused_sessions: int = 0
+    prompt_chars: int = 0
+    files: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+class FakeModelOutput:
+    """Minimal stand-in for `gemini_webapi.ModelOutput`."""
+
+    def __init__(self, metadata: List[str], text: str, thoughts: Optional[str] = None):
+        self.metadata = metadata
+        self.text = text
+        self.thoughts = thoughts
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class FakeChatSession:
+    """Minimal stand-in for `gemini_webapi.ChatSession`."""
+
+    def __init__(self, client: "FakeGeminiClient", metadata: Optional[List[str | None]] = None):
+        self.client = client
+        self.cid, self.rid, self.rcid = [*(metadata or []), None, None, None][:3]
+
+    @property
+    def metadata(self) -> List[str | None]:
+        return [self.cid, self.rid, self.rcid]
+
+    async def send_message(self, prompt: str, files: Optional[list] = None, **kwargs: Any):
+        return await self.client.generate(prompt, files=files, session=self)
+
+
+class FakeGeminiClient:
+    """
+    In-process replacement for `GeminiClientWrapper`.
+
+    Only the surface used by `GeminiClientPool` and the chat route is implemented. The
+    client remembers the conversations it created so that resuming a session on the
+    wrong account fails the same way the real backend does.
+    """
+
+    config: FakeBackendConfig = FakeBackendConfig()
+    stats: FakeBackendStats = FakeBackendStats()
+    _rng: random.Random = random.Random()
+
+    def __init__(self, client_id: str, **kwargs: Any):
+        self.id = client_id
+        self.running = False
+        self.client = None
+        self._conversations: set[str] = set()
+
+    async def init(self, **kwargs: Any) -> None:
+        if self.config.init_latency:
+            await asyncio.sleep(self.config.init_latency)
+        self.running = True
+        self.stats.inits += 1
+
+    async def resume(self, access_token: str, **kwargs: Any) -> None:
+        self.running = True
+
+    def export_state(self) -> Dict[str, Any]:
+        return {"cookies": {}, "access_token": f"token-{self.id}", "saved_at": time.time()}
+
+    def restore_state(self, state: Dict[str, Any]) -> Optional[str]:
+        return state.get("access_token")
+
+    async def close(self, *args: Any, **kwargs: Any) -> None:
+        self.running = False
+
+    def start_chat(self, **kwargs: Any) -> FakeChatSession:
+        return FakeChatSession(self, metadata=kwargs.get("metadata"))
+
+    async def generate(
+        self, prompt: str, files: Optional[list] = None, session: Optional[FakeChatSession] = None
+    ) -> FakeModelOutput:
+        config, stats, rng = self.config, self.stats, self._rng
+        if not self.running:
+            raise RuntimeError(f"Fake client {self.id} is not running")
+
+        stats.calls += 1
+        stats.prompt_chars += len(prompt)
+        stats.files += len(files or [])
+
+        if session and session.cid:
+            if session.cid not in self._conversations:
+                stats.failures += 1
+                raise RuntimeError(f"Conversation {session.cid} unknown to client {self.id}")
+            stats.reused_sessions += 1
+
+        await asyncio.sleep(config.sample_latency(rng, len(prompt)))
+
+        if rng.random() < config.failure_rate:
+            stats.failures += 1
+            raise RuntimeError("Simulated upstream failure")
+
+        if session is not None:
+            if not session.cid:
+                session.cid = f"c_{uuid.uuid4().hex[:16]}"
+                self._conversations.add(session.cid)
+            session.rid = f"r_{uuid.uuid4().hex[:16]}"
+            session.rcid = f"rc_{uuid.uuid4().hex[:16]}"
+            metadata = [session.cid, session.rid, session.rcid]
+        else:
+            metadata = []
+
+        thoughts = None
+        if rng.random() < config.thoughts_rate:
+            thoughts = "Thinking about the request. " * 4
+        text = _synthesize_text(rng, config.response_chars)
+        return FakeModelOutput(metadata=metadata, text=text, thoughts=thoughts)
+
+
+_WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+
+def _synthesize_text(rng: random.Random, length: int) -> str:
+    parts: List[str] = []
+    size = 0
+    while size < length:
+        word = rng.choice(_WORDS)
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts)[:length]
+
+
+@dataclass
+class FakeBackend:
+    """Handle returned by `install_fake_backend`."""
+
+    config: FakeBackendConfig
+    stats: FakeBackendStats = field(default_factory=FakeBackendStats)
+
+
+def install_fake_backend(config: Optional[FakeBackendConfig] = None) -> FakeBackend:
+    """
+    Swap `GeminiClientWrapper` inside the client pool for `FakeGeminiClient`.
+
+    Any pool instance created before the call is discarded so the next
+    `GeminiClientPool()` builds fake clients from the configured client list.
+    """
+    from app.services import pool as pool_module
+    from app.utils.singleton import Singleton
+
+    backend = FakeBackend(config=config or FakeBackendConfig())
+    FakeGeminiClient.config = backend.config
+    FakeGeminiClient.stats = backend.stats
+    FakeGeminiClient._rng = random.Random(backend.config.seed)
+
+    pool_module.GeminiClientWrapper = FakeGeminiClient  # type: ignore[misc]
+    Singleton._instances.pop(pool_module.GeminiClientPool, None)
+    return backend
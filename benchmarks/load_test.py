@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import base64
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+from .common import prepare_environment, summarize
+from .fake_backend import FakeBackendConfig
+
+SCENARIOS = ("new", "reuse", "attachment", "stream")
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    """Parse a scenario mix such as 'new=4,reuse=4,attachment=1,stream=1'."""
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class LoadTest:
+    """Drive `/v1/chat/completions` with concurrent synthetic chats."""
+
+    def __init__(self, client, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.sent_bytes = 0
+        self.received_bytes = 0
+
+    def _pick_scenario(self) -> str:
+        mix = self.args.mix
+        return self.rng.choices(list(mix), weights=list(mix.values()))[0]
+
+    def _user_text(self) -> str:
+        words = self.rng.randint(self.args.prompt_words // 2, self.args.prompt_words)
+        return " ".join(f"word{self.rng.randint(0, 9999)}" for _ in range(words))
+
+    def _attachment(self) -> Dict[str, Any]:
+        payload = self.rng.randbytes(self.args.attachment_kb * 1024)
+        url = "data:image/png;base64," + base64.b64encode(payload).decode("ascii")
+        return {"type": "image_url", "image_url": {"url": url}}
+
+    async def _send(self, tag: str, messages: List[Dict[str, Any]], stream: bool = False):
+        body = orjson.dumps({"model": self.args.model, "messages": messages, "stream": stream})
+        self.sent_bytes += len(body)
+        headers = {"Content-Type": "application/json"}
+        if self.args.api_key:
+            headers["Authorization"] = f"Bearer {self.args.api_key}"
+
+        start = time.perf_counter()
+        try:
+            resp = await self.client.post("/v1/chat/completions", content=body, headers=headers)
+        except Exception:
+            self.errors[tag] += 1
+            return None
+        elapsed = time.perf_counter() - start
+
+        self.received_bytes += len(resp.content)
+        if resp.status_code != 200:
+            self.errors[tag] += 1
+            return None
+
+        self.latencies[tag].append(elapsed)
+        if stream:
+            return _collect_stream(resp.text)
+        return resp.json()["choices"][0]["message"]["content"]
+
+    async def run_chat(self) -> None:
+        scenario = self._pick_scenario()
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": "You are a benchmark assistant."},
+            {"role": "user", "content": self._user_text()},
+        ]
+
+        if scenario == "attachment":
+            messages[-1]["content"] = [
+                {"type": "text", "text": messages[-1]["content"]},
+                self._attachment(),
+            ]
+            await self._send("attachment", messages)
+        elif scenario == "stream":
+            await self._send("stream", messages, stream=True)
+        elif scenario == "new":
+            await self._send("new", messages)
+        else:
+            # Multi-turn chat which echoes every answer back, as OpenAI clients do
+            reply = await self._send("new", messages)
+            for _ in range(self.args.turns - 1):
+                if reply is None:
+                    break
+                messages.append({"role": "assistant", "content": reply})
+                messages.append({"role": "user", "content": self._user_text()})
+                reply = await self._send("reuse", messages)
+
+    async def run(self) -> float:
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(self.args.chats):
+            queue.put_nowait(i)
+
+        async def worker():
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self.run_chat()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        all_latencies = [lat for values in self.latencies.values() for lat in values]
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "overall": {**summarize(all_latencies, elapsed), "errors": sum(self.errors.values())},
+            "scenarios": {
+                tag: {**summarize(values, elapsed), "errors": self.errors.get(tag, 0)}
+                for tag, values in sorted(self.latencies.items())
+            },
+            "bytes": {"sent": self.sent_bytes, "received": self.received_bytes},
+        }
+
+
+def _collect_stream(body: str) -> str:
+    """Reassemble the assistant message from an SSE body."""
+    content = []
+    for line in body.splitlines():
+        if not line.startswith("data: ") or line == "data: [DONE]":
+            continue
+        delta = orjson.loads(line[6:])["choices"][0]["delta"]
+        content.append(delta.get("content") or "")
+    return "".join(content)
+
+
+def _print_report(report: Dict[str, Any], backend_stats: Optional[Dict[str, int]]) -> None:
+    header = f"{'scenario':<12}{'count':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    rows = [*report["scenarios"].items(), ("overall", report["overall"])]
+    for tag, s in rows:
+        print(
+            f"{tag:<12}{s['count']:>8}{s['errors']:>8}{s.get('throughput_rps', 0):>10}"
+            f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}"
+        )
+    print(f"\nelapsed: {report['elapsed_s']}s, bytes: {report['bytes']}")
+    if backend_stats:
+        print(f"backend: {backend_stats}")
+
+
+async def _run(args: argparse.Namespace) -> None:
+    import httpx
+
+    backend = None
+    if args.url:
+        transport = None
+        base_url = args.url
+    else:
+        from .fake_backend import install_fake_backend
+
+        backend = install_fake_backend(
+            FakeBackendConfig(
+                latency=args.latency,
+                latency_mean=args.latency_mean,
+                latency_sigma=args.latency_sigma,
+                failure_rate=args.failure_rate,
+                thoughts_rate=args.thoughts_rate,
+                response_chars=args.response_chars,
+                seed=args.seed,
+            )
+        )
+
+        from app.main import create_app
+        from app.services import GeminiClientPool
+
+        await GeminiClientPool().init()
+        transport = httpx.ASGITransport(app=create_app())
+        base_url = "http://bench"
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url, timeout=args.timeout, limits=limits
+    ) as client:
+        test = LoadTest(client, args)
+        elapsed = await test.run()
+
+    report = test.report(elapsed)
+    if backend:
+        report["backend"] = backend.stats.as_dict()
+
+    if args.json:
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+    else:
+        _print_report(report, report.get("backend"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test /v1/chat/completions")
+    parser.add_argument("--url", help="Target a running server instead of the in-process app")
+    parser.add_argument("--api-key", default=os.getenv("CONFIG_SERVER__API_KEY"))
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--chats", type=int, default=200, help="Number of synthetic chats")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=4, help="Turns per 'reuse' chat")
+    parser.add_argument(
+        "--mix",
+        type=_parse_mix,
+        default=_parse_mix("new=3,reuse=4,attachment=1,stream=2"),
+        help="Scenario weights, e.g. new=3,reuse=4,attachment=1,stream=2",
+    )
+    parser.add_argument("--prompt-words", type=int, default=60)
+    parser.add_argument("--attachment-kb", type=int, default=256)
+    parser.add_argument("--clients", type=int, default=4, help="Number of fake accounts")
+    parser.add_argument(
+        "--latency", choices=["constant", "uniform", "lognormal"], default="lognormal"
+    )
+    parser.add_argument("--latency-mean", type=float, default=0.2, help="Seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--thoughts-rate", type=float, default=0.3)
+    parser.add_argument("--response-chars", type=int, default=600)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Emit the report as JSON")
+    parser.add_argument(
+        "--storage",
+        choices=["lmdb", "memory"],
+        default="lmdb",
+        help="Storage backend of the in-process app",
+    )
+    args = parser.parse_args()
+
+    if not args.url:
+        prepare_environment(args.clients)
+        os.environ["CONFIG_STORAGE__BACKEND"] = args.storage
+        from app.utils import g_config, setup_logging
+
+        setup_logging(
+            level=g_config.logging.level,
+            access_log=g_config.logging.access_log,
+            capture=g_config.logging.capture,
+        )
+
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import itertools
+import json
+import platform
+import random
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import orjson
+
+from .common import prepare_environment
+from .store_bench import _build_history, _int_list, _measure
+
+
+def run_case(
+    history: int, attachment_kb: int, response_kb: int, repeat: int, seed: int
+) -> Dict[str, Any]:
+    """Benchmark the request path of one payload shape, with the default and fast variants."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, Response
+
+    from app.models import ChatCompletionRequest, ConversationInStore, Message
+    from app.server.chat import create_standard_response
+    from app.services import LMDBConversationStore
+    from app.utils import g_config
+    from app.utils.singleton import Singleton
+
+    rng = random.Random(seed)
+    model = "gemini-2.5-flash"
+    client_id = g_config.gemini.clients[0].id
+    messages = _build_history(rng, history, attachment_kb)
+    body = orjson.dumps(
+        {
+            "model": model,
+            "messages": [m.model_dump(mode="json", exclude_none=True) for m in messages],
+        }
+    )
+    request = ChatCompletionRequest.model_validate_json(body)
+    answer = " ".join(f"w{rng.randint(0, 9999)}" for _ in range(response_kb * 1024 // 6))
+    result = create_standard_response([answer], "chatcmpl-bench", 0, model, "prompt")
+
+    path = tempfile.mkdtemp(prefix="gemini-payload-bench-")
+    Singleton._instances.pop(LMDBConversationStore, None)
+    db = LMDBConversationStore(db_path=path, max_db_size=1024**3 * 4)
+
+    def reset_digests() -> None:
+        for message in request.messages:
+            message._digest = None
+
+    def lookup_and_store(cached: bool) -> None:
+        # What a chat request does with the store: look the history up, then save the turn
+        reset_digests()
+        db.find(model, request.messages[:-1])
+        if not cached:
+            reset_digests()
+        last = Message(role="assistant", content=answer)
+        conv = ConversationInStore(
+            model=model, client_id=client_id, metadata=[], messages=[*request.messages, last]
+        )
+        db.store(conv, visible_messages=conv.messages)
+
+    try:
+        ops = {
+            # FastAPI decodes the body with the standard library before validating it
+            "decode_default": _measure(
+                lambda: ChatCompletionRequest.model_validate(json.loads(body)), repeat
+            ),
+            "decode_fast": _measure(
+                lambda: ChatCompletionRequest.model_validate_json(body), repeat
+            ),
+            "store_default": _measure(lambda: lookup_and_store(cached=False), repeat),
+            "store_fast": _measure(lambda: lookup_and_store(cached=True), repeat),
+            # FastAPI runs plain dicts through its encoder, then the standard library
+            "encode_default": _measure(lambda: JSONResponse(jsonable_encoder(result)), repeat),
+            "encode_fast": _measure(
+                lambda: Response(orjson.dumps(result), media_type="application/json"), repeat
+            ),
+        }
+        return {
+            "params": {
+                "history": history,
+                "attachment_kb": attachment_kb,
+                "response_kb": response_kb,
+                "body_bytes": len(body),
+            },
+            "ops": ops,
+        }
+    finally:
+        db.close()
+        Singleton._instances.pop(LMDBConversationStore, None)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark request decoding and encoding")
+    parser.add_argument("--history", type=_int_list, default=[16, 256])
+    parser.add_argument("--attachment-kb", type=_int_list, default=[0, 4096])
+    parser.add_argument("--response-kb", type=_int_list, default=[4, 1024])
+    parser.add_argument("--repeat", type=int, default=20, help="Iterations per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    prepare_environment(1)
+    from app.utils import setup_logging
+
+    setup_logging(level="WARNING")
+
+    results: List[Dict[str, Any]] = [
+        run_case(history, attachment_kb, response_kb, args.repeat, args.seed)
+        for history, attachment_kb, response_kb in itertools.product(
+            args.history, args.attachment_kb, args.response_kb
+        )
+    ]
+    report = {
+        "meta": {
+            "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "orjson": orjson.__version__,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(output)
+    else:
+        print(output.decode())
+
+
+if __name__ == "__main__":
+    main()
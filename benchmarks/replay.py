@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import base64
+import gzip
+import math
+import os
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from .common import percentile, prepare_environment, summarize
+from .fake_backend import FakeBackendConfig
+from .load_test import _collect_stream
+
+
+def load_capture(paths: List[Path]) -> Dict[str, List[Dict[str, Any]]]:
+    """Read capture files, gzip compressed or not, into the requests of each conversation."""
+    records = []
+    for path in paths:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rb") as f:
+            records.extend(orjson.loads(line) for line in f if line.strip())
+
+    threads: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in sorted(records, key=lambda r: r["ts"]):
+        threads[record["thread"]].append(record)
+    return threads
+
+
+def fit_backend(records: List[Dict[str, Any]]) -> Tuple[float, float, int]:
+    """
+    Fit the stand-in backend to the capture.
+
+    Returns:
+        tuple: The median upstream latency and the log-normal spread of the upstream
+            latencies, in seconds, and the median response length
+    """
+    latencies = [r["upstream_ms"] / 1000 for r in records if r.get("upstream_ms")]
+    median = statistics.median(latencies) if latencies else 0.5
+    sigma = statistics.pstdev(math.log(x) for x in latencies) if len(latencies) > 1 else 0.5
+    lengths = [r["response_chars"][0] for r in records if r.get("response_chars")]
+    return median, sigma, int(statistics.median(lengths)) if lengths else 600
+
+
+class Replay:
+    """Replay the conversations of a capture with synthetic content of the same shape."""
+
+    def __init__(self, client, args: argparse.Namespace, threads: Dict[str, List[Dict]]):
+        self.client = client
+        self.args = args
+        self.threads = threads
+        self.rng = random.Random(args.seed)
+        self.origin = min(datetime.fromisoformat(t[0]["ts"]) for t in threads.values())
+        self.latencies: List[float] = []
+        self.lags: List[float] = []
+        self.statuses: Counter[int] = Counter()
+        self.sent_bytes = 0
+
+    def _text(self, chars: int) -> str:
+        # Random words, so that conversations of the same shape do not share a history
+        words: List[str] = []
+        length = 0
+        while length < chars:
+            words.append(f"w{self.rng.randint(0, 99999)}")
+            length += len(words[-1]) + 1
+        return " ".join(words)[:chars]
+
+    def _attachment(self, shape: Dict[str, Any]) -> Dict[str, Any]:
+        size = shape.get("bytes")
+        if size is None:
+            size = self.args.remote_attachment_kb * 1024
+        data = base64.b64encode(self.rng.randbytes(size)).decode("ascii")
+        if shape["type"] == "file":
+            return {"type": "file", "file": {"file_data": data, "filename": "capture.bin"}}
+        return {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{data}"}}
+
+    def _message(self, shape: Dict[str, Any]) -> Dict[str, Any]:
+        text = self._text(shape["chars"])
+        if not shape.get("attachments"):
+            return {"role": shape["role"], "content": text}
+        content = [{"type": "text", "text": text}]
+        content.extend(self._attachment(a) for a in shape["attachments"])
+        return {"role": shape["role"], "content": content}
+
+    def _build(
+        self, history: List[Tuple[Dict, Dict]], shapes: List[Dict[str, Any]]
+    ) -> List[Tuple[Dict, Dict]]:
+        """
+        Rebuild the messages of a request from the history of its conversation, i.e. the
+        messages of the previous request and the reply to it, as the client would. The
+        last message is only kept when its shape is unchanged, as for a regenerated turn.
+        """
+        messages = []
+        for i, shape in enumerate(shapes):
+            if i >= len(history) or history[i][1]["role"] != shape["role"]:
+                break
+            if i == len(shapes) - 1 and history[i][1] != shape:
+                break
+            messages.append(history[i])
+        messages.extend((self._message(s), s) for s in shapes[len(messages) :])
+        return messages
+
+    async def _send(self, record: Dict[str, Any], messages: List[Dict]) -> Optional[str]:
+        payload: Dict[str, Any] = {
+            "model": self.args.model or record["model"],
+            "messages": messages,
+            "stream": record.get("stream", False),
+        }
+        if record.get("n", 1) > 1:
+            payload["n"] = record["n"]
+        body = orjson.dumps(payload)
+        self.sent_bytes += len(body)
+        headers = {"Content-Type": "application/json"}
+        if self.args.api_key:
+            headers["Authorization"] = f"Bearer {self.args.api_key}"
+        if record.get("timeout"):
+            headers["X-Request-Timeout"] = str(record["timeout"])
+
+        start = time.perf_counter()
+        try:
+            resp = await self.client.post("/v1/chat/completions", content=body, headers=headers)
+        except Exception:
+            self.statuses[0] += 1
+            return None
+        self.statuses[resp.status_code] += 1
+        if resp.status_code != 200:
+            return None
+
+        self.latencies.append(time.perf_counter() - start)
+        if payload["stream"]:
+            return _collect_stream(resp.text)
+        return resp.json()["choices"][0]["message"]["content"]
+
+    async def run_thread(self, records: List[Dict[str, Any]], started: float) -> None:
+        speedup = self.args.speedup
+        history: List[Tuple[Dict, Dict]] = []
+        previous_ts: Optional[datetime] = None
+        due = started
+        for record in records:
+            ts = datetime.fromisoformat(record["ts"])
+            if previous_ts is None:
+                due = started + (ts - self.origin).total_seconds() / speedup
+            else:
+                gap = record.get("since_previous_s")
+                if gap is None:
+                    gap = (ts - previous_ts).total_seconds()
+                # A turn cannot be sent before the reply to the previous one
+                due = max(due + gap / speedup, time.perf_counter())
+            previous_ts = ts
+
+            if (delay := due - time.perf_counter()) > 0:
+                await asyncio.sleep(delay)
+            self.lags.append(time.perf_counter() - due)
+
+            messages = self._build(history, record["messages"])
+            reply = await self._send(record, [m for m, _ in messages])
+            history = messages
+            if reply is not None:
+                answer = {"role": "assistant", "content": reply}
+                history = [*messages, (answer, {"role": "assistant", "chars": len(reply)})]
+
+    async def run(self) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_thread(t, start) for t in self.threads.values()))
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        records = [r for t in self.threads.values() for r in t]
+        captured_span = max(datetime.fromisoformat(r["ts"]) for r in records) - self.origin
+        outcomes = [r["reused"] for r in records if "reused" in r]
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "captured": {
+                "conversations": len(self.threads),
+                "requests": len(records),
+                "span_s": round(captured_span.total_seconds(), 3),
+                "statuses": dict(Counter(r["status"] for r in records)),
+                "reuse_rate": round(sum(outcomes) / len(outcomes), 3) if outcomes else None,
+            },
+            "replayed": {
+                **summarize(self.latencies, elapsed),
+                "statuses": dict(self.statuses),
+                "schedule_lag_p95_ms": round(percentile(self.lags, 95) * 1000, 3),
+            },
+            "bytes_sent": self.sent_bytes,
+        }
+
+
+async def _run(args: argparse.Namespace, threads: Dict[str, List[Dict]]) -> None:
+    import httpx
+
+    backend = None
+    if args.url:
+        transport = None
+        base_url = args.url
+    else:
+        from .fake_backend import install_fake_backend
+
+        latency, sigma, response_chars = fit_backend([r for t in threads.values() for r in t])
+        backend = install_fake_backend(
+            FakeBackendConfig(
+                latency="lognormal",
+                latency_mean=args.latency_mean or latency,
+                latency_sigma=args.latency_sigma or sigma,
+                response_chars=response_chars,
+                seed=args.seed,
+            )
+        )
+
+        from app.main import create_app
+        from app.services import GeminiClientPool
+
+        await GeminiClientPool().init()
+        transport = httpx.ASGITransport(app=create_app())
+        base_url = "http://replay"
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url, timeout=args.timeout
+    ) as client:
+        replay = Replay(client, args, threads)
+        elapsed = await replay.run()
+
+    report = replay.report(elapsed)
+    if backend:
+        stats = backend.stats.as_dict()
+        report["backend"] = stats
+        if stats["calls"]:
+            report["replayed"]["reuse_rate"] = round(stats["reused_sessions"] / stats["calls"], 3)
+    print(orjson.dumps(report, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay captured chat traffic")
+    parser.add_argument("capture", type=Path, nargs="+", help="Capture files (.jsonl or .gz)")
+    parser.add_argument("--url", help="Target a running server instead of the in-process app")
+    parser.add_argument("--api-key", default=os.getenv("CONFIG_SERVER__API_KEY"))
+    parser.add_argument("--model", help="Send every request to this model")
+    parser.add_argument(
+        "--speedup", type=float, default=1.0, help="Divide the time between requests by this"
+    )
+    parser.add_argument(
+        "--remote-attachment-kb",
+        type=int,
+        default=64,
+        help="Size of the inline stand-ins for attachments captured as URLs",
+    )
+    parser.add_argument("--clients", type=int, default=4, help="Number of fake accounts")
+    parser.add_argument(
+        "--latency-mean", type=float, help="Median backend latency (default: from the capture)"
+    )
+    parser.add_argument(
+        "--latency-sigma", type=float, help="Log-normal spread (default: from the capture)"
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--storage",
+        choices=["lmdb", "memory"],
+        default="lmdb",
+        help="Storage backend of the in-process app",
+    )
+    args = parser.parse_args()
+    if args.speedup <= 0:
+        parser.error("--speedup must be positive")
+
+    threads = load_capture(args.capture)
+    if not threads:
+        parser.error("The capture is empty")
+
+    if not args.url:
+        prepare_environment(args.clients)
+        os.environ["CONFIG_STORAGE__BACKEND"] = args.storage
+        # The replay must not capture itself
+        os.environ["CONFIG_LOGGING__CAPTURE__ENABLED"] = "false"
+        from app.utils import g_config, setup_logging
+
+        setup_logging(level=g_config.logging.level, access_log=g_config.logging.access_log)
+
+    asyncio.run(_run(args, threads))
+
+
+if __name__ == "__main__":
+    main()
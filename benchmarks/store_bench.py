@@ -0,0 +1,214 @@
+import argparse
+import base64
+import itertools
+import platform
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import orjson
+
+from .common import percentile, prepare_environment
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Run `fn` repeatedly and return per-call timings in microseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        "mean_us": round(sum(timings) / len(timings) * 1e6, 3),
+        "p50_us": round(percentile(timings, 50) * 1e6, 3),
+        "p95_us": round(percentile(timings, 95) * 1e6, 3),
+        "min_us": round(min(timings) * 1e6, 3),
+    }
+
+
+def _build_history(rng: random.Random, length: int, attachment_kb: int):
+    """Build an alternating user/assistant history of `length` messages."""
+    from app.models import ContentItem, Message
+
+    messages = []
+    for i in range(length):
+        text = " ".join(f"w{rng.randint(0, 9999)}" for _ in range(40))
+        if i % 2 == 0:
+            content: Any = text
+            if attachment_kb and i == 0:
+                data = base64.b64encode(rng.randbytes(attachment_kb * 1024)).decode("ascii")
+                content = [
+                    ContentItem(type="text", text=text),
+                    ContentItem(
+                        type="image_url", image_url={"url": f"data:image/png;base64,{data}"}
+                    ),
+                ]
+            messages.append(Message(role="user", content=content))
+        else:
+            messages.append(Message(role="assistant", content=text))
+    return messages
+
+
+def run_case(
+    history: int,
+    attachment_kb: int,
+    pool: int,
+    store_size: int,
+    repeat: int,
+    seed: int,
+    backend: str = "lmdb",
+) -> Dict[str, Any]:
+    """Benchmark every store operation for one parameter combination."""
+    from app.models import ConversationInStore, Message
+    from app.services import LMDBConversationStore, MemoryConversationStore
+    from app.services.storage import _hash_conversation, _hash_message
+    from app.utils import g_config
+    from app.utils.config import GeminiClientSettings
+    from app.utils.singleton import Singleton
+
+    rng = random.Random(seed)
+    g_config.gemini.clients = [
+        GeminiClientSettings(id=f"bench-{i}", secure_1psid="x", secure_1psidts="y")
+        for i in range(pool)
+    ]
+    # Conversations belong to the last client, the worst case for `find`
+    client_id = g_config.gemini.clients[-1].id
+    model = "gemini-2.5-flash"
+
+    path = tempfile.mkdtemp(prefix="gemini-store-bench-")
+    store_cls = MemoryConversationStore if backend == "memory" else LMDBConversationStore
+    Singleton._instances.pop(store_cls, None)
+    if backend == "memory":
+        db = MemoryConversationStore(max_size=1024**3 * 4)
+    else:
+        db = LMDBConversationStore(db_path=path, max_db_size=1024**3 * 4)
+
+    try:
+        # Fill the store with small conversations to reach the requested size
+        for i in range(store_size):
+            filler = _build_history(rng, 2, 0)
+            db.store(
+                ConversationInStore(
+                    model=model, client_id=client_id, metadata=[f"c{i}"], messages=filler
+                )
+            )
+
+        history_msgs = _build_history(rng, history, attachment_kb)
+        conv = ConversationInStore(
+            model=model, client_id=client_id, metadata=["c", "r", "rc"], messages=history_msgs
+        )
+        # Same history as echoed back by clients, i.e. with <think> blocks
+        thought_history = [
+            Message(role=m.role, content=f"<think>Reasoning.</think>\n{m.content}")
+            if m.role == "assistant"
+            else m
+            for m in history_msgs
+        ]
+        key = db.store(conv, visible_messages=thought_history)
+        missing = _build_history(random.Random(seed + 1), history, 0)
+        largest = max(history_msgs, key=lambda m: len(orjson.dumps(m.model_dump(mode="json"))))
+
+        def uncached(fn: Callable[[], Any], *messages: List[Any]) -> Callable[[], Any]:
+            """Drop the digests cached on the messages, as every request parses new ones."""
+
+            def run() -> Any:
+                for message in itertools.chain(*messages):
+                    message._digest = None
+                    message._external = None
+                return fn()
+
+            return run
+
+        ops = {
+            "hash_message": _measure(uncached(lambda: _hash_message(largest), [largest]), repeat),
+            "hash_conversation": _measure(
+                uncached(lambda: _hash_conversation(client_id, model, history_msgs), history_msgs),
+                repeat,
+            ),
+            "store": _measure(
+                uncached(
+                    lambda: db.store(conv, visible_messages=thought_history),
+                    history_msgs,
+                    thought_history,
+                ),
+                repeat,
+            ),
+            "get": _measure(lambda: db.get(key), repeat),
+            "find_raw": _measure(
+                uncached(lambda: db.find(model, history_msgs), history_msgs), repeat
+            ),
+            "find_sanitized": _measure(
+                uncached(lambda: db.find(model, thought_history), thought_history), repeat
+            ),
+            "find_miss": _measure(uncached(lambda: db.find(model, missing), missing), repeat),
+            "keys": _measure(db.keys, max(1, repeat // 10)),
+        }
+        return {
+            "params": {
+                "history": history,
+                "attachment_kb": attachment_kb,
+                "pool": pool,
+                "store_size": store_size,
+            },
+            "ops": ops,
+        }
+    finally:
+        db.close()
+        Singleton._instances.pop(store_cls, None)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmark the conversation store")
+    parser.add_argument("--history", type=_int_list, default=[2, 16, 64])
+    parser.add_argument("--attachment-kb", type=_int_list, default=[0, 512])
+    parser.add_argument("--pool", type=_int_list, default=[1, 8])
+    parser.add_argument("--store-size", type=_int_list, default=[100, 5000])
+    parser.add_argument("--repeat", type=int, default=50, help="Iterations per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", choices=["lmdb", "memory"], default="lmdb")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    prepare_environment(1)
+    from app.utils import setup_logging
+
+    setup_logging(level="WARNING")
+
+    import lmdb
+
+    results = [
+        run_case(history, attachment_kb, pool, store_size, args.repeat, args.seed, args.backend)
+        for history, attachment_kb, pool, store_size in itertools.product(
+            args.history, args.attachment_kb, args.pool, args.store_size
+        )
+    ]
+    report = {
+        "meta": {
+            "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "lmdb": lmdb.__version__,
+            "repeat": args.repeat,
+            "backend": args.backend,
+        },
+        "results": results,
+    }
+
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(output)
+    else:
+        print(output.decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,103 @@
+import multiprocessing
+import os
+import signal
+import socket
+
 import uvicorn
+from loguru import logger
 
 from app.main import create_app
 from app.utils import g_config, setup_logging
+from app.utils.workers import (
+    WORKER_COUNT_ENV,
+    WORKER_INDEX_ENV,
+    effective_workers,
+    handoff_port,
+)
 
 app = create_app()
 
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve_worker(index: int, workers: int, sockets: list[socket.socket]) -> None:
+    """Entry point of a worker process, which only manages its own share of clients."""
+    os.environ[WORKER_INDEX_ENV] = str(index)
+    os.environ[WORKER_COUNT_ENV] = str(workers)
+    setup_logging(
+        level=g_config.logging.level,
+        access_log=g_config.logging.access_log,
+        capture=g_config.logging.capture,
+    )
+
+    # Every LMDB environment and Gemini client is created lazily inside the worker
+    config = uvicorn.Config(app, log_config=None, access_log=_uvicorn_access_log())
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def _uvicorn_access_log() -> bool:
+    """The uvicorn access log is redundant with the structured one."""
+    return not g_config.logging.access_log.enabled
+
+
+def run_workers(workers: int) -> None:
+    """Serve the public port from several processes, each with a loopback handoff port."""
+    public = _bind(g_config.server.host, g_config.server.port)
+    ctx = multiprocessing.get_context("spawn")
+
+    processes = []
+    for index in range(workers):
+        private = _bind("127.0.0.1", handoff_port(index))
+        process = ctx.Process(target=_serve_worker, args=(index, workers, [public, private]))
+        process.start()
+        processes.append(process)
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def _stop(signum, frame):
+        raise SystemExit(128 + signum)
+
+    # Under SIGTERM (docker stop, systemd, k8s), stop the workers instead of orphaning them
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
 if __name__ == "__main__":
-    # Setup loguru logging
-    setup_logging(level=g_config.logging.level)
-
-    uvicorn.run(
-        app,
-        host=g_config.server.host,
-        port=g_config.server.port,
-        log_config=None,
+    workers = effective_workers()
+
+    # Setup loguru logging, workers open their own access log and capture file
+    setup_logging(
+        level=g_config.logging.level,
+        access_log=g_config.logging.access_log if workers == 1 else None,
+        capture=g_config.logging.capture if workers == 1 else None,
     )
+
+    if workers < g_config.server.workers:
+        logger.warning(f"Only {workers} workers started, each worker needs at least one client")
+
+    if workers > 1:
+        run_workers(workers)
+    else:
+        uvicorn.run(
+            app,
+            host=g_config.server.host,
+            port=g_config.server.port,
+            log_config=None,
+            access_log=_uvicorn_access_log(),
+        )
@@ -0,0 +1,61 @@
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+import lmdb
+
+
+def _allocated_bytes(path: Path) -> int:
+    """Disk space used by the data file, which is sparse when the server opened it."""
+    return (path / "data.mdb").stat().st_blocks * 512
+
+
+def _other_reader_pids(env: lmdb.Environment) -> set[int]:
+    """Return the other live processes that have the environment open for reading."""
+    env.reader_check()
+    pids = {int(line.split()[0]) for line in env.readers().splitlines()[1:] if line.strip()}
+    pids.discard(os.getpid())
+    return pids
+
+
+def compact_lmdb(path: Path, force: bool = False) -> tuple[int, int]:
+    """Replace the database with a compacting copy of itself, return its sizes on disk."""
+    before = _allocated_bytes(path)
+    target = path.with_name(f"{path.name}.compact")
+    env = lmdb.open(str(path), max_dbs=16, readahead=False)
+    try:
+        if (pids := _other_reader_pids(env)) and not force:
+            raise SystemExit(
+                f"{path} is open in processes {sorted(pids)}, stop the server or use "
+                "POST /admin/compact"
+            )
+        shutil.rmtree(target, ignore_errors=True)
+        target.mkdir(parents=True)
+        env.copy(str(target), compact=True)
+    finally:
+        env.close()
+
+    try:
+        os.replace(target / "data.mdb", path / "data.mdb")
+    finally:
+        shutil.rmtree(target, ignore_errors=True)
+    return before, _allocated_bytes(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Return the free pages of LMDB to the disk")
+    parser.add_argument("path", type=Path, help="Path to LMDB directory")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Compact even if other processes have the database open, losing their writes",
+    )
+    args = parser.parse_args()
+
+    before, after = compact_lmdb(args.path, args.force)
+    print(f"{before} -> {after} bytes on disk, {max(0, before - after)} reclaimed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import gzip
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import IO, Any, Iterator, List, Optional, Tuple
+
+import lmdb
+import orjson
+
+HASH_LOOKUP_PREFIX = b"hash:"
+
+
+def _parse_time(value: str) -> datetime:
+    """Parse an ISO datetime, or a duration such as '14d' or '24h' counted back from now."""
+    if value[:-1].isdigit() and value[-1] in "dh":
+        unit = "days" if value.endswith("d") else "hours"
+        return datetime.now() - timedelta(**{unit: int(value[:-1])})
+    return datetime.fromisoformat(value)
+
+
+def _record_time(record: dict[str, Any]) -> Optional[datetime]:
+    """Return the last modification time of a conversation record."""
+    timestamp = record.get("updated_at") or record.get("created_at")
+    if not timestamp:
+        return None
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
+        return None
+
+
+class RecordFilter:
+    """Key range and time filters applied to conversation records."""
+
+    def __init__(
+        self,
+        prefix: str = "",
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> None:
+        self.prefix = prefix.encode("utf-8")
+        self.start = start.encode("utf-8") if start else None
+        self.end = end.encode("utf-8") if end else None
+        self.since = since
+        self.until = until
+
+    def match_key(self, key: bytes) -> bool:
+        if not key.startswith(self.prefix):
+            return False
+        if self.start is not None and key < self.start:
+            return False
+        return self.end is None or key < self.end
+
+    def match_record(self, record: Any) -> bool:
+        if self.since is None and self.until is None:
+            return True
+        if not isinstance(record, dict) or not (ts := _record_time(record)):
+            return False
+        if self.since is not None and ts < self.since:
+            return False
+        return self.until is None or ts < self.until
+
+
+def _iter_pages(
+    env: lmdb.Environment, db: Any, start_after: Optional[bytes], page: int
+) -> Iterator[List[Tuple[bytes, bytes, Optional[bytes]]]]:
+    """
+    Yield pages of (key, value, target) records in key order.
+
+    Each page is read in its own short transaction, so that a long export neither
+    holds the whole store in memory nor pins old pages of a live database. For hash
+    mappings of the main database, `target` is the conversation record they point to.
+    """
+    cursor_key = start_after
+    while True:
+        batch: List[Tuple[bytes, bytes, Optional[bytes]]] = []
+        with env.begin(db=db) as txn:
+            cursor = txn.cursor()
+            if not (cursor.set_range(cursor_key) if cursor_key else cursor.first()):
+                return
+            for key, value in cursor:
+                if key == cursor_key:
+                    continue
+                target = None
+                if db is None and key.startswith(HASH_LOOKUP_PREFIX):
+                    target = txn.get(value)
+                batch.append((key, value, target))
+                if len(batch) >= page:
+                    break
+
+        if not batch:
+            return
+        yield batch
+        if len(batch) < page:
+            return
+        cursor_key = batch[-1][0]
+
+
+def _encode_line(key: bytes, value: bytes) -> Optional[bytes]:
+    """Serialize a record as a JSONL line, keeping non-JSON values as raw strings."""
+    try:
+        record = {"key": key.decode("utf-8"), "value": orjson.loads(value)}
+    except orjson.JSONDecodeError:
+        record = {"key": key.decode("utf-8"), "raw": value.decode("utf-8")}
+    except UnicodeDecodeError:
+        return None
+    return orjson.dumps(record) + b"\n"
+
+
+@contextmanager
+def _open_output(output: str, append: bool) -> Iterator[IO[bytes]]:
+    """Open the output file, compressed with gzip when its name ends with '.gz'."""
+    if output == "-":
+        yield sys.stdout.buffer
+        return
+    mode = "ab" if append else "wb"
+    handle = gzip.open(output, mode) if output.endswith(".gz") else open(output, mode)
+    try:
+        yield handle
+    finally:
+        handle.close()
+
+
+def export_lmdb(
+    path: Path,
+    output: str,
+    db_name: Optional[str] = None,
+    record_filter: Optional[RecordFilter] = None,
+    after: Optional[str] = None,
+    cursor_file: Optional[Path] = None,
+    page: int = 1000,
+) -> int:
+    """
+    Stream the records of the main database, or of a named sub-database, as JSONL.
+
+    In the main database only conversation records and their hash mappings are
+    exported, the records of named sub-databases are skipped. Filters are applied to
+    conversation records, hash mappings follow the conversation they point to.
+
+    Returns:
+        int: The number of exported records
+    """
+    record_filter = record_filter or RecordFilter()
+    env = lmdb.open(str(path), readonly=True, max_dbs=16)
+    db = env.open_db(db_name.encode("utf-8"), create=False) if db_name else None
+
+    # Resume after the last key written by a previous run
+    resumed = False
+    if cursor_file and cursor_file.exists():
+        after = cursor_file.read_text(encoding="utf-8").strip() or after
+        resumed = True
+    start_after = after.encode("utf-8") if after else None
+
+    exported = skipped = 0
+    with _open_output(output, append=resumed) as out:
+        for batch in _iter_pages(env, db, start_after, page):
+            for key, value, target in batch:
+                if db is None and key.startswith(HASH_LOOKUP_PREFIX):
+                    # Hash mappings follow the conversation record they point to
+                    if target is None or not record_filter.match_key(value):
+                        continue
+                    if not record_filter.match_record(orjson.loads(target)):
+                        continue
+                else:
+                    if not record_filter.match_key(key):
+                        continue
+                    try:
+                        record = orjson.loads(value)
+                    except orjson.JSONDecodeError:
+                        if db is None:
+                            # Records of named sub-databases are not conversations
+                            skipped += 1
+                            continue
+                        record = None
+                    if db is None and not record_filter.match_record(record):
+                        continue
+
+                if line := _encode_line(key, value):
+                    out.write(line)
+                    exported += 1
+
+            out.flush()
+            if cursor_file:
+                cursor_file.write_text(batch[-1][0].decode("utf-8"), encoding="utf-8")
+
+    env.close()
+    if skipped:
+        print(f"Skipped {skipped} non-conversation records", file=sys.stderr)
+    print(f"Exported {exported} records", file=sys.stderr)
+    return exported
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stream LMDB records as JSONL")
+    parser.add_argument("path", type=Path, help="Path to LMDB directory")
+    parser.add_argument(
+        "-o", "--output", default="-", help="Output file, gzip compressed if it ends with .gz"
+    )
+    parser.add_argument("--db", help="Export a named sub-database instead of conversations")
+    parser.add_argument("--prefix", default="", help="Only export keys with this prefix")
+    parser.add_argument("--start", help="Only export keys greater than or equal to this key")
+    parser.add_argument("--end", help="Only export keys lower than this key")
+    parser.add_argument(
+        "--since",
+        type=_parse_time,
+        help="Only export records updated since, e.g. 7d or an ISO date",
+    )
+    parser.add_argument(
+        "--until",
+        type=_parse_time,
+        help="Only export records updated before, e.g. 1d or an ISO date",
+    )
+    parser.add_argument("--after", help="Resume the export after this key")
+    parser.add_argument(
+        "--cursor-file",
+        type=Path,
+        help="File recording the last exported key, used to resume an interrupted export",
+    )
+    parser.add_argument("--page", type=int, default=1000, help="Records read per transaction")
+    args = parser.parse_args()
+
+    record_filter = RecordFilter(args.prefix, args.start, args.end, args.since, args.until)
+    export_lmdb(
+        args.path,
+        args.output,
+        db_name=args.db,
+        record_filter=record_filter,
+        after=args.after,
+        cursor_file=args.cursor_file,
+        page=args.page,
+    )
+
+
+if __name__ == "__main__":
+    main()
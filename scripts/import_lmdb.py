@@ -0,0 +1,129 @@
+import argparse
+import gzip
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple
+
+import lmdb
+import orjson
+
+
+@contextmanager
+def _open_input(source: str) -> Iterator[IO[bytes]]:
+    """Open the input file, decompressed with gzip when its name ends with '.gz'."""
+    if source == "-":
+        yield sys.stdin.buffer
+        return
+    handle = gzip.open(source, "rb") if source.endswith(".gz") else open(source, "rb")
+    try:
+        yield handle
+    finally:
+        handle.close()
+
+
+def _decode_line(line: bytes) -> Tuple[bytes, bytes]:
+    """Convert a JSONL line written by export_lmdb.py back into a key-value pair."""
+    record = orjson.loads(line)
+    key = record["key"].encode("utf-8")
+    if "raw" in record:
+        return key, record["raw"].encode("utf-8")
+    return key, orjson.dumps(record["value"])
+
+
+def _write_batch(
+    env: lmdb.Environment, db: Optional[object], batch: List[Tuple[bytes, bytes]], overwrite: bool
+) -> int:
+    """Write a batch in a single transaction, growing the map when the store is full."""
+    while True:
+        try:
+            written = 0
+            with env.begin(write=True, db=db) as txn:
+                for key, value in batch:
+                    written += txn.put(key, value, overwrite=overwrite)
+            return written
+        except lmdb.MapFullError:
+            map_size = env.info()["map_size"] * 2
+            env.set_mapsize(map_size)
+            print(f"Map full, grown to {map_size} bytes", file=sys.stderr)
+
+
+def import_lmdb(
+    path: Path,
+    source: str,
+    db_name: Optional[str] = None,
+    batch_size: int = 10000,
+    map_size: int = 134217728,
+    overwrite: bool = True,
+) -> int:
+    """
+    Load a JSONL export into the main database, or into a named sub-database.
+
+    Lines are read one at a time and written in large transactions of `batch_size`
+    records, so that memory use does not depend on the size of the export.
+
+    Returns:
+        int: The number of written records
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    env = lmdb.open(
+        str(path), map_size=map_size, max_dbs=16, writemap=True, readahead=False, meminit=False
+    )
+    db = env.open_db(db_name.encode("utf-8")) if db_name else None
+
+    read = written = 0
+    batch: List[Tuple[bytes, bytes]] = []
+    with _open_input(source) as src:
+        for number, line in enumerate(src, start=1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(_decode_line(line))
+            except (orjson.JSONDecodeError, KeyError, AttributeError) as e:
+                print(f"Skipping invalid line {number}: {e}", file=sys.stderr)
+                continue
+
+            read += 1
+            if len(batch) >= batch_size:
+                written += _write_batch(env, db, batch, overwrite)
+                batch = []
+
+        if batch:
+            written += _write_batch(env, db, batch, overwrite)
+
+    env.sync()
+    env.close()
+    print(f"Imported {written} of {read} records", file=sys.stderr)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load a JSONL export into LMDB")
+    parser.add_argument("path", type=Path, help="Path to LMDB directory, created if missing")
+    parser.add_argument(
+        "input", nargs="?", default="-", help="JSONL file, gzip compressed if it ends with .gz"
+    )
+    parser.add_argument("--db", help="Import into a named sub-database")
+    parser.add_argument(
+        "--batch-size", type=int, default=10000, help="Records written per transaction"
+    )
+    parser.add_argument(
+        "--map-size", type=int, default=134217728, help="Initial LMDB map size in bytes"
+    )
+    parser.add_argument(
+        "--no-overwrite", action="store_true", help="Keep the existing value of duplicate keys"
+    )
+    args = parser.parse_args()
+
+    import_lmdb(
+        args.path,
+        args.input,
+        db_name=args.db,
+        batch_size=args.batch_size,
+        map_size=args.map_size,
+        overwrite=not args.no_overwrite,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,29 @@ from typing import Any
 import lmdb
 import orjson
 
+HASH_LOOKUP_PREFIX = b"hash:"
+
+# Summaries of the conversations, kept in sync with the main database
+CONVERSATION_META_DB = b"conversation_meta"
+# Attachments by digest, the number of conversations referring to each, and last accesses
+BLOB_DB = b"blobs"
+BLOB_REF_DB = b"blob_refs"
+ACCESS_DB = b"last_access"
+
+# Named sub-databases of LMDBConversationStore, whose names are keys of the main database
+SUB_DATABASES = {
+    b"client_state",
+    b"batches",
+    b"batch_inputs",
+    b"batch_results",
+    CONVERSATION_META_DB,
+    b"changes",
+    b"peer_cursors",
+    BLOB_DB,
+    BLOB_REF_DB,
+    ACCESS_DB,
+}
+
 
 def _parse_duration(value: str) -> timedelta:
     """Parse duration in the format '14d' or '24h'."""
@@ -28,13 +51,41 @@ def _should_delete(record: dict[str, Any], threshold: datetime) -> bool:
     return ts < threshold
 
 
+def _open_db(env: lmdb.Environment, name: bytes) -> Any:
+    """Open a named sub-database, or return None if the store has none."""
+    try:
+        return env.open_db(name, create=False)
+    except lmdb.NotFoundError:
+        return None
+
+
+def _release_blobs(txn: lmdb.Transaction, digests: list[str], blob_db: Any, ref_db: Any) -> None:
+    """Drop one reference to attachments, deleting those no conversation refers to."""
+    for digest in digests:
+        key = digest.encode("utf-8")
+        refs = int(txn.get(key, db=ref_db) or 0) - 1
+        if refs > 0:
+            txn.put(key, str(refs).encode("utf-8"), db=ref_db)
+        else:
+            txn.delete(key, db=ref_db)
+            txn.delete(key, db=blob_db)
+
+
 def rotate_lmdb(path: Path, keep: str) -> None:
     """Remove records older than the specified duration."""
-    env = lmdb.open(str(path), writemap=True, readahead=False, meminit=False)
+    env = lmdb.open(str(path), max_dbs=16, writemap=True, readahead=False, meminit=False)
+    meta_db = _open_db(env, CONVERSATION_META_DB)
+    blob_db, ref_db = _open_db(env, BLOB_DB), _open_db(env, BLOB_REF_DB)
+    access_db = _open_db(env, ACCESS_DB)
+
     if keep == "all":
         with env.begin(write=True) as txn:
-            cursor = txn.cursor()
-            for key, _ in cursor:
+            for db in (meta_db, blob_db, ref_db, access_db):
+                if db is not None:
+                    txn.drop(db, delete=False)
+            # Deleting the record of a named sub-database fails the whole transaction
+            keys = [key for key in txn.cursor().iternext(values=False) if key not in SUB_DATABASES]
+            for key in keys:
                 txn.delete(key)
         env.close()
         return
@@ -43,14 +94,39 @@ def rotate_lmdb(path: Path, keep: str) -> None:
     threshold = datetime.now() - delta
 
     with env.begin(write=True) as txn:
-        cursor = txn.cursor()
-        for key, value in cursor:
+        expired = set()
+        for key, value in txn.cursor():
+            if key in SUB_DATABASES or key.startswith(HASH_LOOKUP_PREFIX):
+                continue
             try:
                 record = orjson.loads(value)
             except orjson.JSONDecodeError:
                 continue
-            if _should_delete(record, threshold):
-                txn.delete(key)
+            if isinstance(record, dict) and _should_delete(record, threshold):
+                expired.add(key)
+
+        # Clean up like the server deletes a conversation: attachments, summary and access
+        for key in expired:
+            if meta_db is not None:
+                summary = orjson.loads(txn.get(key, db=meta_db) or b"{}")
+                if blob_db is not None and ref_db is not None:
+                    _release_blobs(txn, summary.get("blobs", []), blob_db, ref_db)
+                txn.delete(key, db=meta_db)
+            if access_db is not None:
+                txn.delete(key, db=access_db)
+            txn.delete(key)
+
+        # Hash mappings, aliases included, that resolved to a deleted conversation
+        cursor = txn.cursor()
+        stale = []
+        if cursor.set_range(HASH_LOOKUP_PREFIX):
+            for key, value in cursor:
+                if not key.startswith(HASH_LOOKUP_PREFIX):
+                    break
+                if value in expired:
+                    stale.append(key)
+        for key in stale:
+            txn.delete(key)
     env.close()
 
 
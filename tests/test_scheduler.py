@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app.services.scheduler import FairScheduler
+from app.utils.singleton import Singleton
+
+
+@pytest.fixture
+def scheduler():
+    Singleton._instances.pop(FairScheduler, None)
+    yield FairScheduler(capacity=1)
+    Singleton._instances.pop(FairScheduler, None)
+
+
+def test_cancel_queued_request_in_the_same_step_as_a_release(scheduler):
+    async def scenario():
+        holder = scheduler.slot("a")
+        await holder.__aenter__()
+
+        async def queued():
+            async with scheduler.slot("b"):
+                pass
+
+        task = asyncio.create_task(queued())
+        await asyncio.sleep(0)
+        assert scheduler._tenants["b"].waiters
+
+        # The queued request is cancelled, and the slot released before it gets to run
+        task.cancel()
+        await holder.__aexit__(None, None, None)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert scheduler._in_flight == 0
+        assert not scheduler._tenants["b"].waiters
+        async with scheduler.slot("c"):
+            assert scheduler._in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_slot_granted_to_the_next_live_waiter(scheduler):
+    async def scenario():
+        holder = scheduler.slot("a")
+        await holder.__aenter__()
+        served = []
+
+        async def queued(name):
+            async with scheduler.slot(name):
+                served.append(name)
+
+        cancelled = asyncio.create_task(queued("b"))
+        live = asyncio.create_task(queued("c"))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        await holder.__aexit__(None, None, None)
+        await live
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        assert served == ["c"]
+        assert scheduler._in_flight == 0
+
+    asyncio.run(scenario())
@@ -1,12 +1,22 @@
+import os
+
+# 冷启动优化: 客户端在首次使用时才初始化, 必须在导入 app 之前设置
+os.environ.setdefault("CONFIG_GEMINI__LAZY_INIT", "true")
+
 from app.main import create_app
-from app.utils import setup_logging, g_config
+from app.utils import g_config, setup_logging
 
 # 初始化日志
-setup_logging(level=g_config.logging.level)
+setup_logging(
+    level=g_config.logging.level,
+    access_log=g_config.logging.access_log,
+    capture=g_config.logging.capture,
+)
 
-# 创建应用实例
+# 创建应用实例, 热启动时复用已初始化的客户端
 app = create_app()
 
+
 # Vercel 需要的导出
 def handler(event, context):
-    return app 
\ No newline at end of file
+    return app